@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+HTML Parsing Benchmark
+- Compare full-page parsing with the targeted parsing of parse_module
+- Report parse time per page and peak memory for each saved fixture
+- Check that both ways extract the same result
+
+The fixtures in benchmarks/fixtures are reduced copies of the pages the
+scrapers read: they keep the structure the selectors rely on, surrounded by
+the navigation, scripts and sidebars real pages carry.
+
+Usage:
+    python benchmarks/bench_parse.py [--repeat N] [--parser lxml|html.parser]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+from typing import Callable, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from parse_module import (  # noqa: E402
+    AZLYRICS_LYRICS,
+    AZLYRICS_RESULTS,
+    GENIUS_LYRICS,
+    GENIUS_RESULTS,
+    HTML_PARSER,
+    SPTODAY_RATES,
+    parse,
+    select,
+    select_one,
+)
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def _sptoday_full(markup: bytes, parser: str) -> str:
+    """Extract the sp-today rates from a fully parsed page."""
+    soup = BeautifulSoup(markup, parser)
+    return _sptoday_extract(soup)
+
+
+def _sptoday_targeted(markup: bytes, parser: str) -> str:
+    """Extract the sp-today rates from the reduced parse tree."""
+    return _sptoday_extract(parse(markup, SPTODAY_RATES, parser))
+
+
+def _sptoday_extract(soup: BeautifulSoup) -> str:
+    """Collect the fields get_rates_from_sptoday reads."""
+    names = [item.find("span", class_="name").text for item in soup.find_all("div", class_="item-data")]
+    table = soup.find("table", class_="local-cur")
+    return "|".join(names) + "|" + table.get_text()
+
+
+# (fixture, full-page extraction, targeted extraction)
+CASES: List[Tuple[str, Callable[[bytes, str], str], Callable[[bytes, str], str]]] = [
+    (
+        "azlyrics_search.html",
+        lambda m, p: BeautifulSoup(m, p).select("td.text-left a")[0]["href"],
+        lambda m, p: select(m, AZLYRICS_RESULTS, p)[0]["href"],
+    ),
+    (
+        "azlyrics_lyrics.html",
+        lambda m, p: BeautifulSoup(m, p).find("div", class_=None, id=None, attrs={"style": None}).get_text(),
+        lambda m, p: select_one(m, AZLYRICS_LYRICS, p).get_text(),
+    ),
+    (
+        "genius_search.html",
+        lambda m, p: BeautifulSoup(m, p).select("a.mini_card")[0]["href"],
+        lambda m, p: select(m, GENIUS_RESULTS, p)[0]["href"],
+    ),
+    (
+        "genius_lyrics.html",
+        lambda m, p: BeautifulSoup(m, p).select_one('div[class*="Lyrics__Container"]').get_text("\n"),
+        lambda m, p: select_one(m, GENIUS_LYRICS, p).get_text("\n"),
+    ),
+    ("sptoday_dollar.html", _sptoday_full, _sptoday_targeted),
+]
+
+
+def measure(func: Callable[[bytes, str], str], markup: bytes, parser: str, repeat: int) -> Tuple[float, int, str]:
+    """
+    Time an extraction and measure its peak memory.
+
+    Returns:
+        Tuple of (best seconds per page, peak bytes, extracted result)
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(markup, parser)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(markup, parser)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def main() -> None:
+    """Run every case and print a comparison table."""
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--repeat", type=int, default=10, help="timing runs per case (best is reported)")
+    arg_parser.add_argument("--parser", default=HTML_PARSER, help="BeautifulSoup tree builder")
+    args = arg_parser.parse_args()
+
+    print(f"parser: {args.parser}")
+    print(f"{'fixture':24} {'KB':>5} {'full ms':>8} {'target ms':>9} {'speedup':>7} "
+          f"{'full MB':>8} {'target MB':>9} {'saved':>6}")
+    for name, full, targeted in CASES:
+        with open(os.path.join(FIXTURES, name), "rb") as f:
+            markup = f.read()
+        full_time, full_peak, full_result = measure(full, markup, args.parser, args.repeat)
+        fast_time, fast_peak, fast_result = measure(targeted, markup, args.parser, args.repeat)
+        if full_result != fast_result:
+            raise SystemExit(f"{name}: targeted parsing extracted a different result")
+        print(f"{name:24} {len(markup) // 1024:5d} {full_time * 1000:8.1f} {fast_time * 1000:9.1f} "
+              f"{full_time / fast_time:6.1f}x {full_peak / 2**20:8.1f} {fast_peak / 2**20:9.1f} "
+              f"{1 - fast_peak / full_peak:6.0%}")
+
+
+if __name__ == "__main__":
+    main()
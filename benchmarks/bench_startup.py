@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Bot Startup Benchmark
+- Cold start of bot.py to its first handled update
+- Latency of the first reply that needs a feature module (/qrgen)
+- Peak and current RSS once the bot is idle
+
+Every run starts a fresh interpreter that builds the application with
+bot.build_application() and a fake Bot API request object, so no network or
+token is needed: getUpdates hands out a /start update, then a /qrgen
+conversation, and the replies the bot sends are timed. The modes are:
+
+    eager    every feature module imported before the bot (the old bot.py)
+    lazy     feature modules imported on first use, no pre-warming
+    prewarm  lazy, plus the background pre-warm after startup
+
+Usage:
+    python benchmarks/bench_startup.py [--runs N] [--idle SECONDS] [--modes eager,lazy,prewarm]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import statistics
+import subprocess
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What the old bot.py imported at the top
+EAGER_MODULES = (
+    "qr_module", "youtube_module", "lyrics_module", "image_module", "encoder_module",
+    "decode_module", "rates_module", "history_module", "http_module",
+)
+HEAVY_LIBRARIES = ("cv2", "numpy", "PIL", "yt_dlp", "bs4", "requests", "qrcode")
+RESULT_PREFIX = "BENCH_RESULT "
+CHAT = {"id": 1, "type": "private"}
+USER = {"id": 1, "is_bot": False, "first_name": "Bench"}
+
+
+def _rss_mb() -> float:
+    """Current resident set size of this process in MB."""
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+class FakeTelegram:
+    """Bot API state shared by the request objects of one benchmark run."""
+
+    def __init__(self, started: float, idle: float):
+        self.started = started
+        self.idle = idle
+        self.application = None
+        self.updates: List[Dict[str, Any]] = []
+        self.update_id = 0
+        self.message_id = 0
+        self.times: Dict[str, float] = {}
+        self.rss: Dict[str, float] = {}
+        self.push("/start")
+
+    def push(self, text: str) -> None:
+        """Queue a private text message as the next update."""
+        self.update_id += 1
+        message = {"message_id": self.update_id, "date": int(time.time()), "chat": CHAT, "from": USER, "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        self.updates.append({"update_id": self.update_id, "message": message})
+
+    def mark(self, name: str) -> None:
+        """Record the time since process start of a milestone, once."""
+        if name not in self.times:
+            self.times[name] = time.time() - self.started
+            self.rss[name] = _rss_mb()
+
+    def sent(self, method: str) -> Dict[str, Any]:
+        """Handle a message the bot sent and return it as Telegram would."""
+        self.message_id += 1
+        message = {"message_id": self.message_id, "date": int(time.time()), "chat": CHAT}
+        if method == "sendPhoto":
+            message["photo"] = [{"file_id": f"photo-{self.message_id}", "file_unique_id": f"u{self.message_id}",
+                                 "width": 256, "height": 256}]
+            self.mark("first_feature_reply")
+            asyncio.get_running_loop().call_later(self.idle, self.stop)
+        else:
+            message["text"] = "ok"
+            if "first_update" not in self.times:
+                self.mark("first_update")
+                self.push("/qrgen")
+                self.push("benchmark")
+        return message
+
+    def stop(self) -> None:
+        self.rss["idle"] = _rss_mb()
+        self.application.stop_running()
+
+
+def _fake_request(telegram: FakeTelegram):
+    """Create a BaseRequest that answers Bot API calls from a FakeTelegram."""
+    from telegram.request import BaseRequest
+
+    class FakeRequest(BaseRequest):
+        @property
+        def read_timeout(self) -> Optional[float]:
+            return 5.0
+
+        async def initialize(self) -> None:
+            pass
+
+        async def shutdown(self) -> None:
+            pass
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None) -> Tuple[int, bytes]:
+            endpoint = url.rsplit("/", 1)[-1]
+            if endpoint == "getMe":
+                result: Any = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+            elif endpoint == "getUpdates":
+                if not telegram.updates:
+                    await asyncio.sleep(0.02)
+                result, telegram.updates = telegram.updates, []
+            elif endpoint.startswith("send"):
+                result = telegram.sent(endpoint)
+            else:
+                result = True
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    return FakeRequest()
+
+
+def child(mode: str, idle: float) -> None:
+    """Run the bot once and print the measurements as JSON."""
+    started = float(os.environ["BENCH_STARTED"])
+    sys.path.insert(0, ROOT)
+    if mode == "eager":
+        import importlib
+        for module_name in EAGER_MODULES:
+            importlib.import_module(module_name)
+
+    import bot
+
+    telegram = FakeTelegram(started, idle)
+    telegram.application = bot.build_application(
+        token="123456:benchmark", request=_fake_request(telegram), get_updates_request=_fake_request(telegram)
+    )
+    telegram.mark("built")
+    telegram.application.run_polling(allowed_updates=bot.ALLOWED_UPDATES, close_loop=False)
+
+    print(RESULT_PREFIX + json.dumps({
+        "times": telegram.times,
+        "rss": telegram.rss,
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "libraries": [name for name in HEAVY_LIBRARIES if name in sys.modules],
+    }), flush=True)
+
+
+def run(mode: str, idle: float, prewarm_delay: float, verbose: bool) -> Dict[str, Any]:
+    """Start one child process and return its measurements."""
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as data_dir:
+        env = dict(
+            os.environ,
+            PREWARM_FEATURES="all" if mode == "prewarm" else "none",
+            PREWARM_DELAY=str(prewarm_delay),
+            JOB_DB=os.path.join(data_dir, "jobs.sqlite3"),
+            FILE_ID_DB=os.path.join(data_dir, "file_ids.sqlite3"),
+            LYRICS_DB=os.path.join(data_dir, "lyrics.sqlite3"),
+            RATES_HISTORY_LOG=os.path.join(data_dir, "rates_history.bin"),
+            STATE_DB=os.path.join(data_dir, "state.sqlite3"),
+            BENCH_STARTED=repr(time.time()),
+        )
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", mode, "--idle", str(idle)],
+            env=env, cwd=ROOT, stdout=subprocess.PIPE, stderr=None if verbose else subprocess.DEVNULL,
+            text=True, timeout=120 + idle,
+        ).stdout
+    for line in output.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise SystemExit(f"{mode}: the bot exited without a result")
+
+
+def main() -> None:
+    """Run every mode and print a comparison table."""
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--runs", type=int, default=3, help="cold starts per mode (median is reported)")
+    arg_parser.add_argument("--idle", type=float, default=8.0, help="seconds to stay idle before measuring RSS")
+    arg_parser.add_argument("--prewarm-delay", type=float, default=2.0, help="PREWARM_DELAY of the prewarm mode")
+    arg_parser.add_argument("--modes", default="eager,lazy,prewarm", help="comma separated modes to run")
+    arg_parser.add_argument("--verbose", action="store_true", help="show the bot's log output")
+    arg_parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.child:
+        child(args.child, args.idle)
+        return
+
+    print(f"{'mode':8} {'build ms':>9} {'1st update ms':>13} {'1st /qrgen ms':>13} "
+          f"{'RSS@1st MB':>10} {'idle MB':>8} {'peak MB':>8}  libraries at idle")
+    for mode in args.modes.split(","):
+        results = [run(mode, args.idle, args.prewarm_delay, args.verbose) for _ in range(args.runs)]
+
+        def median(key: str, field: str = "times") -> float:
+            return statistics.median(result[field][key] for result in results)
+
+        print(f"{mode:8} {median('built') * 1000:9.0f} {median('first_update') * 1000:13.0f} "
+              f"{median('first_feature_reply') * 1000:13.0f} {median('first_update', 'rss'):10.1f} "
+              f"{median('idle', 'rss'):8.1f} {statistics.median(r['peak_rss'] for r in results):8.1f}  "
+              f"{','.join(results[-1]['libraries']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,10 +11,13 @@ Features:
 """
 
 import os
+import asyncio
 import logging
-import tempfile
+from functools import partial
+from typing import Optional
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -24,13 +27,23 @@ from telegram.ext import (
     filters,
     ConversationHandler,
 )
+from telegram.request import BaseRequest
 
-# Import custom modules
-from qr_module import generate_qr_code, read_qr_code
-from youtube_module import search_youtube, download_youtube_audio
-from lyrics_module import get_lyrics
-from image_module import process_image
-from dollar import get_rates_from_sptoday
+# Load environment variables before the modules below read their settings
+load_dotenv()
+
+# Import custom modules; the feature modules (OpenCV, yt-dlp, BeautifulSoup,
+# NumPy, PIL) are registered below and imported on first use
+from features_module import FEATURES, PREWARM_DELAY, prewarm_names
+from fileid_module import FileIdRegistry, file_id_of
+from executor_module import PoolBusyError, run_in_pool, shutdown_pools
+from jobqueue_module import DownloadJob, DownloadJobQueue
+from storage_module import STORAGE
+from health_module import start_prober, stop_prober
+from webhook_module import BOT_MODE, CONCURRENT_UPDATES, run_webhook, use_api_server
+from persistence_module import SQLitePersistence, SharedStateApplication
+from scaleout_module import SCALE_WORKERS, Dispatcher, is_primary, serve_worker, worker_index
+from session_module import SESSIONS, SESSION_SWEEP_INTERVAL, SESSION_TTL
 
 
 # Enable logging
@@ -39,15 +52,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-
 # Get the bot token from environment variables
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
-# Create temp directory if it doesn't exist
-TEMP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "temp")
-os.makedirs(TEMP_DIR, exist_ok=True)
+# Update types the handlers below react to; Telegram sends no others
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
 
 # Define conversation states
 (
@@ -59,6 +68,113 @@ os.makedirs(TEMP_DIR, exist_ok=True)
     WAITING_FOR_IMAGE,
 ) = range(6)
 
+# Feature modules, in the order they are pre-warmed after startup
+FEATURES.register("youtube", "youtube_module")
+FEATURES.register("rates", "rates_module")
+FEATURES.register("history", "history_module")
+FEATURES.register("lyrics", "lyrics_module")
+FEATURES.register("decode", "decode_module")
+FEATURES.register("qr", "qr_module")
+FEATURES.register("encoder", "encoder_module")
+FEATURES.register("image", "image_module")
+# Shared HTTP client, loaded by the lyrics and rates features
+FEATURES.register("http", "http_module")
+
+# Registry of file_ids Telegram returned for results we already uploaded
+FILE_IDS = FileIdRegistry()
+
+async def send_known(key, send) -> bool:
+    """
+    Send a result by the file_id Telegram assigned it when it was first uploaded.
+
+    Args:
+        key: Content key of the result, or None if it cannot be identified
+        send: Coroutine function send(media, kind, title) returning the sent Message
+
+    Returns:
+        True if the result was sent, False if it has to be uploaded
+    """
+    # SQLite may wait for a lock, so the registry is used off the event loop
+    entry = await asyncio.to_thread(FILE_IDS.get, key) if key else None
+    if entry is None:
+        return False
+    try:
+        await send(entry.file_id, entry.kind, entry.title)
+        return True
+    except BadRequest as e:
+        logger.warning(f"Stored file_id for {key} was rejected: {e}")
+        await asyncio.to_thread(FILE_IDS.forget, key)
+        return False
+
+async def send_media(key, send, produce) -> None:
+    """
+    Send a result, re-using Telegram's file_id when it was uploaded before.
+
+    Args:
+        key: Content key of the result, or None if it cannot be identified
+        send: Coroutine function send(media, kind, title) returning the sent Message
+        produce: Coroutine function returning (media, kind, title) for a fresh upload
+    """
+    if await send_known(key, send):
+        return
+
+    media, kind, title = await produce()
+    message = await send(media, kind, title)
+    sent = file_id_of(message)
+    if key and sent is not None:
+        await asyncio.to_thread(FILE_IDS.put, key, sent.kind, sent.file_id, title)
+
+# Persistent queue of /download jobs, started with the application
+DOWNLOAD_QUEUE = DownloadJobQueue()
+
+async def audio_key(url: str):
+    """Return the content key of the audio downloaded from a YouTube URL."""
+    youtube = await FEATURES.load("youtube")
+    video_id = youtube.extract_video_id(url)
+    return f"audio:{video_id}:{youtube.DEFAULT_AUDIO_TIER}" if video_id else None
+
+def audio_sender(bot, chat_id: int):
+    """Return a send(media, kind, title) coroutine function for songs."""
+    async def send(audio, kind, title):
+        # Send the audio file
+        return await bot.send_audio(
+            chat_id=chat_id,
+            audio=audio,
+            title=title,
+            caption=f"Downloaded: {title}"
+        )
+    return send
+
+async def request_download(bot, chat_id: int, user_id: int, url: str) -> None:
+    """Send a song right away if it was uploaded before, otherwise queue its download."""
+    if await send_known(await audio_key(url), audio_sender(bot, chat_id)):
+        return
+
+    youtube = await FEATURES.load("youtube")
+    job_id = await DOWNLOAD_QUEUE.submit(chat_id, user_id, url, youtube.DEFAULT_AUDIO_TIER)
+    ahead = await DOWNLOAD_QUEUE.position(job_id)
+    if ahead:
+        await bot.send_message(
+            chat_id=chat_id,
+            text=f"Your download is queued ({ahead} ahead of it). Send /cancel to stop it."
+        )
+
+async def deliver_download(bot, job: DownloadJob, file_path: str, title: str) -> None:
+    """Upload a finished download job to its chat."""
+    youtube = await FEATURES.load("youtube")
+
+    async def produce():
+        # The file belongs to the audio cache, so it is read but not removed
+        with open(file_path, "rb") as f:
+            audio = InputFile(f.read(), filename=f"{title}.{youtube.audio_extension(file_path)}")
+        return audio, "audio", title
+
+    await send_media(await audio_key(job.url), audio_sender(bot, job.chat_id), produce)
+
+async def report_download_failure(bot, job: DownloadJob, error: str) -> None:
+    """Tell a chat that its download job failed."""
+    await bot.send_message(chat_id=job.chat_id, text=f"Error downloading song: {error}")
+
 # Command handlers
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
@@ -72,6 +188,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "/lyrics - Get lyrics for a song\n"
         "/enhance - Enhance an image quality\n"
         "/dollar - Dollar Price in Syria\n"
+        "/dollar history [day|week|month] - Chart of recent rates\n"
         "/help - Show this help message"
     )
 
@@ -85,6 +202,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "/lyrics - Get lyrics for a song\n"
         "/enhance - Enhance an image quality\n"
         "/dollar - Dollar Price in Syria\n"
+        "/dollar history [day|week|month] - Chart of recent rates\n"
         "/help - Show this help message"
     )
 
@@ -103,14 +221,21 @@ async def qr_gen_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     await update.message.reply_text(f"Generating QR code for: {text}")
     
     try:
-        # Generate QR code
-        qr_image = generate_qr_code(text)
-        
-        # Send the QR code image
-        await update.message.reply_photo(
-            photo=qr_image,
-            caption=f"QR code for: {text}"
-        )
+        qr = await FEATURES.load("qr")
+
+        async def produce():
+            # Generate QR code
+            qr_image = await run_in_pool("qr", qr.generate_qr_code, text)
+            return qr_image, "photo", ""
+
+        async def send(photo, kind, title):
+            # Send the QR code image
+            return await update.message.reply_photo(
+                photo=photo,
+                caption=f"QR code for: {text}"
+            )
+
+        await send_media(f"qr:{qr.qr_content_key(text)}", send, produce)
         await update.message.reply_text("QR code generated successfully!")
     except Exception as e:
         logger.error(f"Error generating QR code: {e}")
@@ -133,15 +258,26 @@ async def qr_read_image(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     photo = update.message.photo[-1]
     
     try:
+        qr = await FEATURES.load("qr")
+        decode = await FEATURES.load("decode")
+
         # Download the photo
         file = await context.bot.get_file(photo.file_id)
         image_bytes = await file.download_as_bytearray()
         
         # Read QR code
-        qr_text = read_qr_code(image_bytes)
+        image_bytes = bytes(image_bytes)
+        with decode.admit(image_bytes):
+            qr_texts = await run_in_pool("qr", qr.read_qr_codes, image_bytes)
         
         # Send the decoded text
-        await update.message.reply_text(f"QR code content: {qr_text}")
+        if len(qr_texts) == 1:
+            await update.message.reply_text(f"QR code content: {qr_texts[0]}")
+        else:
+            await update.message.reply_text(
+                f"Found {len(qr_texts)} QR codes:\n\n" +
+                "\n".join(f"{i+1}. {text}" for i, text in enumerate(qr_texts))
+            )
     except Exception as e:
         logger.error(f"Error reading QR code: {e}")
         await update.message.reply_text(f"Error reading QR code: {e}")
@@ -163,23 +299,14 @@ async def download_song(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     
     # Check if input is a URL
     if user_input.startswith("http://") or user_input.startswith("https://"):
-        context.user_data["youtube_url"] = user_input
         await update.message.reply_text(f"Downloading song from URL: {user_input}")
         
         try:
-            # Download the song
-            file_path, title = download_youtube_audio(user_input)
-            
-            # Send the audio file
-            await update.message.reply_audio(
-                audio=open(file_path, "rb"),
-                title=title,
-                caption=f"Downloaded: {title}"
+            # Download the song unless it was uploaded before
+            await request_download(
+                context.bot, update.effective_chat.id, update.effective_user.id, user_input
             )
             
-            # Clean up
-            os.remove(file_path)
-            
         except Exception as e:
             logger.error(f"Error downloading song: {e}")
             await update.message.reply_text(f"Error downloading song: {e}")
@@ -189,21 +316,22 @@ async def download_song(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         # Search for the song
         try:
             await update.message.reply_text(f"Searching for: {user_input}")
-            search_results = search_youtube(user_input)
+            youtube = await FEATURES.load("youtube")
+            search_results = await run_in_pool("search", youtube.search_youtube, user_input)
             
             if not search_results:
                 await update.message.reply_text(f"No results found for: {user_input}")
                 return ConversationHandler.END
             
-            # Store search results in context
-            context.user_data["search_results"] = search_results
+            # Keep compact search results until the user picks one
+            search_results = SESSIONS.put_results(context.user_data, update.effective_user.id, search_results)
             
             # Create inline keyboard with search results
             keyboard = []
             for i, result in enumerate(search_results):
                 keyboard.append([
                     InlineKeyboardButton(
-                        f"{i+1}. {result['title']} ({result['uploader']})",
+                        f"{i+1}. {result.title} ({result.uploader})",
                         callback_data=f"download_{i}"
                     )
                 ])
@@ -233,30 +361,20 @@ async def download_song_selection(update: Update, context: ContextTypes.DEFAULT_
     index = int(data.split("_")[1])
     
     # Get the selected song URL
-    search_results = context.user_data.get("search_results", [])
+    search_results = SESSIONS.results(context.user_data, update.effective_user.id)
     if not search_results or index >= len(search_results):
         await query.edit_message_text("Invalid selection or search results expired.")
         return ConversationHandler.END
     
     selected_song = search_results[index]
-    url = selected_song["url"]
+    url = selected_song.url
+    SESSIONS.end(context.user_data, update.effective_user.id)
     
-    await query.edit_message_text(f"Downloading: {selected_song['title']}")
+    await query.edit_message_text(f"Downloading: {selected_song.title}")
     
     try:
-        # Download the song
-        file_path, title = download_youtube_audio(url)
-        
-        # Send the audio file
-        await context.bot.send_audio(
-            chat_id=update.effective_chat.id,
-            audio=open(file_path, "rb"),
-            title=title,
-            caption=f"Downloaded: {title}"
-        )
-        
-        # Clean up
-        os.remove(file_path)
+        # Download the song unless it was uploaded before
+        await request_download(context.bot, update.effective_chat.id, update.effective_user.id, url)
         
     except Exception as e:
         logger.error(f"Error downloading song: {e}")
@@ -283,7 +401,8 @@ async def lyrics_song(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     
     try:
         # Get lyrics
-        lyrics = get_lyrics(song_name)
+        lyrics_feature = await FEATURES.load("lyrics")
+        lyrics = await lyrics_feature.find_lyrics(song_name)
         
         # Check if lyrics are too long for a single message
         if len(lyrics) > 4000:
@@ -320,20 +439,42 @@ async def enhance_image(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     photo = update.message.photo[-1]
     
     try:
-        # Download the photo
-        file = await context.bot.get_file(photo.file_id)
-        image_bytes = await file.download_as_bytearray()
-        
-        await update.message.reply_text("Enhancing image... This may take a moment.")
-        
-        # Process the image
-        enhanced_image = process_image(image_bytes, enhance=True, upscale=True, scale_factor=1.5)
-        
-        # Send the enhanced image
-        await update.message.reply_photo(
-            photo=enhanced_image,
-            caption="Enhanced image"
-        )
+        image = await FEATURES.load("image")
+        encoder = await FEATURES.load("encoder")
+        decode = await FEATURES.load("decode")
+
+        async def produce():
+            # Download the photo
+            file = await context.bot.get_file(photo.file_id)
+            image_bytes = await file.download_as_bytearray()
+
+            await update.message.reply_text("Enhancing image... This may take a moment.")
+
+            # Process the image
+            image_bytes = bytes(image_bytes)
+            with decode.admit(image_bytes, scale_factor=1.5):
+                enhanced_image = await run_in_pool(
+                    "image", image.process_image, image_bytes, enhance=True, upscale=True, scale_factor=1.5
+                )
+
+            # Send as a document if it exceeds the photo limits
+            kind = "document" if encoder.should_send_as_document(enhanced_image) else "photo"
+            return enhanced_image, kind, ""
+
+        async def send(media, kind, title):
+            # Send the enhanced image
+            if kind == "document":
+                return await update.message.reply_document(
+                    document=media,
+                    caption="Enhanced image"
+                )
+            return await update.message.reply_photo(
+                photo=media,
+                caption="Enhanced image"
+            )
+
+        # The same upload processed with the same settings gives the same result
+        await send_media(f"enhance:{photo.file_unique_id}:1.5", send, produce)
         
     except Exception as e:
         logger.error(f"Error enhancing image: {e}")
@@ -342,24 +483,99 @@ async def enhance_image(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     return ConversationHandler.END
 
 
-async def dollar_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Fetch and send the dollar exchange rate."""
-    try:
-        rates = get_rates_from_sptoday()
-        # await update.message.reply_text(rates)
-        await update.message.reply_text(get_rates_from_sptoday())
+def refresh_and_record():
+    """Refresh the rate snapshot and add it to the history (blocking)."""
+    snapshot = FEATURES.get("rates").RATES.refresh()
+    FEATURES.get("history").rate_history().record_snapshot(snapshot)
+    return snapshot
+
+def follow_rates():
+    """Load the rate snapshot and history the primary worker stored (blocking)."""
+    FEATURES.get("rates").RATES.sync()
+    FEATURES.get("history").rate_history().sync()
 
+async def refresh_rates(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Refresh the dollar rate snapshot; runs on the JobQueue."""
+    try:
+        await run_in_pool("dollar", refresh_and_record)
     except Exception as e:
-        logger.error(f"Error fetching dollar rate: {e}")
-        await update.message.reply_text("Failed to fetch dollar rates. Please try again later.")
-        
+        logger.warning(f"Could not refresh dollar rates: {e}")
+
+async def sweep_sessions(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Expire abandoned sessions; runs on the JobQueue."""
+    await SESSIONS.sweep()
+
+async def dollar_history(update: Update, period: str) -> None:
+    """Send the cached rate chart of a period."""
+    history_feature = await FEATURES.load("history")
+    if period not in history_feature.PERIODS:
+        await update.message.reply_text(f"Usage: /dollar history [{'|'.join(history_feature.PERIODS)}]")
+        return
+
+    history = history_feature.rate_history()
+    if not is_primary():
+        await asyncio.to_thread(follow_rates)
+    chart = history.cached_chart(period)
+    if chart is None:
+        # Rendering runs in its own pool: the "dollar" pool may be busy scraping rates
+        try:
+            chart = await run_in_pool("history", history.chart, period)
+        except PoolBusyError as e:
+            await update.message.reply_text(str(e))
+            return
+    if chart is None:
+        await update.message.reply_text("Not enough rate history yet. Please try again later.")
+        return
+
+    # Every chart version is uploaded once; later requests send its file_id
+    file_id = history.file_id(period, chart.version)
+    message = await update.message.reply_photo(
+        photo=file_id or InputFile(chart.png, filename=f"rates-{period}.png"),
+        caption=f"Damascus rates, last {period}",
+    )
+    if file_id is None and message.photo:
+        history.remember_file_id(period, chart.version, message.photo[-1].file_id)
+
+async def dollar_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send the dollar exchange rate from the latest snapshot, or its history chart."""
+    if context.args and context.args[0].lower() == "history":
+        period = context.args[1].lower() if len(context.args) > 1 else "day"
+        await dollar_history(update, period)
+        return
+
+    rates = (await FEATURES.load("rates")).RATES
+    if not is_primary():
+        # Only the primary worker fetches rates; read the snapshot it stored
+        await asyncio.to_thread(follow_rates)
+        if rates.snapshot is None:
+            await update.message.reply_text("Failed to fetch dollar rates. Please try again later.")
+        else:
+            await update.message.reply_text(rates.render(rates.snapshot))
+        return
 
+    snapshot = rates.snapshot
+    # Without a background refresher (or before its first run) fetch on demand
+    if snapshot is None or (context.job_queue is None and rates.is_stale(snapshot)):
+        try:
+            snapshot = await run_in_pool("dollar", refresh_and_record)
+        except Exception as e:
+            logger.error(f"Error fetching dollar rate: {e}")
+            if snapshot is None:
+                await update.message.reply_text("Failed to fetch dollar rates. Please try again later.")
+                return
+
+    await update.message.reply_text(rates.render(snapshot))
 
 
 # Cancel conversation
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Cancel the current conversation."""
-    await update.message.reply_text("Operation cancelled.")
+    """Cancel the current conversation and any download of the user."""
+    SESSIONS.end(context.user_data, update.effective_user.id)
+    stopped = await DOWNLOAD_QUEUE.cancel_user(update.effective_user.id)
+    if stopped:
+        await update.message.reply_text(f"Operation cancelled. Stopped {stopped} download(s).")
+    else:
+        await update.message.reply_text("Operation cancelled.")
     return ConversationHandler.END
 
 # Error handler
@@ -373,10 +589,91 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     except:
         pass
 
-def main() -> None:
-    """Start the bot."""
+# Background task loading the features after startup
+_warm_up_task: Optional[asyncio.Task] = None
+
+async def warm_up(application: Application) -> None:
+    """Load the features in the background once the bot is serving updates."""
+    await asyncio.sleep(PREWARM_DELAY)
+
+    # The dollar rates are refreshed whether or not features are pre-warmed,
+    # by the primary worker only; the others read the snapshot it stores
+    if is_primary():
+        rates = await FEATURES.load("rates")
+        if application.job_queue is not None:
+            application.job_queue.run_repeating(
+                refresh_rates, interval=rates.REFRESH_INTERVAL, first=0, name="dollar-rates"
+            )
+        else:
+            logger.warning("JobQueue is not available; dollar rates are fetched on demand")
+
+    names = prewarm_names(FEATURES)
+    await FEATURES.prewarm(names)
+    if "youtube" in names:
+        await run_in_pool("search", FEATURES.get("youtube").warm_up_search)
+
+async def on_startup(application: Application) -> None:
+    """Start the download workers and warm up slow-to-create resources."""
+    STORAGE.start_janitor()
+    start_prober()
+    await DOWNLOAD_QUEUE.start(
+        deliver=partial(deliver_download, application.bot),
+        fail=partial(report_download_failure, application.bot),
+    )
+    SESSIONS.bind(application)
+    if application.job_queue is not None:
+        application.job_queue.run_repeating(sweep_sessions, interval=SESSION_SWEEP_INTERVAL, name="session-sweep")
+    # Not Application.create_task: the application is not running yet, and
+    # the task is cancelled explicitly on shutdown
+    global _warm_up_task
+    _warm_up_task = asyncio.create_task(warm_up(application))
+
+async def on_shutdown(application: Application) -> None:
+    """Stop the download workers and release the feature pools."""
+    if _warm_up_task is not None:
+        _warm_up_task.cancel()
+    await DOWNLOAD_QUEUE.stop()
+    shutdown_pools()
+    # Only features that were loaded have anything to release
+    if FEATURES.is_loaded("rates"):
+        FEATURES.get("rates").RATES.close()
+    if FEATURES.is_loaded("http"):
+        FEATURES.get("http").HTTP.close()
+    stop_prober()
+    STORAGE.stop_janitor()
+
+def build_application(
+    token: Optional[str] = None,
+    request: Optional[BaseRequest] = None,
+    get_updates_request: Optional[BaseRequest] = None,
+) -> Application:
+    """
+    Create the Application with every handler registered.
+
+    Args:
+        token: Bot token, defaults to TELEGRAM_BOT_TOKEN
+        request: Request object for Bot API calls (e.g. a fake one in benchmarks)
+        get_updates_request: Request object for getUpdates
+
+    Returns:
+        The Application, not started yet
+    """
     # Create the Application
-    application = Application.builder().token(TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(token or TOKEN)
+        .application_class(SharedStateApplication)
+        .persistence(SQLitePersistence(conversation_ttl=SESSION_TTL))
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    builder = use_api_server(builder)
+    if request is not None:
+        builder = builder.request(request)
+    if get_updates_request is not None:
+        builder = builder.get_updates_request(get_updates_request)
+    application = builder.build()
 
     # Add command handlers
     application.add_handler(CommandHandler("start", start))
@@ -384,52 +681,67 @@ def main() -> None:
     
     # QR Code Generation conversation handler
     qr_gen_handler = ConversationHandler(
+        name="qr_gen",
+        persistent=True,
         entry_points=[CommandHandler("qrgen", qr_gen_start)],
         states={
             WAITING_FOR_QR_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, qr_gen_text)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=SESSION_TTL,
     )
     application.add_handler(qr_gen_handler)
     
     # QR Code Reading conversation handler
     qr_read_handler = ConversationHandler(
+        name="qr_read",
+        persistent=True,
         entry_points=[CommandHandler("qrread", qr_read_start)],
         states={
             WAITING_FOR_QR_IMAGE: [MessageHandler(filters.PHOTO, qr_read_image)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=SESSION_TTL,
     )
     application.add_handler(qr_read_handler)
     
     # YouTube Download conversation handler
     download_handler = ConversationHandler(
+        name="download",
+        persistent=True,
         entry_points=[CommandHandler("download", download_start)],
         states={
             WAITING_FOR_SONG_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, download_song)],
             WAITING_FOR_SONG_URL: [CallbackQueryHandler(download_song_selection, pattern=r"^download_\d+$")],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=SESSION_TTL,
     )
     application.add_handler(download_handler)
     
     # Lyrics Extraction conversation handler
     lyrics_handler = ConversationHandler(
+        name="lyrics",
+        persistent=True,
         entry_points=[CommandHandler("lyrics", lyrics_start)],
         states={
             WAITING_FOR_LYRICS_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, lyrics_song)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=SESSION_TTL,
     )
     application.add_handler(lyrics_handler)
     
     # Image Enhancement conversation handler
     enhance_handler = ConversationHandler(
+        name="enhance",
+        persistent=True,
         entry_points=[CommandHandler("enhance", enhance_start)],
         states={
             WAITING_FOR_IMAGE: [MessageHandler(filters.PHOTO, enhance_image)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=SESSION_TTL,
     )
     application.add_handler(enhance_handler)
 
@@ -437,12 +749,30 @@ def main() -> None:
     # Dollar rate handler (simple command, no conversation needed)
     application.add_handler(CommandHandler("dollar", dollar_start))
 
+    # /cancel outside a conversation still stops queued and running downloads
+    application.add_handler(CommandHandler("cancel", cancel))
+
     
     # Add error handler
     application.add_error_handler(error_handler)
+    return application
+
+def main() -> None:
+    """Start the bot."""
+    if SCALE_WORKERS > 1 and worker_index() is None:
+        # Receive the updates here and hand them to worker processes running this script
+        application = Dispatcher().build_application(TOKEN, configure=use_api_server)
+    else:
+        application = build_application()
+        if worker_index() is not None:
+            serve_worker(application)
+            return
 
     # Run the bot until the user presses Ctrl-C
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if BOT_MODE == "webhook":
+        run_webhook(application, ALLOWED_UPDATES)
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == "__main__":
     main()
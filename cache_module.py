@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Cache Module for Telegram Bot
+- Size-bounded in-memory LRU cache for encoded results
+- Size-bounded on-disk LRU store with atomic writes
+"""
+
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(*parts: object) -> str:
+    """Build a stable cache key from any number of parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class DiskLRUStore:
+    """
+    A directory of cached files, evicted least-recently-used first.
+
+    Files are written to a temporary name in the same directory and then
+    renamed into place, so readers never see a partially written entry.
+    The modification time of a file is its last use. Each entry may carry a
+    small JSON metadata sidecar, which is removed together with the entry.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, suffix: str = ""):
+        """
+        Args:
+            directory: Directory holding the cached files
+            max_bytes: Total size the store may occupy
+            suffix: Extension appended to every cached file name
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._total = sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        """Yield (path, size, mtime) for every cached file."""
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(self.suffix) and not entry.name.startswith("."):
+                stat = entry.stat()
+                yield entry.path, stat.st_size, stat.st_mtime
+
+    def path_for(self, key: str) -> str:
+        """Return the path a key is (or would be) stored at."""
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def _meta_path(self, path: str) -> str:
+        """Return the metadata sidecar path of a cached file."""
+        directory, name = os.path.split(path)
+        return os.path.join(directory, f".{name}.json")
+
+    def get_meta(self, key: str) -> Dict[str, Any]:
+        """Return the metadata stored with a key, or an empty dict."""
+        try:
+            with open(self._meta_path(self.path_for(key)), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get_path(self, key: str) -> Optional[str]:
+        """
+        Look up a cached file and mark it as recently used.
+
+        Returns:
+            The file path, or None if the key is not cached
+        """
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        """Return the cached content for a key, or None."""
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put_bytes(self, key: str, data: bytes, meta: Optional[Dict[str, Any]] = None) -> str:
+        """Atomically store bytes under a key and return the file path."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return self._commit(key, tmp_path, meta)
+
+    def put_file(self, key: str, src_path: str, meta: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Atomically move an existing file into the store and return its new path.
+
+        The source should be on the same filesystem as the store; otherwise it
+        is copied to a temporary file first.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        os.close(fd)
+        try:
+            try:
+                os.replace(src_path, tmp_path)
+            except OSError:
+                # Different filesystem: copy, then remove the source
+                with open(src_path, "rb") as src, open(tmp_path, "wb") as dst:
+                    while True:
+                        chunk = src.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                os.unlink(src_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return self._commit(key, tmp_path, meta)
+
+    def set_meta(self, key: str, meta: Dict[str, Any]) -> None:
+        """Atomically replace the metadata of a key without rewriting its content."""
+        self._write_meta(self.path_for(key), meta)
+
+    def _write_meta(self, path: str, meta: Dict[str, Any]) -> None:
+        """Write the metadata sidecar of a cached file through a temporary file."""
+        fd, tmp_meta = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_meta, self._meta_path(path))
+
+    def _commit(self, key: str, tmp_path: str, meta: Optional[Dict[str, Any]]) -> str:
+        """Rename a finished temporary file into place and enforce the quota."""
+        path = self.path_for(key)
+        size = os.path.getsize(tmp_path)
+        if meta is not None:
+            # The sidecar goes in first, so a visible entry always has its metadata
+            self._write_meta(path, meta)
+        with self._lock:
+            try:
+                old_size = os.path.getsize(path)
+            except FileNotFoundError:
+                old_size = 0
+            os.replace(tmp_path, path)
+            self._total += size - old_size
+        self.evict(keep=path)
+        return path
+
+    def delete(self, key: str) -> None:
+        """Remove a key from the store if present."""
+        path = self.path_for(key)
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.unlink(path)
+                self._total -= size
+            except FileNotFoundError:
+                pass
+            self._unlink_meta(path)
+
+    def _unlink_meta(self, path: str) -> None:
+        """Remove the metadata sidecar of a cached file, if any."""
+        try:
+            os.unlink(self._meta_path(path))
+        except FileNotFoundError:
+            pass
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """
+        Delete least-recently-used files until the store fits its quota.
+
+        Args:
+            keep: A path that must not be evicted (e.g. the entry just written)
+
+        Returns:
+            The number of bytes freed
+        """
+        with self._lock:
+            if self._total <= self.max_bytes:
+                return 0
+            freed = 0
+            for path, size, _ in sorted(self._entries(), key=lambda item: item[2]):
+                if self._total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    continue
+                self._unlink_meta(path)
+                self._total -= size
+                freed += size
+            if freed:
+                logger.info(f"Evicted {freed} bytes from {self.directory}")
+            return freed
+
+    @property
+    def total_bytes(self) -> int:
+        """Bytes currently stored."""
+        with self._lock:
+            return self._total
+
+
+class ByteLRUCache:
+    """
+    An in-memory LRU cache of byte strings, bounded by their total size.
+
+    An optional DiskLRUStore acts as a second tier: memory misses are looked
+    up on disk, and every new entry is also written to disk, so entries
+    survive restarts.
+    """
+
+    def __init__(self, max_bytes: int, disk: Optional[DiskLRUStore] = None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached bytes for a key, or None on a miss."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        if self.disk is not None:
+            value = self.disk.get_bytes(key)
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._insert(key, value)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: bytes) -> None:
+        """Store bytes under a key in memory and, if configured, on disk."""
+        self._insert(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.put_bytes(key, value)
+            except OSError as e:
+                logger.warning(f"Could not write cache entry to disk: {e}")
+
+    def _insert(self, key: str, value: bytes) -> None:
+        """Insert into the memory tier and evict down to max_bytes."""
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit, miss and size counters."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Image Decoding Module for Telegram Bot
+- Decode uploaded images under a per-job and a global memory budget
+- Use reduced JPEG decoding when full resolution is not needed
+- Reject other formats whose full frame does not fit the budget (no tiled decoding)
+"""
+
+import os
+import threading
+import cv2
+import numpy as np
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Iterator, Optional, Tuple
+from PIL import Image
+
+_MB = 1024 * 1024
+
+# Largest decoded frame a single job may hold, and the total for all jobs
+JOB_MAX_BYTES = int(os.getenv("DECODE_JOB_MAX_MB", "192")) * _MB
+GLOBAL_MAX_BYTES = int(os.getenv("DECODE_GLOBAL_MAX_MB", "512")) * _MB
+
+# Rough peak working set per decoded pixel, in units of the decoded frame:
+# source frame, result frame and PIL intermediates for the enhancement chain
+PEAK_FRAME_COPIES = 4
+
+_BANDS = {"1": 1, "L": 1, "P": 1, "LA": 2, "RGB": 3, "YCbCr": 3, "CMYK": 4, "RGBA": 4}
+
+
+class MemoryBudgetExceeded(RuntimeError):
+    """Raised when an image cannot be decoded within the memory budget."""
+
+
+class MemoryBudget:
+    """
+    A byte counter shared by concurrent jobs.
+
+    Reservations never block: if the budget is used up the caller gets an
+    error right away, the same way a full feature pool rejects new jobs.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._used = 0
+        self._lock = threading.Lock()
+
+    @property
+    def used(self) -> int:
+        """Bytes currently reserved."""
+        with self._lock:
+            return self._used
+
+    @contextmanager
+    def reserve(self, nbytes: int) -> Iterator[None]:
+        """
+        Reserve nbytes for the duration of a with-block.
+
+        Raises:
+            MemoryBudgetExceeded: If the reservation does not fit
+        """
+        with self._lock:
+            if self._used + nbytes > self.limit:
+                raise MemoryBudgetExceeded(
+                    "Too many large images are being processed right now. Please try again in a moment."
+                )
+            self._used += nbytes
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._used -= nbytes
+
+
+GLOBAL_BUDGET = MemoryBudget(GLOBAL_MAX_BYTES)
+
+
+def probe(image_data: bytes) -> Tuple[Optional[str], int, int, int]:
+    """
+    Read an image header without decoding any pixels.
+
+    Args:
+        image_data: Image data as bytes
+
+    Returns:
+        Tuple of (format, width, height, bands)
+
+    Raises:
+        MemoryBudgetExceeded: If the header trips PIL's decompression bomb guard
+    """
+    with _open(image_data) as img:
+        width, height = img.size
+        return img.format, width, height, _BANDS.get(img.mode, 4)
+
+
+def _open(image_data: bytes) -> Image.Image:
+    """Open an image lazily, reporting PIL's decompression bomb guard as a budget error."""
+    try:
+        return Image.open(BytesIO(image_data))
+    except Image.DecompressionBombError as exc:
+        raise MemoryBudgetExceeded("This image is too large to process.") from exc
+
+
+def _too_large(fmt: Optional[str]) -> MemoryBudgetExceeded:
+    """Build the error for an image whose decoded frame does not fit the per-job budget."""
+    if fmt == "JPEG":
+        return MemoryBudgetExceeded("This image is too large to process.")
+    # Only JPEG can be reduced while decoding
+    return MemoryBudgetExceeded("This image is too large to process. Please send it as a JPEG or at a lower resolution.")
+
+
+def _job_bytes(width: int, height: int, bands: int, scale_factor: float) -> int:
+    """Estimate the peak bytes of a job working on a decoded frame of this size."""
+    return int(width * height * bands * PEAK_FRAME_COPIES * max(1.0, scale_factor) ** 2)
+
+
+def _reduction_for(width: int, height: int, bands: int, max_side: Optional[int],
+                   scale_factor: float = 1.0) -> int:
+    """
+    Pick the smallest JPEG reduction (1, 2, 4 or 8) that fits the per-job budget.
+
+    Args:
+        width: Full image width
+        height: Full image height
+        bands: Number of colour bands
+        max_side: Longest side the task needs, or None for full resolution
+        scale_factor: Output scale of the job
+
+    Returns:
+        The reduction factor
+    """
+    for factor in (1, 2, 4, 8):
+        w, h = -(-width // factor), -(-height // factor)
+        fits_task = max_side is None or max(w, h) < 2 * max_side or factor == 8
+        fits_budget = _job_bytes(w, h, bands, scale_factor) <= JOB_MAX_BYTES
+        if fits_task and fits_budget:
+            return factor
+    return 8
+
+
+def estimate_job_bytes(image_data: bytes, scale_factor: float = 1.0, max_side: Optional[int] = None) -> int:
+    """
+    Estimate the peak memory a job needs for an image, from its header only.
+
+    Args:
+        image_data: Image data as bytes
+        scale_factor: Output scale of the job (e.g. 1.5 for an upscale)
+        max_side: Longest side the task needs, or None for full resolution
+
+    Returns:
+        Estimated peak bytes
+    """
+    fmt, width, height, bands = probe(image_data)
+    factor = _reduction_for(width, height, bands, max_side, scale_factor) if fmt == "JPEG" else 1
+    return _job_bytes(-(-width // factor), -(-height // factor), bands, scale_factor)
+
+
+@contextmanager
+def admit(image_data: bytes, scale_factor: float = 1.0, max_side: Optional[int] = None) -> Iterator[int]:
+    """
+    Reserve the global budget for one image job.
+
+    Used by the bot around each image job, so the limit holds even when the
+    work itself runs in a separate process.
+
+    Yields:
+        The number of bytes reserved
+    """
+    nbytes = estimate_job_bytes(image_data, scale_factor, max_side)
+    if nbytes > GLOBAL_BUDGET.limit:
+        raise MemoryBudgetExceeded("This image is too large to process.")
+    with GLOBAL_BUDGET.reserve(nbytes):
+        yield nbytes
+
+
+def open_image(image_data: bytes, max_side: Optional[int] = None, scale_factor: float = 1.0) -> Image.Image:
+    """
+    Open an image, decoding at reduced resolution when allowed and needed.
+
+    JPEG images are decoded with Image.draft, which lets libjpeg scale by
+    1/2, 1/4 or 1/8 while decoding, so a huge photo never exists in memory at
+    full size. Other formats cannot be reduced while decoding and are
+    rejected when their full frame exceeds the per-job budget; there is no
+    tiled decoding for them. Photos sent to the bot always arrive as JPEG
+    (Telegram re-encodes them), so this only affects direct callers.
+
+    Args:
+        image_data: Image data as bytes
+        max_side: Longest side the task needs, or None for full resolution
+        scale_factor: Output scale of the job (e.g. 1.5 for an upscale)
+
+    Returns:
+        The loaded image; img.format still reports the source format
+
+    Raises:
+        MemoryBudgetExceeded: If the image cannot fit the per-job budget
+    """
+    img = _open(image_data)
+    width, height = img.size
+    bands = _BANDS.get(img.mode, 4)
+
+    if img.format == "JPEG":
+        factor = _reduction_for(width, height, bands, max_side, scale_factor)
+        if factor > 1:
+            img.draft(img.mode, (-(-width // factor), -(-height // factor)))
+        width, height = img.size
+
+    if _job_bytes(width, height, bands, scale_factor) > JOB_MAX_BYTES:
+        img.close()
+        raise _too_large(img.format)
+
+    img.load()
+    return img
+
+
+def imdecode(image_data: bytes, grayscale: bool = True, max_side: Optional[int] = None) -> np.ndarray:
+    """
+    Decode an image with OpenCV, using IMREAD_REDUCED_* flags when possible.
+
+    Args:
+        image_data: Image data as bytes
+        grayscale: Whether to decode a single grayscale channel
+        max_side: Longest side the task needs, or None for full resolution
+
+    Returns:
+        The decoded image as a numpy array
+
+    Raises:
+        MemoryBudgetExceeded: If the image cannot fit the per-job budget
+        ValueError: If the data is not a decodable image
+    """
+    fmt, width, height, _ = probe(image_data)
+    bands = 1 if grayscale else 3
+    factor = _reduction_for(width, height, bands, max_side) if fmt == "JPEG" else 1
+
+    if _job_bytes(-(-width // factor), -(-height // factor), bands, 1.0) > JOB_MAX_BYTES:
+        raise _too_large(fmt)
+
+    flags = {
+        (True, 1): cv2.IMREAD_GRAYSCALE,
+        (True, 2): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+        (True, 4): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+        (True, 8): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+        (False, 1): cv2.IMREAD_COLOR,
+        (False, 2): cv2.IMREAD_REDUCED_COLOR_2,
+        (False, 4): cv2.IMREAD_REDUCED_COLOR_4,
+        (False, 8): cv2.IMREAD_REDUCED_COLOR_8,
+    }[(grayscale, factor)]
+
+    img = cv2.imdecode(np.frombuffer(image_data, np.uint8), flags)
+    if img is None:
+        raise ValueError("Could not decode the image")
+    return img
@@ -1,58 +1,108 @@
-import requests
-from bs4 import BeautifulSoup
+from health_module import CircuitOpenError, register_source
+from http_module import http_get
+from parse_module import SPTODAY_RATES, parse
 
-def get_rates_from_sptoday():
-    url = "https://www.sp-today.com/currency/us_dollar"
-    headers = {
-        "User-Agent": "Mozilla/5.0"
-    }
+SPTODAY_URL = "https://www.sp-today.com/currency/us_dollar"
+SPTODAY_HEADERS = {
+    "User-Agent": "Mozilla/5.0"
+}
 
-    try:
-        response = requests.get(url, headers=headers)
-        soup = BeautifulSoup(response.content, "html.parser")
-
-        # أسعار عامة: دولار / يورو / تركي / غرام الذهب
-        general_targets = {
-            # "دولار دمشق": None,
-            "يورو دمشق": None,
-            "ل. تركية دمشق": None,
-            "غرام الذهب": None
-        }
-
-        for item in soup.find_all("div", class_="item-data"):
-            name = item.find("span", class_="name")
-            value = item.find("span", class_="value")
-            if name and value:
-                name_text = name.text.strip()
-                if name_text in general_targets:
-                    general_targets[name_text] = value.text.strip().replace(",", "")
-
-        # سعر الشراء والمبيع للدولار في دمشق
-        buy_price = sell_price = None
-        table = soup.find("table", class_="local-cur")
-        if table:
-            rows = table.find_all("tr")
-            for row in rows:
-                cell = row.find("span")
-                if cell and "دولار أمريكي دمشق" in cell.text:
-                    prices = row.find_all("strong")
-                    if len(prices) >= 3:
-                        buy_price = prices[1].text.strip()
-                        sell_price = prices[2].text.strip()
-                    break
-
-        # تجميع النتائج في سلسلة نصية
-        result = "\n💱 دولار دمشق :\n"
-
-        if buy_price and sell_price:
-            result += f"شراء: {buy_price} SYP, "
-            result += f"مبيع: {sell_price} SYP\n\n"
-
-        result += "📊 أسعار السوق في دمشق:\n"
-
-        for label, val in general_targets.items():
-            result += f"{label}: {val or 'غير متوفر'} SYP\n"
-        return result
 
+class RatesUnavailable(RuntimeError):
+    """Raised when the exchange rates could not be fetched or read."""
+
+
+def _fetch_sptoday(timeout):
+    response = http_get(SPTODAY_URL, headers=SPTODAY_HEADERS, timeout=timeout)
+    response.raise_for_status()
+    return response.content
+
+
+def _probe_sptoday(timeout):
+    # Bypass the HTTP cache: a cached page says nothing about whether sp-today is back
+    http_get(SPTODAY_URL, headers=SPTODAY_HEADERS, timeout=timeout, cache=False).raise_for_status()
+
+
+SPTODAY_HEALTH = register_source(
+    "sp-today",
+    max_timeout=10.0,
+    probe=_probe_sptoday,
+)
+
+
+def fetch_rates_from_sptoday():
+    """
+    Fetch and read the Damascus rates from sp-today.com.
+
+    Returns:
+        Dict with "buy" and "sell" (US dollar, or None) and "market"
+        (label -> value or None)
+
+    Raises:
+        CircuitOpenError: While sp-today keeps failing
+        RatesUnavailable: If the page could not be fetched or read
+    """
+    # Fails at once with CircuitOpenError while sp-today keeps failing
+    try:
+        content = SPTODAY_HEALTH.call(_fetch_sptoday)
+    except CircuitOpenError:
+        raise
     except Exception as e:
-        return f"❌ حدث خطأ أثناء جلب البيانات: {e}"
+        raise RatesUnavailable(f"Could not reach sp-today.com: {e}") from e
+
+    soup = parse(content, SPTODAY_RATES)
+
+    # أسعار عامة: دولار / يورو / تركي / غرام الذهب
+    general_targets = {
+        # "دولار دمشق": None,
+        "يورو دمشق": None,
+        "ل. تركية دمشق": None,
+        "غرام الذهب": None
+    }
+
+    for item in soup.find_all("div", class_="item-data"):
+        name = item.find("span", class_="name")
+        value = item.find("span", class_="value")
+        if name and value:
+            name_text = name.text.strip()
+            if name_text in general_targets:
+                general_targets[name_text] = value.text.strip().replace(",", "")
+
+    # سعر الشراء والمبيع للدولار في دمشق
+    buy_price = sell_price = None
+    table = soup.find("table", class_="local-cur")
+    if table:
+        rows = table.find_all("tr")
+        for row in rows:
+            cell = row.find("span")
+            if cell and "دولار أمريكي دمشق" in cell.text:
+                prices = row.find_all("strong")
+                if len(prices) >= 3:
+                    buy_price = prices[1].text.strip()
+                    sell_price = prices[2].text.strip()
+                break
+
+    if not (buy_price or any(general_targets.values())):
+        raise RatesUnavailable("sp-today.com returned no rates")
+
+    return {"buy": buy_price, "sell": sell_price, "market": general_targets}
+
+
+def format_rates(buy_price, sell_price, market):
+    # تجميع النتائج في سلسلة نصية
+    result = "\n💱 دولار دمشق :\n"
+
+    if buy_price and sell_price:
+        result += f"شراء: {buy_price} SYP, "
+        result += f"مبيع: {sell_price} SYP\n\n"
+
+    result += "📊 أسعار السوق في دمشق:\n"
+
+    for label, val in market.items():
+        result += f"{label}: {val or 'غير متوفر'} SYP\n"
+    return result
+
+
+def get_rates_from_sptoday():
+    rates = fetch_rates_from_sptoday()
+    return format_rates(rates["buy"], rates["sell"], rates["market"])
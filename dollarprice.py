@@ -1,18 +1,29 @@
+import os
 
-import http.client
-import json
-import requests
+from health_module import register_source
+from http_module import http_get
 
-def dollar():
+CURRENCYFREAKS_URL = "https://api.currencyfreaks.com/v2.0/rates/latest"
+EXCHANGERATE_API_URL = "https://v6.exchangerate-api.com/v6/{key}/latest/USD"
+
+
+def _get_json(url, timeout):
+    response = http_get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
 
-    conn = http.client.HTTPSConnection("api.currencyfreaks.com")
-    payload = ''
-    headers = {}
-    conn.request("GET", "https://api.currencyfreaks.com/v2.0/rates/latest?apikey=712082cb068b49129f14e8d3803cc5e9", payload, headers)
-    res = conn.getresponse()
-    data = res.read()
 
-    parsed = json.loads(data)
+CURRENCYFREAKS_HEALTH = register_source("currencyfreaks", max_timeout=10.0)
+EXCHANGERATE_API_HEALTH = register_source("exchangerate-api", max_timeout=10.0)
+
+
+def dollar():
+    # Official USD rates from currencyfreaks.com (key: CURRENCYFREAKS_API_KEY)
+    api_key = os.getenv("CURRENCYFREAKS_API_KEY")
+    if not api_key:
+        raise RuntimeError("CURRENCYFREAKS_API_KEY is not set")
+
+    parsed = CURRENCYFREAKS_HEALTH.call(_get_json, f"{CURRENCYFREAKS_URL}?apikey={api_key}")
     rates = parsed.get("rates", {})
     return {
         "SYP": rates.get("SYP"),
@@ -20,18 +31,13 @@ def dollar():
     }
 
 
-print(dollar())
-
-
-
 def price():
-    # Where USD is the base currency you want to use
-    url = "https://v6.exchangerate-api.com/v6/76b938a7b3b412f8c5bf5e50/latest/USD"
-
-    # Making our request
-    response = requests.get(url)
-    data = response.json()
+    # Official USD rates from exchangerate-api.com (key: EXCHANGERATE_API_KEY)
+    api_key = os.getenv("EXCHANGERATE_API_KEY")
+    if not api_key:
+        raise RuntimeError("EXCHANGERATE_API_KEY is not set")
 
+    data = EXCHANGERATE_API_HEALTH.call(_get_json, EXCHANGERATE_API_URL.format(key=api_key))
     rates = data.get("conversion_rates", {})
     return {
         "SYP": rates.get("SYP"),
@@ -39,5 +45,6 @@ def price():
     }
 
 
-print(price())
-	
\ No newline at end of file
+if __name__ == "__main__":
+    print(dollar())
+    print(price())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Image Encoding Module for Telegram Bot
+- Pick an output format and quality for processed images
+- Keep results under Telegram's photo limits
+"""
+
+import os
+from io import BytesIO
+from typing import Optional
+from PIL import Image
+
+# Telegram sendPhoto limits: 10 MB, width + height <= 10000, aspect ratio <= 20
+PHOTO_MAX_BYTES = 10 * 1024 * 1024
+PHOTO_MAX_DIMENSION_SUM = 10000
+PHOTO_MAX_ASPECT_RATIO = 20
+
+# "auto" keeps the source format family, or one of "jpeg", "webp", "png"
+OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "auto").lower()
+OUTPUT_QUALITY = int(os.getenv("IMAGE_OUTPUT_QUALITY", "90"))
+MIN_QUALITY = int(os.getenv("IMAGE_MIN_QUALITY", "60"))
+QUALITY_STEP = 10
+
+_EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png"}
+# Sources whose pixels are exact (screenshots, QR codes, drawings): kept lossless
+_LOSSLESS_FORMATS = {"PNG", "BMP", "TIFF", "GIF"}
+
+
+def _has_alpha(img: Image.Image) -> bool:
+    """Check whether an image carries transparency."""
+    return img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+
+
+def choose_format(img: Image.Image, source_format: Optional[str]) -> str:
+    """
+    Choose the output format for a processed image.
+
+    Args:
+        img: The processed image
+        source_format: Format of the uploaded image (e.g. "JPEG"), if known
+
+    Returns:
+        One of "JPEG", "WEBP" or "PNG"
+    """
+    if OUTPUT_FORMAT in ("jpeg", "jpg"):
+        return "PNG" if _has_alpha(img) else "JPEG"
+    if OUTPUT_FORMAT in ("webp", "png"):
+        return OUTPUT_FORMAT.upper()
+
+    # Automatic: lossy sources stay lossy, lossless ones lossless, transparency is preserved
+    source_format = (source_format or "").upper()
+    if source_format == "WEBP":
+        return "WEBP"
+    if source_format in _LOSSLESS_FORMATS or _has_alpha(img):
+        return "PNG"
+    return "JPEG"
+
+
+def _encode_once(img: Image.Image, fmt: str, quality: int) -> BytesIO:
+    """Encode an image once with the given format and quality."""
+    bio = BytesIO()
+    if fmt == "JPEG":
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(bio, format="JPEG", quality=quality)
+    elif fmt == "WEBP":
+        img.save(bio, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(bio, format="PNG", compress_level=6)
+    return bio
+
+
+def encode_image(img: Image.Image, source_format: Optional[str], name: str,
+                 max_bytes: int = PHOTO_MAX_BYTES) -> BytesIO:
+    """
+    Encode a processed image for sending, aiming to stay under max_bytes.
+
+    Lossy formats step their quality down from IMAGE_OUTPUT_QUALITY to
+    IMAGE_MIN_QUALITY until the result fits. If it still does not fit, the
+    smallest attempt is returned and should be sent as a document.
+
+    Args:
+        img: The processed image
+        source_format: Format of the uploaded image, if known
+        name: File name without extension
+        max_bytes: Target size in bytes
+
+    Returns:
+        Encoded image as BytesIO object, with a matching file name
+    """
+    fmt = choose_format(img, source_format)
+    quality = OUTPUT_QUALITY
+
+    bio = _encode_once(img, fmt, quality)
+    while fmt != "PNG" and bio.getbuffer().nbytes > max_bytes and quality > MIN_QUALITY:
+        quality = max(MIN_QUALITY, quality - QUALITY_STEP)
+        bio = _encode_once(img, fmt, quality)
+
+    bio.name = f"{name}.{_EXTENSIONS[fmt]}"
+    bio.seek(0)
+    return bio
+
+
+def should_send_as_document(bio: BytesIO) -> bool:
+    """
+    Check whether an encoded image exceeds Telegram's photo limits.
+
+    Args:
+        bio: Encoded image as BytesIO object
+
+    Returns:
+        True if the image has to be sent with send_document instead of send_photo
+    """
+    if bio.getbuffer().nbytes > PHOTO_MAX_BYTES:
+        return True
+
+    # Only the header is read to get the dimensions
+    position = bio.tell()
+    try:
+        with Image.open(bio) as img:
+            width, height = img.size
+    finally:
+        bio.seek(position)
+
+    if width + height > PHOTO_MAX_DIMENSION_SUM:
+        return True
+    return max(width, height) > PHOTO_MAX_ASPECT_RATIO * max(1, min(width, height))
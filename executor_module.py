@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Execution Module for Telegram Bot
+- Run blocking feature calls off the event loop
+- One bounded thread or process pool per feature
+- Single-flight deduplication of identical concurrent jobs
+"""
+
+import os
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class PoolBusyError(RuntimeError):
+    """Raised when a feature pool already holds its maximum number of jobs."""
+
+
+class FeaturePool:
+    """
+    A bounded executor for a single bot feature.
+
+    Every pool has its own worker limit and its own queue-depth limit, so a
+    backlog in one feature (e.g. slow YouTube downloads) never delays jobs
+    submitted to another feature.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int, kind: str = "thread"):
+        """
+        Args:
+            name: Feature name, used for logging and thread names
+            max_workers: Number of jobs that may run at the same time
+            max_queue: Number of jobs that may wait for a free worker
+            kind: "thread" for I/O-bound work, "process" for CPU-bound work
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def _get_executor(self) -> Executor:
+        """Create the underlying executor on first use."""
+        if self._executor is None:
+            if self.kind == "process":
+                # forkserver avoids forking a process that already runs the
+                # event loop and the thread pools of other features
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=f"{self.name}-pool",
+                )
+        return self._executor
+
+    def _run_tracked(self, func: Callable[..., Any], args: tuple, kwargs: dict) -> Any:
+        """Run a job inside a thread worker while keeping the counters in sync."""
+        with self._lock:
+            self._pending -= 1
+            self._running += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+
+    def _finish_untracked(self, _future) -> None:
+        """Update counters for a process job once its result is available."""
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Run a blocking function in this pool and await its result.
+
+        Args:
+            func: The blocking function to run
+            *args: Positional arguments for func
+            **kwargs: Keyword arguments for func
+
+        Returns:
+            Whatever func returns
+
+        Raises:
+            PoolBusyError: If the pool already holds max_workers + max_queue jobs
+        """
+        with self._lock:
+            if self._pending + self._running >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise PoolBusyError(
+                    f"The {self.name} service is busy right now. Please try again in a moment."
+                )
+            self._pending += 1
+
+        executor = self._get_executor()
+        if self.kind == "process":
+            # Process workers cannot update our counters, so a job counts as
+            # pending from submission until its result comes back.
+            future = executor.submit(func, *args, **kwargs)
+            future.add_done_callback(self._finish_untracked)
+            return await asyncio.wrap_future(future)
+
+        future = executor.submit(self._run_tracked, func, args, kwargs)
+        future.add_done_callback(self._finish_cancelled)
+        return await asyncio.wrap_future(future)
+
+    def _finish_cancelled(self, future) -> None:
+        """Release the queue slot of a thread job cancelled before it started."""
+        if future.cancelled():
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self) -> Dict[str, int]:
+        """Return a snapshot of the pool's queue-depth counters."""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "pending": self._pending,
+                "running": self._running,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self, wait: bool = False) -> None:
+        """Stop the underlying executor."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent calls that do the same work.
+
+    The first caller for a key starts the work; callers arriving while it is
+    still running wait on the same future and receive the same result (or
+    the same exception). The key is forgotten as soon as the work finishes.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, asyncio.Future] = {}
+        self.started = 0
+        self.shared = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run func once per key among concurrent callers.
+
+        Args:
+            key: Identifies the work, e.g. a YouTube video id
+            func: Coroutine function doing the work
+
+        Returns:
+            The result of the (shared) call
+        """
+        future = self._flights.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._flights[key] = future
+            future.add_done_callback(lambda _: self._flights.pop(key, None))
+            self.started += 1
+        else:
+            self.shared += 1
+        # A waiter that gets cancelled must not cancel the work for the others
+        return await asyncio.shield(future)
+
+    def in_flight(self) -> int:
+        """Return the number of keys currently being worked on."""
+        return len(self._flights)
+
+
+def _env_int(name: str, default: int) -> int:
+    """Read a positive integer from the environment."""
+    try:
+        return max(1, int(os.getenv(name, default)))
+    except ValueError:
+        logger.warning(f"Invalid value for {name}, using {default}")
+        return default
+
+
+# Default limits per feature: (kind, workers, queue)
+POOL_DEFAULTS = {
+    "youtube": ("thread", 2, 8),
+    "search": ("thread", 2, 16),
+    "lyrics": ("thread", 4, 16),
+    "image": ("process", 2, 4),
+    "qr": ("thread", 4, 16),
+    "dollar": ("thread", 1, 4),
+    "history": ("thread", 1, 4),
+}
+
+_pools: Dict[str, FeaturePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name: str) -> FeaturePool:
+    """
+    Return the pool for a feature, creating it from the environment on first use.
+
+    Limits can be overridden with POOL_<NAME>_WORKERS and POOL_<NAME>_QUEUE.
+    """
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            kind, workers, queue = POOL_DEFAULTS.get(name, ("thread", 2, 8))
+            prefix = f"POOL_{name.upper()}"
+            pool = FeaturePool(
+                name,
+                max_workers=_env_int(f"{prefix}_WORKERS", workers),
+                max_queue=_env_int(f"{prefix}_QUEUE", queue),
+                kind=os.getenv(f"{prefix}_KIND", kind),
+            )
+            _pools[name] = pool
+        return pool
+
+
+async def run_in_pool(name: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run a blocking function in the named feature pool."""
+    return await get_pool(name).run(func, *args, **kwargs)
+
+
+def pool_stats() -> Dict[str, Dict[str, int]]:
+    """Return queue-depth counters for every pool created so far."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.name: pool.stats() for pool in pools}
+
+
+def shutdown_pools(wait: bool = False) -> None:
+    """Shut down every feature pool."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=wait)
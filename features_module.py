@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Feature Loading Module for Telegram Bot
+- Feature modules registered by name and imported on first use
+- Imports run in a worker thread so the event loop keeps serving updates
+- Optional background pre-warming of every feature after startup
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import importlib
+import threading
+from types import ModuleType
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Features imported in the background after startup: "all", "none" or a
+# comma separated list of feature names
+PREWARM_FEATURES = os.getenv("PREWARM_FEATURES", "all")
+# Seconds to wait after startup before pre-warming, so the first updates are
+# not slowed down by imports competing for the interpreter
+PREWARM_DELAY = float(os.getenv("PREWARM_DELAY", "2"))
+
+
+class UnknownFeatureError(ValueError):
+    """Raised when a feature name was never registered."""
+
+
+class FeatureRegistry:
+    """
+    Maps feature names to the modules that implement them.
+
+    A module is imported the first time get() or load() asks for its
+    feature, so a bot process only pays for the libraries (OpenCV, yt-dlp,
+    BeautifulSoup, ...) of the features it actually uses. Each feature has
+    its own lock, so concurrent first uses import the module once.
+    """
+
+    def __init__(self):
+        self._modules: Dict[str, str] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._load_times: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, module_name: str) -> None:
+        """
+        Register a feature.
+
+        Args:
+            name: Feature name used by the handlers (e.g. "qr")
+            module_name: Module implementing it (e.g. "qr_module")
+        """
+        with self._lock:
+            self._modules[name] = module_name
+            self._locks.setdefault(name, threading.Lock())
+
+    def names(self) -> List[str]:
+        """Return the registered feature names in registration order."""
+        with self._lock:
+            return list(self._modules)
+
+    def _module_name(self, name: str) -> str:
+        with self._lock:
+            module_name = self._modules.get(name)
+        if module_name is None:
+            raise UnknownFeatureError(f"Unknown feature: {name}")
+        return module_name
+
+    def is_loaded(self, name: str) -> bool:
+        """Check whether the module of a feature was imported, by us or by another module."""
+        return self._module_name(name) in sys.modules
+
+    def get(self, name: str) -> ModuleType:
+        """
+        Return the module of a feature, importing it if needed (blocking).
+
+        Raises:
+            UnknownFeatureError: If the feature was never registered
+        """
+        module_name = self._module_name(name)
+        module = sys.modules.get(module_name)
+        if module is not None:
+            return module
+
+        with self._locks[name]:
+            module = sys.modules.get(module_name)
+            if module is not None:
+                return module
+            start = time.perf_counter()
+            module = importlib.import_module(module_name)
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._load_times[name] = elapsed
+            logger.info(f"Loaded feature {name} ({module_name}) in {elapsed:.2f}s")
+            return module
+
+    async def load(self, name: str) -> ModuleType:
+        """Return the module of a feature, importing it in a worker thread if needed."""
+        if self.is_loaded(name):
+            return sys.modules[self._module_name(name)]
+        return await asyncio.to_thread(self.get, name)
+
+    async def prewarm(self, names: Optional[Iterable[str]] = None, delay: float = 0.0) -> None:
+        """
+        Import features in the background, one at a time.
+
+        A feature that fails to import is logged and skipped; its handler
+        will report the error when it is used.
+
+        Args:
+            names: Features to import, defaults to every registered feature
+            delay: Seconds to wait before the first import
+        """
+        if delay > 0:
+            await asyncio.sleep(delay)
+        for name in list(names) if names is not None else self.names():
+            try:
+                await self.load(name)
+            except Exception as e:
+                logger.warning(f"Could not pre-warm feature {name}: {e}")
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        """Return whether each feature is loaded and how long its import took."""
+        with self._lock:
+            load_times = dict(self._load_times)
+        return {
+            name: {"loaded": self.is_loaded(name), "load_time": load_times.get(name)}
+            for name in self.names()
+        }
+
+
+def prewarm_names(registry: FeatureRegistry, setting: str = PREWARM_FEATURES) -> List[str]:
+    """Return the features selected by a PREWARM_FEATURES value."""
+    setting = setting.strip().lower()
+    if setting in ("", "none", "0", "false"):
+        return []
+    if setting == "all":
+        return registry.names()
+    wanted = [name.strip() for name in setting.split(",") if name.strip()]
+    return [name for name in registry.names() if name in wanted]
+
+
+FEATURES = FeatureRegistry()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File ID Registry Module for Telegram Bot
+- Remember the file_id Telegram returns for every uploaded result
+- Let repeat sends reference the uploaded file instead of uploading it again
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from typing import NamedTuple, Optional
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+FILE_ID_DB = os.getenv("FILE_ID_DB", os.path.join(DATA_DIR, "file_ids.sqlite3"))
+
+
+class FileIdEntry(NamedTuple):
+    """A file previously uploaded to Telegram."""
+    file_id: str
+    kind: str
+    title: str
+
+
+class FileIdRegistry:
+    """
+    A persistent mapping from content keys to Telegram file_ids.
+
+    Content keys describe what was sent, e.g. "audio:<video id>:<format>" or
+    "qr:<hash of text and parameters>", so the same result requested again by
+    any user can be re-sent with one API call and no upload.
+    """
+
+    def __init__(self, path: str = FILE_ID_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS file_ids (
+                    key TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    title TEXT NOT NULL DEFAULT '',
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    uses INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+
+    def get(self, key: str) -> Optional[FileIdEntry]:
+        """
+        Look up the uploaded file for a content key.
+
+        Returns:
+            The registry entry, or None if nothing was uploaded for this key
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT file_id, kind, title FROM file_ids WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE file_ids SET last_used = ?, uses = uses + 1 WHERE key = ?",
+                (time.time(), key),
+            )
+        return FileIdEntry(*row)
+
+    def put(self, key: str, kind: str, file_id: str, title: str = "") -> None:
+        """Record the file_id Telegram returned for a content key."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO file_ids (key, kind, file_id, title, created_at, last_used)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    kind = excluded.kind,
+                    file_id = excluded.file_id,
+                    title = excluded.title,
+                    last_used = excluded.last_used
+                """,
+                (key, kind, file_id, title, now, now),
+            )
+
+    def forget(self, key: str) -> None:
+        """Drop a content key, e.g. after Telegram rejected its file_id."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM file_ids WHERE key = ?", (key,))
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+def file_id_of(message) -> Optional[FileIdEntry]:
+    """
+    Extract the file_id and kind of the media in a sent Telegram message.
+
+    Args:
+        message: The telegram.Message returned by a send call
+
+    Returns:
+        A FileIdEntry without title, or None if the message has no media
+    """
+    if message.audio is not None:
+        return FileIdEntry(message.audio.file_id, "audio", message.audio.title or "")
+    if message.photo:
+        return FileIdEntry(message.photo[-1].file_id, "photo", "")
+    if message.document is not None:
+        return FileIdEntry(message.document.file_id, "document", "")
+    return None
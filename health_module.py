@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Source Health Module for Telegram Bot
+- Circuit breaker per external website
+- Timeouts that follow the recent latency of each website
+- Background probing of websites whose circuit is open
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+# Consecutive failures that open a circuit, and how long it stays open at first
+FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURES", "5"))
+COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "30"))
+MAX_COOLDOWN = 600.0
+# Seconds between background probe rounds
+PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "15"))
+
+# Adaptive timeout: LATENCY_PERCENTILE of recent successful calls times
+# TIMEOUT_MULTIPLIER, once at least MIN_SAMPLES calls were measured
+LATENCY_SAMPLES = 100
+MIN_SAMPLES = 10
+LATENCY_PERCENTILE = 0.95
+TIMEOUT_MULTIPLIER = 2.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when a source is skipped because its circuit is open."""
+
+
+class Attempt:
+    """
+    One call to a source whose outcome is recorded exactly once.
+
+    The deadline runs from start(), when the call begins, so time spent
+    waiting for a free worker does not count against the source. A caller
+    that stops waiting after the start abandons the attempt, which counts as
+    a failure; one that stops before the start cancels it, which does not.
+    Either way the call's own outcome, arriving later, is ignored, and a
+    call that had not started yet returns at once.
+    """
+
+    def __init__(self, health: "SourceHealth", timeout: float, on_start: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            health: Source the outcome is recorded for
+            timeout: Seconds the call may take once started
+            on_start: Called (in the calling thread) when the call starts
+        """
+        self.health = health
+        self.timeout = timeout
+        self.started_at: Optional[float] = None
+        self._on_start = on_start
+        self._settled = False
+        self._lock = threading.Lock()
+
+    def start(self) -> bool:
+        """Mark the call as started; return False if the attempt is already settled."""
+        with self._lock:
+            if self._settled:
+                return False
+            self.started_at = time.monotonic()
+        if self._on_start is not None:
+            self._on_start()
+        return True
+
+    def settle(self) -> bool:
+        """Mark the outcome as recorded; return False if it already was."""
+        with self._lock:
+            if self._settled:
+                return False
+            self._settled = True
+            return True
+
+    def abandon(self) -> None:
+        """Record the attempt as failed because its deadline passed."""
+        if self.settle():
+            self.health.record_failure()
+
+    def cancel(self) -> None:
+        """Give up on the attempt without counting it against the source."""
+        self.settle()
+
+
+class SourceHealth:
+    """
+    Health of one external source: a circuit breaker plus a latency window.
+
+    After FAILURE_THRESHOLD consecutive failures the circuit opens and every
+    call fails at once with CircuitOpenError, so a dead website does not hold
+    worker slots. If the source has a probe, the background prober checks it
+    after the cooldown and closes the circuit when it answers; without a
+    probe, the first call after the cooldown is let through as the trial.
+    Each failed trial doubles the cooldown, up to MAX_COOLDOWN.
+
+    The timeout of a call is derived from the recent latency of successful
+    calls, clamped to [min_timeout, max_timeout].
+    """
+
+    def __init__(self, name: str, max_timeout: float, min_timeout: float = 1.0,
+                 probe: Optional[Callable[[float], Any]] = None,
+                 expected: Tuple[Type[BaseException], ...] = ()):
+        """
+        Args:
+            name: Source name used in logs and errors
+            max_timeout: Longest timeout a call may get; also used until enough latencies are known
+            min_timeout: Shortest timeout a call may get
+            probe: Function (timeout) that raises if the source is still down
+            expected: Exceptions that are valid answers (e.g. "not found"), not failures
+        """
+        self.name = name
+        self.max_timeout = max_timeout
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.probe = probe
+        self.expected = expected
+        self._lock = threading.Lock()
+        self._latencies: "deque[float]" = deque(maxlen=LATENCY_SAMPLES)
+        self._state = CLOSED
+        self._failures = 0
+        self._cooldown = COOLDOWN
+        self._opened_at = 0.0
+        self.calls = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        """Current circuit state: closed, open or half_open."""
+        with self._lock:
+            return self._state
+
+    def timeout(self) -> float:
+        """Return the timeout for the next call, based on recent latencies."""
+        with self._lock:
+            if len(self._latencies) < MIN_SAMPLES:
+                return self.max_timeout
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * LATENCY_PERCENTILE))
+        return max(self.min_timeout, min(self.max_timeout, ordered[index] * TIMEOUT_MULTIPLIER))
+
+    def percentiles(self) -> Dict[str, float]:
+        """Return p50/p95 of recent successful calls in seconds (0 when unknown)."""
+        with self._lock:
+            ordered = sorted(self._latencies)
+        if not ordered:
+            return {"p50": 0.0, "p95": 0.0}
+        return {
+            "p50": ordered[len(ordered) // 2],
+            "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        }
+
+    def allow(self) -> bool:
+        """Check whether a call may go to the source right now."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and self.probe is None and time.monotonic() - self._opened_at >= self._cooldown:
+                # No prober for this source: this call is the trial
+                self._state = HALF_OPEN
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self, latency: Optional[float]) -> None:
+        """Record a successful call (latency None: not a regular call) and close the circuit."""
+        with self._lock:
+            if latency is not None:
+                self._latencies.append(latency)
+            self._failures = 0
+            if self._state != CLOSED:
+                logger.info(f"Source {self.name} recovered, closing its circuit")
+            self._state = CLOSED
+            self._cooldown = COOLDOWN
+
+    def record_failure(self) -> None:
+        """Record a failed call and open the circuit if the source keeps failing."""
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN:
+                self._cooldown = min(MAX_COOLDOWN, self._cooldown * 2)
+            elif self._state != CLOSED or self._failures < FAILURE_THRESHOLD:
+                return
+            self._state = OPEN
+            self._opened_at = time.monotonic()
+            logger.warning(f"Source {self.name} is failing, skipping it for {self._cooldown:.0f}s")
+
+    def call(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Call the source through the breaker, passing the adaptive timeout.
+
+        func is called as func(*args, timeout) and must give up after timeout
+        seconds.
+
+        Raises:
+            CircuitOpenError: If the circuit is open
+        """
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} is unavailable right now")
+        return self.measure(func, *args)
+
+    def attempt(self, on_start: Optional[Callable[[], None]] = None) -> Attempt:
+        """Create an attempt with the current adaptive timeout, for callers that enforce it themselves."""
+        return Attempt(self, self.timeout(), on_start)
+
+    def measure(self, func: Callable[..., Any], *args: Any, attempt: Optional[Attempt] = None) -> Any:
+        """
+        Call func(*args, timeout) and record the outcome, for callers that already checked allow().
+
+        With an attempt, its timeout is used and nothing is recorded if the
+        attempt was settled before func returned; if it was settled before
+        the call could start, func is not called and None is returned.
+        """
+        if attempt is not None and not attempt.start():
+            return None
+        with self._lock:
+            self.calls += 1
+        start = time.monotonic()
+        try:
+            result = func(*args, attempt.timeout if attempt is not None else self.timeout())
+        except self.expected:
+            if attempt is None or attempt.settle():
+                self.record_success(time.monotonic() - start)
+            raise
+        except Exception:
+            if attempt is None or attempt.settle():
+                self.record_failure()
+            raise
+        if attempt is None or attempt.settle():
+            self.record_success(time.monotonic() - start)
+        return result
+
+    def probe_due(self) -> bool:
+        """Check whether the prober should try this source now."""
+        with self._lock:
+            return (
+                self.probe is not None
+                and self._state == OPEN
+                and time.monotonic() - self._opened_at >= self._cooldown
+            )
+
+    def run_probe(self) -> None:
+        """Probe the source once and update the circuit with the outcome."""
+        with self._lock:
+            self._state = HALF_OPEN
+        try:
+            self.probe(self.max_timeout)
+        except Exception as e:
+            logger.info(f"Probe of {self.name} failed: {e}")
+            self.record_failure()
+            return
+        # A probe is a lighter request than a real call, so its latency is not recorded
+        self.record_success(None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return state, counters and latency percentiles."""
+        stats: Dict[str, Any] = {"state": self.state, "timeout": self.timeout()}
+        stats.update(self.percentiles())
+        with self._lock:
+            stats.update(calls=self.calls, rejected=self.rejected, failures=self._failures)
+        return stats
+
+
+_sources: Dict[str, SourceHealth] = {}
+_sources_lock = threading.Lock()
+_prober: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+
+def register_source(name: str, max_timeout: float, min_timeout: float = 1.0,
+                    probe: Optional[Callable[[float], Any]] = None,
+                    expected: Tuple[Type[BaseException], ...] = ()) -> SourceHealth:
+    """
+    Return the health tracker of a source, creating it on first registration.
+
+    Args:
+        name: Source name
+        max_timeout: Longest timeout a call may get
+        min_timeout: Shortest timeout a call may get
+        probe: Function (timeout) that raises if the source is still down
+        expected: Exceptions that count as valid answers
+
+    Returns:
+        The shared SourceHealth for this name
+    """
+    with _sources_lock:
+        health = _sources.get(name)
+        if health is None:
+            health = SourceHealth(name, max_timeout, min_timeout, probe, expected)
+            _sources[name] = health
+        return health
+
+
+def source_stats() -> Dict[str, Dict[str, Any]]:
+    """Return the health of every registered source."""
+    with _sources_lock:
+        sources = list(_sources.values())
+    return {health.name: health.stats() for health in sources}
+
+
+def _probe_loop(interval: float) -> None:
+    """Probe sources with an open circuit until stopped."""
+    while not _stop.wait(interval):
+        with _sources_lock:
+            due = [health for health in _sources.values() if health.probe_due()]
+        for health in due:
+            health.run_probe()
+
+
+def start_prober(interval: float = PROBE_INTERVAL) -> None:
+    """Start the background prober thread, if it is not running yet."""
+    global _prober
+    if _prober is not None and _prober.is_alive():
+        return
+    _stop.clear()
+    _prober = threading.Thread(target=_probe_loop, args=(interval,), name="health-prober", daemon=True)
+    _prober.start()
+
+
+def stop_prober() -> None:
+    """Stop the background prober thread."""
+    global _prober
+    _stop.set()
+    if _prober is not None:
+        _prober.join(timeout=5)
+        _prober = None
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rate History Module for Telegram Bot
+- Ring-buffer time series of the Damascus exchange rates
+- Fixed-size binary append log so the history survives restarts
+- PNG charts rendered once per new sample and served from memory
+"""
+
+import os
+import threading
+from io import BytesIO
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+HISTORY_LOG = os.getenv("RATES_HISTORY_LOG", os.path.join(DATA_DIR, "rates_history.bin"))
+# Samples kept in memory: a month of refreshes every five minutes
+HISTORY_CAPACITY = int(os.getenv("RATES_HISTORY_SIZE", "9000"))
+
+# Series stored per sample, with the market labels they are read from
+SERIES: Tuple[Tuple[str, str], ...] = (
+    ("USD buy", "buy"),
+    ("USD sell", "sell"),
+    ("EUR", "يورو دمشق"),
+    ("TRY", "ل. تركية دمشق"),
+    ("Gold (g)", "غرام الذهب"),
+)
+
+PERIODS: Dict[str, float] = {
+    "day": 24 * 3600.0,
+    "week": 7 * 24 * 3600.0,
+    "month": 30 * 24 * 3600.0,
+}
+
+# One log record: timestamp (float64) and one float32 per series, NaN if missing
+RECORD = np.dtype([("t", "<f8"), ("v", "<f4", (len(SERIES),))])
+
+CHART_SIZE = (800, 150 * len(SERIES) + 40)
+_COLORS = ((31, 119, 180), (214, 39, 40), (44, 160, 44), (255, 127, 14), (148, 103, 189))
+
+
+class Chart(NamedTuple):
+    """A rendered chart and the sample it was rendered for."""
+    version: float
+    png: bytes
+
+
+def _to_float(value: Optional[str]) -> float:
+    """Convert a scraped price such as "14,772" to a float, NaN if missing."""
+    try:
+        return float(str(value).replace(",", ""))
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def sample_values(snapshot) -> Tuple[float, ...]:
+    """Return the SERIES values of a rate snapshot."""
+    market = dict(snapshot.market)
+    fields = {"buy": snapshot.buy, "sell": snapshot.sell}
+    return tuple(_to_float(fields[key] if key in fields else market.get(key)) for _, key in SERIES)
+
+
+class RateHistory:
+    """
+    A fixed-capacity ring buffer of rate samples backed by an append log.
+
+    Samples live in two preallocated NumPy arrays (timestamps and a
+    float32 row per sample), so memory use does not grow with uptime. Every
+    sample is also appended to a binary log of fixed-size records; on start
+    the newest records are loaded back, and the log is compacted once it
+    holds twice the capacity.
+
+    Charts are rendered when a sample is recorded and kept as PNG bytes, so
+    any number of /dollar history requests only read memory.
+    """
+
+    def __init__(self, path: str = HISTORY_LOG, capacity: int = HISTORY_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._values = np.full((capacity, len(SERIES)), np.nan, dtype=np.float32)
+        self._count = 0
+        self._head = 0
+        self._lock = threading.Lock()
+        self._charts: Dict[str, Chart] = {}
+        self._file_ids: Dict[Tuple[str, float], str] = {}
+        self._logged = 0
+        self._load()
+
+    def _load(self) -> None:
+        """Load the newest records of the append log."""
+        if not os.path.exists(self.path):
+            return
+        records = np.fromfile(self.path, dtype=RECORD)
+        self._logged = len(records)
+        newest = records[-self.capacity:]
+        self._count = len(newest)
+        self._times[:self._count] = newest["t"]
+        self._values[:self._count] = newest["v"]
+        self._head = self._count % self.capacity
+
+    def _insert(self, timestamp: float, values: Sequence[float]) -> None:
+        """Write a sample into the ring buffer."""
+        self._times[self._head] = timestamp
+        self._values[self._head] = values
+        self._head = (self._head + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def _append_log(self, timestamp: float, values: Sequence[float]) -> None:
+        """Append one record to the log, compacting it when it grew too long."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        record = np.array([(timestamp, values)], dtype=RECORD)
+        if self._logged + 1 > 2 * self.capacity:
+            times, values_array = self._ordered()
+            compacted = np.empty(len(times), dtype=RECORD)
+            compacted["t"] = times
+            compacted["v"] = values_array
+            tmp_path = f"{self.path}.tmp"
+            compacted.tofile(tmp_path)
+            os.replace(tmp_path, self.path)
+            self._logged = len(compacted)
+            return
+        with open(self.path, "ab") as f:
+            f.write(record.tobytes())
+        self._logged += 1
+
+    def _ordered(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return copies of the stored samples, oldest first."""
+        if self._count < self.capacity:
+            return self._times[:self._count].copy(), self._values[:self._count].copy()
+        order = np.roll(np.arange(self.capacity), -self._head)
+        return self._times[order], self._values[order]
+
+    def sync(self) -> bool:
+        """
+        Read the samples another process appended to the log.
+
+        Only one process records samples when several bot processes run;
+        the others call this to follow its log.
+
+        Returns:
+            True if new samples were read
+        """
+        try:
+            logged = os.path.getsize(self.path) // RECORD.itemsize
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            if logged == self._logged:
+                return False
+            if logged < self._logged:
+                # The writer compacted the log: read it again from the start
+                self._count = self._head = 0
+                self._load()
+            else:
+                records = np.fromfile(self.path, dtype=RECORD, count=logged - self._logged,
+                                      offset=self._logged * RECORD.itemsize)
+                for timestamp, values in zip(records["t"], records["v"]):
+                    if not self._count or timestamp > self._times[(self._head - 1) % self.capacity]:
+                        self._insert(float(timestamp), values)
+                self._logged = logged
+            self._charts = {}
+            self._file_ids.clear()
+        return True
+
+    @property
+    def last_time(self) -> float:
+        """Timestamp of the newest sample, 0 if there is none."""
+        with self._lock:
+            if self._count == 0:
+                return 0.0
+            return float(self._times[(self._head - 1) % self.capacity])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._count
+
+    def record(self, timestamp: float, values: Sequence[float]) -> bool:
+        """
+        Store a sample and re-render the charts.
+
+        Args:
+            timestamp: Unix time the rates were fetched
+            values: One value per entry of SERIES (NaN if missing)
+
+        Returns:
+            False if the sample is not newer than the last one and was ignored
+        """
+        with self._lock:
+            if self._count and timestamp <= self._times[(self._head - 1) % self.capacity]:
+                return False
+            self._insert(timestamp, values)
+            self._append_log(timestamp, values)
+            times, values_array = self._ordered()
+
+        charts = {period: Chart(timestamp, self._render(times, values_array, period, timestamp))
+                  for period in PERIODS}
+        with self._lock:
+            self._charts = charts
+            self._file_ids.clear()
+        return True
+
+    def record_snapshot(self, snapshot) -> bool:
+        """Store the sp-today rates of a RateSnapshot, stamped with the time sp-today answered."""
+        quote = snapshot.quote("sp-today")
+        if quote is None:
+            return False
+        return self.record(quote.fetched_at, sample_values(snapshot))
+
+    def window(self, period: str, now: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (timestamps, values) of the samples within a period, oldest first."""
+        with self._lock:
+            times, values = self._ordered()
+        end = now if now is not None else (times[-1] if len(times) else 0.0)
+        mask = times >= end - PERIODS[period]
+        return times[mask], values[mask]
+
+    def cached_chart(self, period: str) -> Optional[Chart]:
+        """Return the chart of a period if it is already rendered, without rendering it."""
+        with self._lock:
+            return self._charts.get(period)
+
+    def chart(self, period: str) -> Optional[Chart]:
+        """
+        Return the cached chart of a period.
+
+        Returns:
+            The chart, or None while fewer than two samples are stored
+        """
+        with self._lock:
+            if self._count < 2:
+                return None
+            chart = self._charts.get(period)
+            if chart is not None:
+                return chart
+            # Loaded from the log but not rendered yet
+            times, values = self._ordered()
+            version = float(times[-1])
+        chart = Chart(version, self._render(times, values, period, version))
+        with self._lock:
+            self._charts.setdefault(period, chart)
+            return self._charts[period]
+
+    def file_id(self, period: str, version: float) -> Optional[str]:
+        """Return the Telegram file_id a chart version was uploaded as, if any."""
+        with self._lock:
+            return self._file_ids.get((period, version))
+
+    def remember_file_id(self, period: str, version: float, file_id: str) -> None:
+        """Record the Telegram file_id of an uploaded chart version."""
+        with self._lock:
+            if period in self._charts and self._charts[period].version == version:
+                self._file_ids[(period, version)] = file_id
+
+    @staticmethod
+    def _render(times: np.ndarray, values: np.ndarray, period: str, end: float) -> bytes:
+        """Draw one small line chart per series and return it as PNG bytes."""
+        width, height = CHART_SIZE
+        img = Image.new("RGB", CHART_SIZE, "white")
+        draw = ImageDraw.Draw(img)
+        font = ImageFont.load_default()
+
+        span = PERIODS[period]
+        mask = times >= end - span
+        times, values = times[mask], values[mask]
+        draw.text((10, 10), f"Damascus rates - last {period} ({len(times)} samples)", fill="black", font=font)
+
+        left, right, panel_h, top = 70, width - 20, 150, 40
+        for index, (label, _) in enumerate(SERIES):
+            y0 = top + index * panel_h
+            y1 = y0 + panel_h - 30
+            draw.rectangle((left, y0, right, y1), outline=(200, 200, 200))
+            series = values[:, index] if len(values) else np.empty(0)
+            valid = ~np.isnan(series)
+            if valid.sum() == 0:
+                draw.text((left + 5, y0 + 5), f"{label}: no data", fill="gray", font=font)
+                continue
+
+            t, v = times[valid], series[valid].astype(np.float64)
+            low, high = float(v.min()), float(v.max())
+            if high == low:
+                low, high = low - 1, high + 1
+            xs = left + (t - (end - span)) / span * (right - left)
+            ys = y1 - (v - low) / (high - low) * (y1 - y0 - 10) - 5
+            points = list(zip(xs.tolist(), ys.tolist()))
+            color = _COLORS[index % len(_COLORS)]
+            if len(points) > 1:
+                draw.line(points, fill=color, width=2)
+            else:
+                x, y = points[0]
+                draw.ellipse((x - 2, y - 2, x + 2, y + 2), fill=color)
+
+            draw.text((left + 5, y0 + 5), f"{label}: {v[-1]:,.0f}", fill=color, font=font)
+            draw.text((5, y0), f"{high:,.0f}", fill="gray", font=font)
+            draw.text((5, y1 - 12), f"{low:,.0f}", fill="gray", font=font)
+
+        bio = BytesIO()
+        img.save(bio, format="PNG", optimize=True)
+        return bio.getvalue()
+
+
+_history: Optional[RateHistory] = None
+_history_lock = threading.Lock()
+
+
+def rate_history() -> RateHistory:
+    """Return the shared rate history, loading it on first use."""
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = RateHistory()
+        return _history
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+HTTP Module for Telegram Bot
+- One keep-alive connection pool per host, shared by all scrapers
+- Default timeouts and compressed transfers
+- On-disk response cache revalidated with ETag / Last-Modified
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from typing import Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from cache_module import DiskLRUStore, make_key
+from storage_module import TEMP_DIR
+
+logger = logging.getLogger(__name__)
+
+# (connect, read) timeout in seconds for requests that do not pass their own
+DEFAULT_TIMEOUT = (
+    float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05")),
+    float(os.getenv("HTTP_READ_TIMEOUT", "10")),
+)
+# Connections kept open per host
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "8"))
+
+HTTP_CACHE_DIR = os.path.join(TEMP_DIR, "http_cache")
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MB", "64")) * 1024 * 1024
+
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+# Response headers kept with a cached body
+_KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control", "Date")
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+def _max_age(headers) -> float:
+    """Return the freshness lifetime a response allows, in seconds."""
+    cache_control = headers.get("Cache-Control", "").lower()
+    if "no-cache" in cache_control or "no-store" in cache_control:
+        return 0.0
+    match = _MAX_AGE_RE.search(cache_control)
+    return float(match.group(1)) if match else 0.0
+
+
+def _cached_response(url: str, body: bytes, meta: Dict) -> requests.Response:
+    """Build a requests.Response for a body served from the cache."""
+    response = requests.Response()
+    response.status_code = 200
+    response.reason = "OK"
+    response.url = url
+    response._content = body
+    response.headers = CaseInsensitiveDict(meta.get("headers", {}))
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.from_cache = True
+    return response
+
+
+class HttpClient:
+    """
+    A shared HTTP client for the scrapers.
+
+    Every host gets its own requests.Session, so connections (and TLS
+    sessions) are reused across calls instead of being opened per request.
+    GET responses that carry an ETag or Last-Modified header are kept on
+    disk; later fetches of the same URL send If-None-Match /
+    If-Modified-Since and reuse the stored body on 304 Not Modified. While a
+    response is still fresh (Cache-Control max-age or the caller's
+    fresh_for) it is served without any network call.
+    """
+
+    def __init__(self, cache: Optional[DiskLRUStore] = None, timeout: Timeout = DEFAULT_TIMEOUT,
+                 pool_size: int = POOL_SIZE):
+        """
+        Args:
+            cache: Store for cacheable responses, or None to disable caching
+            timeout: Default timeout for requests that do not pass their own
+            pool_size: Connections kept open per host
+        """
+        self.cache = cache
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+        self.network_fetches = 0
+        self.not_modified = 0
+        self.local_hits = 0
+
+    def session_for(self, url: str) -> requests.Session:
+        """Return the keep-alive session of a URL's host, creating it on first use."""
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            session = self._sessions.get(origin)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount(origin, adapter)
+                session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+                self._sessions[origin] = session
+            return session
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None, timeout: Optional[Timeout] = None,
+            cache: bool = True, fresh_for: float = 0.0) -> requests.Response:
+        """
+        Fetch a URL, using the response cache when possible.
+
+        Args:
+            url: URL to fetch
+            headers: Extra request headers
+            timeout: Timeout in seconds (or a (connect, read) tuple), defaults to DEFAULT_TIMEOUT
+            cache: Whether to use the response cache
+            fresh_for: Seconds a cached response may be used without revalidation
+
+        Returns:
+            The response; responses served from the cache have from_cache set to True
+        """
+        store = self.cache if cache else None
+        key = make_key("GET", url)
+        meta = store.get_meta(key) if store is not None else {}
+
+        request_headers = dict(headers or {})
+        if meta:
+            age = time.time() - meta.get("fetched_at", 0)
+            if age < max(fresh_for, meta.get("max_age", 0)):
+                body = store.get_bytes(key)
+                if body is not None:
+                    with self._lock:
+                        self.local_hits += 1
+                    return _cached_response(url, body, meta)
+            if meta.get("etag"):
+                request_headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                request_headers["If-Modified-Since"] = meta["last_modified"]
+
+        response = self.session_for(url).get(url, headers=request_headers, timeout=timeout or self.timeout)
+        response.from_cache = False
+        with self._lock:
+            self.network_fetches += 1
+
+        if response.status_code == 304 and meta:
+            body = store.get_bytes(key)
+            if body is not None:
+                with self._lock:
+                    self.not_modified += 1
+                meta.update(fetched_at=time.time(), max_age=_max_age(response.headers))
+                store.set_meta(key, meta)
+                return _cached_response(url, body, meta)
+            # The body was evicted after its metadata was read: fetch it again
+            response = self.session_for(url).get(url, headers=headers, timeout=timeout or self.timeout)
+            response.from_cache = False
+
+        if store is not None and response.status_code == 200:
+            self._store(store, key, response, fresh_for)
+        return response
+
+    def _store(self, store: DiskLRUStore, key: str, response: requests.Response, fresh_for: float) -> None:
+        """Keep a response on disk if it can be revalidated or is fresh for a while."""
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        max_age = _max_age(response.headers)
+        if "no-store" in response.headers.get("Cache-Control", "").lower():
+            return
+        if not (etag or last_modified or max_age or fresh_for):
+            return
+        meta = {
+            "etag": etag,
+            "last_modified": last_modified,
+            "max_age": max_age,
+            "fetched_at": time.time(),
+            "headers": {name: response.headers[name] for name in _KEPT_HEADERS if name in response.headers},
+        }
+        try:
+            store.put_bytes(key, response.content, meta=meta)
+        except OSError as e:
+            logger.warning(f"Could not cache response for {response.url}: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        """Return network and cache counters."""
+        with self._lock:
+            return {
+                "hosts": len(self._sessions),
+                "network_fetches": self.network_fetches,
+                "not_modified": self.not_modified,
+                "local_hits": self.local_hits,
+            }
+
+    def close(self) -> None:
+        """Close every pooled connection."""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+HTTP = HttpClient(DiskLRUStore(HTTP_CACHE_DIR, HTTP_CACHE_MAX_BYTES))
+
+
+def http_get(url: str, headers: Optional[Dict[str, str]] = None, timeout: Optional[Timeout] = None,
+             cache: bool = True, fresh_for: float = 0.0) -> requests.Response:
+    """Fetch a URL with the shared client; see HttpClient.get."""
+    return HTTP.get(url, headers=headers, timeout=timeout, cache=cache, fresh_for=fresh_for)
@@ -1,4 +1,8 @@
-from dollar import dollar
+from dotenv import load_dotenv
 
-str = dollar()
-print(str)
\ No newline at end of file
+load_dotenv()
+
+from rates_module import RATES  # noqa: E402
+
+if __name__ == "__main__":
+    print(RATES.render(RATES.refresh()))
@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Download Job Queue Module for Telegram Bot
+- Persistent, prioritized queue of /download jobs stored in SQLite
+- Fixed number of worker slots backed by long-lived, killable download processes
+- Real cancellation and resumption of unfinished jobs after a restart
+"""
+
+import os
+import time
+import signal
+import sqlite3
+import asyncio
+import logging
+import importlib
+import threading
+import multiprocessing
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from executor_module import SingleFlight
+from storage_module import pid_alive
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+JOB_DB = os.getenv("JOB_DB", os.path.join(DATA_DIR, "jobs.sqlite3"))
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "2"))
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# Seconds between polls of the database when no job was submitted locally
+POLL_INTERVAL = 2.0
+# Seconds a killed download gets to exit after SIGTERM before SIGKILL
+KILL_GRACE = 3.0
+
+# youtube_module once it is fully imported (see _youtube)
+_youtube_module = None
+
+
+class DownloadJob(NamedTuple):
+    """A queued or running download."""
+    id: int
+    chat_id: int
+    user_id: int
+    url: str
+    tier: str
+    priority: int
+
+
+class JobCancelled(Exception):
+    """Raised inside a worker when its job was cancelled."""
+
+
+def _download_entry(conn) -> None:
+    """
+    Entry point of a download process; serves downloads until its pipe closes.
+
+    The process starts its own session, so yt-dlp and the ffmpeg processes it
+    spawns can be killed together as one process group. yt-dlp is imported
+    once, not once per download.
+    """
+    os.setsid()
+    from youtube_module import download_youtube_audio
+    while True:
+        try:
+            url, tier = conn.recv()
+        except EOFError:
+            break
+        try:
+            conn.send(("ok", download_youtube_audio(url, tier)))
+        except Exception as e:
+            conn.send(("error", str(e)))
+    conn.close()
+
+
+async def _readable(conn) -> None:
+    """Wait until a pipe has a message or its other end is closed."""
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    loop.add_reader(conn.fileno(), lambda: ready.done() or ready.set_result(None))
+    try:
+        await ready
+    finally:
+        loop.remove_reader(conn.fileno())
+
+
+async def _youtube() -> Any:
+    """Return youtube_module, importing it (and yt-dlp) off the event loop on first use."""
+    global _youtube_module
+    # sys.modules already lists a module while another thread is still
+    # importing it; import_module waits for that import to finish
+    if _youtube_module is None:
+        _youtube_module = await asyncio.to_thread(importlib.import_module, "youtube_module")
+    return _youtube_module
+
+
+class _DownloadProcess:
+    """A long-lived download process and the parent's end of its pipe."""
+
+    def __init__(self, mp):
+        self.conn, child = mp.Pipe()
+        self.process = mp.Process(target=_download_entry, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    def close(self) -> None:
+        """Let the process exit after its current download."""
+        self.conn.close()
+        self.process.join(timeout=0)
+
+
+class _Download:
+    """A download shared by every job waiting for the same video."""
+
+    def __init__(self):
+        self.process = None
+        self.job_ids: Set[int] = set()
+
+
+class DownloadJobQueue:
+    """
+    A persistent priority queue of downloads with a fixed number of worker slots.
+
+    Jobs are rows in SQLite, so they survive restarts: jobs that were running
+    when the bot stopped are queued again on start. Several bot processes may
+    share the database; each running job records the process that claimed
+    it, so one process never takes back another's live jobs. Each download runs in its
+    own process group, which cancel_user() kills to stop yt-dlp and ffmpeg
+    and free the slot. Download processes are reused between jobs; only a
+    killed one is replaced. Jobs for the same video and tier share one
+    download, and a job that only waits for another slot's download does not
+    take up a slot itself.
+    """
+
+    def __init__(self, path: str = JOB_DB, workers: int = DOWNLOAD_WORKERS):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.workers = workers
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS download_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                tier TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                state TEXT NOT NULL,
+                title TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                owner INTEGER
+            )
+            """
+        )
+        # Databases created before jobs recorded the process running them
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(download_jobs)")}
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE download_jobs ADD COLUMN owner INTEGER")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS download_jobs_pick ON download_jobs (state, priority DESC, id)"
+        )
+        self._flights = SingleFlight()
+        self._downloads: Dict[str, _Download] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._followers: Set[asyncio.Task] = set()
+        self._idle: List[_DownloadProcess] = []
+        self._deliver = None
+        self._fail = None
+        # forkserver, like the process pools in executor_module: download
+        # processes are not forked from the process running the event loop
+        self._mp = multiprocessing.get_context("forkserver")
+
+    # Database helpers (blocking: the event loop calls them through _db)
+
+    async def _db(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run a database helper in a thread, so a locked database never stalls the event loop."""
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        """Run one statement under the connection lock."""
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def _set_state(self, job_id: int, state: str, **fields: Any) -> None:
+        """Update the state (and optional title/error) of a job."""
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        sql = f"UPDATE download_jobs SET state = ?, updated_at = ?{', ' + columns if columns else ''} WHERE id = ?"
+        self._execute(sql, (state, time.time(), *fields.values(), job_id))
+
+    def _state(self, job_id: int) -> Optional[str]:
+        """Return the current state of a job."""
+        row = self._execute("SELECT state FROM download_jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def _running(self, job_ids: Set[int]) -> bool:
+        """Check whether any of the jobs is still running."""
+        if not job_ids:
+            return False
+        ids = list(job_ids)
+        row = self._execute(
+            f"SELECT COUNT(*) FROM download_jobs WHERE state = ? AND id IN ({', '.join('?' * len(ids))})",
+            (RUNNING, *ids),
+        ).fetchone()
+        return row[0] > 0
+
+    def _insert(self, chat_id: int, user_id: int, url: str, tier: str, priority: Optional[int]) -> int:
+        """Insert a queued job and return its id."""
+        if priority is None:
+            priority = -self._active_jobs(user_id)
+        now = time.time()
+        cursor = self._execute(
+            """
+            INSERT INTO download_jobs (chat_id, user_id, url, tier, priority, state, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (chat_id, user_id, url, tier, priority, QUEUED, now, now),
+        )
+        return cursor.lastrowid
+
+    def _active_jobs(self, user_id: int) -> int:
+        """Count the queued or running jobs of a user."""
+        row = self._execute(
+            "SELECT COUNT(*) FROM download_jobs WHERE user_id = ? AND state IN (?, ?)",
+            (user_id, QUEUED, RUNNING),
+        ).fetchone()
+        return row[0]
+
+    def _position(self, job_id: int) -> int:
+        """Count the queued jobs that will run before a job."""
+        row = self._execute(
+            """
+            SELECT COUNT(*) FROM download_jobs AS other, download_jobs AS job
+            WHERE job.id = ? AND other.state = ?
+              AND (other.priority > job.priority OR (other.priority = job.priority AND other.id < job.id))
+            """,
+            (job_id, QUEUED),
+        ).fetchone()
+        return row[0]
+
+    def _cancel_jobs(self, user_id: int) -> List[int]:
+        """Mark the queued and running jobs of a user cancelled and return their ids."""
+        rows = self._execute(
+            "SELECT id FROM download_jobs WHERE user_id = ? AND state IN (?, ?)",
+            (user_id, QUEUED, RUNNING),
+        ).fetchall()
+        for (job_id,) in rows:
+            self._set_state(job_id, CANCELLED)
+        return [job_id for (job_id,) in rows]
+
+    def _resume(self) -> int:
+        """Queue again the running jobs whose process is gone; return how many."""
+        # Other bot processes may share the database: only take back jobs
+        # whose process is gone
+        running = self._execute(
+            "SELECT id, owner FROM download_jobs WHERE state = ?", (RUNNING,)
+        ).fetchall()
+        resumed = 0
+        for job_id, owner in running:
+            if owner is None or not pid_alive(owner):
+                resumed += self._execute(
+                    "UPDATE download_jobs SET state = ?, updated_at = ? WHERE id = ? AND state = ?",
+                    (QUEUED, time.time(), job_id, RUNNING),
+                ).rowcount
+        return resumed
+
+    def _requeue_own(self) -> None:
+        """Queue again the jobs this process was running."""
+        self._execute(
+            "UPDATE download_jobs SET state = ?, updated_at = ? WHERE state = ? AND owner = ?",
+            (QUEUED, time.time(), RUNNING, os.getpid()),
+        )
+
+    def _claim(self) -> Optional[DownloadJob]:
+        """Atomically move the highest-priority queued job to running."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    """
+                    SELECT id, chat_id, user_id, url, tier, priority FROM download_jobs
+                    WHERE state = ? ORDER BY priority DESC, id LIMIT 1
+                    """,
+                    (QUEUED,),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE download_jobs SET state = ?, updated_at = ?, owner = ? WHERE id = ?",
+                        (RUNNING, time.time(), os.getpid(), row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return DownloadJob(*row) if row else None
+
+    # Public API
+
+    async def submit(self, chat_id: int, user_id: int, url: str, tier: str, priority: Optional[int] = None) -> int:
+        """
+        Add a download job to the queue.
+
+        Args:
+            chat_id: Chat the result is delivered to
+            user_id: User who requested the download
+            url: YouTube URL
+            tier: Audio format tier
+            priority: Higher runs first; by default a user's first unfinished
+                job outranks their later ones, so one user cannot starve others
+
+        Returns:
+            The job id
+        """
+        job_id = await self._db(self._insert, chat_id, user_id, url, tier, priority)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def active_jobs(self, user_id: int) -> int:
+        """Return the number of queued or running jobs of a user."""
+        return await self._db(self._active_jobs, user_id)
+
+    async def position(self, job_id: int) -> int:
+        """Return how many queued jobs will run before this one."""
+        return await self._db(self._position, job_id)
+
+    async def cancel_user(self, user_id: int) -> int:
+        """
+        Cancel every queued or running download of a user.
+
+        Running downloads are killed unless another user's job still waits
+        for the same video. A download run by another bot process sharing
+        the database is killed by that process when it next checks its jobs
+        (within POLL_INTERVAL seconds).
+
+        Returns:
+            The number of jobs cancelled
+        """
+        job_ids = await self._db(self._cancel_jobs, user_id)
+        for download in list(self._downloads.values()):
+            download.job_ids.difference_update(job_ids)
+            if not download.job_ids and download.process is not None:
+                self._kill(download.process)
+        return len(job_ids)
+
+    # Workers
+
+    async def start(self, deliver: Callable[[DownloadJob, str, str], Awaitable[None]],
+                    fail: Callable[[DownloadJob, str], Awaitable[None]]) -> None:
+        """
+        Resume unfinished jobs and start the worker slots.
+
+        Args:
+            deliver: Coroutine called as deliver(job, file_path, title) when a job finishes
+            fail: Coroutine called as fail(job, error) when a job fails
+        """
+        self._deliver = deliver
+        self._fail = fail
+        self._wakeup = asyncio.Event()
+        resumed = await self._db(self._resume)
+        if resumed:
+            logger.info(f"Resuming {resumed} unfinished download job(s)")
+        self._tasks = [asyncio.create_task(self._worker(slot)) for slot in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Stop the workers; jobs still running are queued again for the next start."""
+        for download in self._downloads.values():
+            if download.process is not None:
+                self._kill(download.process)
+        tasks = self._tasks + list(self._followers)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        for worker in self._idle:
+            worker.close()
+        self._idle = []
+        await self._db(self._requeue_own)
+
+    async def _worker(self, slot: int) -> None:
+        """Take jobs from the queue one at a time."""
+        while True:
+            job = await self._db(self._claim)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                youtube = await _youtube()
+                video_id = youtube.extract_video_id(job.url)
+            except Exception as e:
+                await self._failed(job, e)
+                continue
+            key = f"{video_id or job.url}:{job.tier}"
+            if key in self._downloads:
+                # Another slot already downloads this video: wait for it
+                # without holding this slot
+                task = asyncio.create_task(self._complete(job, key, video_id))
+                self._followers.add(task)
+                task.add_done_callback(self._followers.discard)
+                continue
+            await self._complete(job, key, video_id)
+
+    async def _failed(self, job: DownloadJob, error: Exception) -> None:
+        """Mark a job failed and report it, unless it was cancelled meanwhile."""
+        logger.error(f"Download job {job.id} failed: {error}")
+        if await self._db(self._state, job.id) == RUNNING:
+            await self._db(self._set_state, job.id, FAILED, error=str(error))
+            await self._fail(job, str(error))
+
+    async def _complete(self, job: DownloadJob, key: str, video_id: Optional[str]) -> None:
+        """Run a claimed job to its end and deliver the result or the error."""
+        try:
+            file_path, title = await self._run(job, key, video_id)
+        except JobCancelled:
+            logger.info(f"Download job {job.id} was cancelled")
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._failed(job, e)
+            return
+
+        if await self._db(self._state, job.id) != RUNNING:
+            return
+        try:
+            await self._deliver(job, file_path, title)
+            await self._db(self._set_state, job.id, DONE, title=title)
+        except Exception as e:
+            logger.error(f"Delivering download job {job.id} failed: {e}")
+            await self._db(self._set_state, job.id, FAILED, error=str(e))
+
+    async def _run(self, job: DownloadJob, key: str, video_id: Optional[str]) -> Tuple[str, str]:
+        """Get the audio of a job, sharing the download with identical jobs."""
+        if video_id:
+            hit = _youtube_module.cached_audio(video_id, job.tier)
+            if hit is not None:
+                return hit
+
+        download = self._downloads.setdefault(key, _Download())
+        download.job_ids.add(job.id)
+        try:
+            result = await self._flights.do(key, lambda: self._download(key, job.url, job.tier))
+        except Exception:
+            if await self._db(self._state, job.id) != RUNNING:
+                raise JobCancelled()
+            raise
+        finally:
+            download.job_ids.discard(job.id)
+            if not download.job_ids and self._downloads.get(key) is download:
+                del self._downloads[key]
+        if await self._db(self._state, job.id) != RUNNING:
+            raise JobCancelled()
+        return result
+
+    async def _download(self, key: str, url: str, tier: str) -> Tuple[str, str]:
+        """Run one download in a download process and wait for it."""
+        worker = None
+        while self._idle and worker is None:
+            candidate = self._idle.pop()
+            if candidate.process.is_alive():
+                worker = candidate
+            else:
+                candidate.close()
+        if worker is None:
+            # Starting a process blocks until it runs, so keep it off the event loop
+            worker = await asyncio.to_thread(_DownloadProcess, self._mp)
+        download = self._downloads.get(key)
+        if download is not None:
+            download.process = worker.process
+
+        try:
+            worker.conn.send((url, tier))
+            while True:
+                try:
+                    await asyncio.wait_for(_readable(worker.conn), POLL_INTERVAL)
+                    break
+                except asyncio.TimeoutError:
+                    # Another bot process sharing the database may have cancelled the jobs
+                    if download is not None and not await self._db(self._running, set(download.job_ids)):
+                        self._kill(worker.process)
+            # EOFError here means the process died, e.g. killed by cancel_user()
+            status, value = worker.conn.recv()
+        except asyncio.CancelledError:
+            self._kill(worker.process)
+            worker.close()
+            raise
+        except (EOFError, OSError):
+            worker.close()
+            raise RuntimeError("The download was stopped before it finished")
+
+        # The download is over: cancel_user() must not kill the process once it is reused
+        if download is not None:
+            download.process = None
+        self._idle.append(worker)
+
+        if status != "ok":
+            raise RuntimeError(value)
+        return tuple(value)
+
+    def _kill(self, process) -> None:
+        """Terminate a download process group, escalating to SIGKILL."""
+        def kill():
+            for sig in (signal.SIGTERM, signal.SIGKILL):
+                try:
+                    os.killpg(process.pid, sig)
+                except (ProcessLookupError, PermissionError):
+                    # Not a group leader yet (or already gone): signal the process alone
+                    if process.is_alive():
+                        os.kill(process.pid, sig)
+                process.join(KILL_GRACE)
+                if not process.is_alive():
+                    return
+
+        threading.Thread(target=kill, name="download-kill", daemon=True).start()
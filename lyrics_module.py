@@ -4,136 +4,303 @@
 """
 Lyrics Extraction Module for Telegram Bot
 - Extract lyrics from song name using free websites
+- Query all sources concurrently and use the first good result
+- Answer repeated and similar queries from the local lyrics store
 """
 
-import requests
-from bs4 import BeautifulSoup
+import os
 import re
+import time
+import asyncio
+import logging
+import threading
 from urllib.parse import quote
+from typing import Callable, List, NamedTuple, Optional
 
-def extract_lyrics_from_azlyrics(song_name: str) -> str:
+from executor_module import PoolBusyError, run_in_pool
+from health_module import SourceHealth, register_source as register_health
+from http_module import http_get
+from lyricsstore_module import LyricsStore
+from parse_module import (
+    AZLYRICS_LYRICS,
+    AZLYRICS_RESULTS,
+    GENIUS_LYRICS,
+    GENIUS_RESULTS,
+    select,
+    select_one,
+)
+
+logger = logging.getLogger(__name__)
+
+# Seconds a single source may take, including its search and lyrics pages
+SOURCE_DEADLINE = float(os.getenv("LYRICS_SOURCE_DEADLINE", "8"))
+
+# Shorter texts are error pages or placeholders rather than lyrics
+MIN_LYRICS_LENGTH = 40
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+
+class LyricsNotFound(ValueError):
+    """Raised when a source (or every source) has no lyrics for a song."""
+
+
+class SourceUnavailable(LyricsNotFound):
+    """Raised when a source failed or timed out, so its answer is unknown."""
+
+
+class LyricsSource(NamedTuple):
+    """A lyrics website, the longest it may take to answer, and a page to probe it with."""
+    name: str
+    fetch: Callable[[str, float], str]
+    deadline: float
+    probe_url: Optional[str] = None
+
+
+def _get(url: str, timeout: float) -> str:
+    """Fetch a page and return its text."""
+    response = http_get(url, headers=HEADERS, timeout=timeout)
+    response.raise_for_status()
+    return response.text
+
+def extract_lyrics_from_azlyrics(song_name: str, timeout: float = SOURCE_DEADLINE) -> str:
     """
     Extract lyrics from AZLyrics.com
-    
+
+    Args:
+        song_name: Name of the song (can include artist)
+        timeout: Seconds each HTTP request may take
+
+    Returns:
+        Lyrics as text
+
+    Raises:
+        LyricsNotFound: If the song or its lyrics could not be found
+    """
+    # Format the search query
+    search_query = quote(song_name.lower().replace(' ', '+'))
+    search_url = f"https://search.azlyrics.com/search.php?q={search_query}"
+
+    # Parse search results
+    song_results = select(_get(search_url, timeout), AZLYRICS_RESULTS)
+
+    if not song_results:
+        raise LyricsNotFound(f"No lyrics found for '{song_name}'")
+
+    # Get the first result URL
+    lyrics_url = song_results[0]['href']
+
+    # Find the lyrics div (AZLyrics has a specific structure)
+    lyrics_div = select_one(_get(lyrics_url, timeout), AZLYRICS_LYRICS)
+
+    if not lyrics_div:
+        raise LyricsNotFound(f"Could not extract lyrics for '{song_name}'")
+
+    # Extract the text and clean it up
+    lyrics = lyrics_div.get_text().strip()
+    # Remove any script or comment content
+    lyrics = re.sub(r'<!--.*?-->', '', lyrics, flags=re.DOTALL)
+    lyrics = re.sub(r'<script.*?>.*?</script>', '', lyrics, flags=re.DOTALL)
+    return lyrics
+
+def extract_lyrics_from_genius(song_name: str, timeout: float = SOURCE_DEADLINE) -> str:
+    """
+    Extract lyrics from Genius.com
+
     Args:
         song_name: Name of the song (can include artist)
-        
+        timeout: Seconds each HTTP request may take
+
     Returns:
-        Lyrics as text or error message
+        Lyrics as text
+
+    Raises:
+        LyricsNotFound: If the song or its lyrics could not be found
     """
+    # Format the search query
+    search_query = quote(song_name.lower().replace(' ', '-'))
+    search_url = f"https://genius.com/search?q={search_query}"
+
+    # Parse search results
+    song_results = select(_get(search_url, timeout), GENIUS_RESULTS)
+
+    if not song_results:
+        raise LyricsNotFound(f"No lyrics found for '{song_name}' on Genius")
+
+    # Get the first result URL
+    lyrics_url = song_results[0]['href']
+
+    # Find the lyrics div
+    lyrics_div = select_one(_get(lyrics_url, timeout), GENIUS_LYRICS)
+
+    if not lyrics_div:
+        raise LyricsNotFound(f"Could not extract lyrics for '{song_name}' from Genius")
+
+    # Extract the text and clean it up
+    return lyrics_div.get_text(separator='\n').strip()
+
+
+# Sources queried for every lookup; all of them run at the same time
+LYRICS_SOURCES: List[LyricsSource] = [
+    LyricsSource("azlyrics", extract_lyrics_from_azlyrics, SOURCE_DEADLINE, "https://www.azlyrics.com/"),
+    LyricsSource("genius", extract_lyrics_from_genius, SOURCE_DEADLINE, "https://genius.com/"),
+]
+
+_store: Optional[LyricsStore] = None
+_store_lock = threading.Lock()
+
+def lyrics_store() -> LyricsStore:
+    """Return the shared lyrics store, opening it on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = LyricsStore()
+        return _store
+
+def register_source(name: str, fetch: Callable[[str, float], str], deadline: float = SOURCE_DEADLINE,
+                    probe_url: Optional[str] = None) -> None:
+    """
+    Add a lyrics source to every future lookup.
+
+    Args:
+        name: Source name used in logs
+        fetch: Blocking function (song_name, timeout) -> lyrics that raises on failure
+        deadline: Longest time in seconds the source may take
+        probe_url: Page fetched to check whether the source is back after failures
+    """
+    LYRICS_SOURCES.append(LyricsSource(name, fetch, deadline, probe_url))
+
+def _probe(url: str) -> Callable[[float], None]:
+    """Build a health probe that fetches a page of the source."""
+    def probe(timeout: float) -> None:
+        http_get(url, headers=HEADERS, timeout=timeout, cache=False).raise_for_status()
+    return probe
+
+def _health(source: LyricsSource) -> SourceHealth:
+    """Return the health tracker of a lyrics source."""
+    return register_health(
+        f"lyrics:{source.name}",
+        max_timeout=source.deadline,
+        probe=_probe(source.probe_url) if source.probe_url else None,
+        expected=(LyricsNotFound,),
+    )
+
+async def _query(source: LyricsSource, song_name: str) -> str:
+    """Run one source under its adaptive timeout and check that the result is usable."""
+    health = _health(source)
+    if not health.allow():
+        # Skip a failing source without taking a worker slot
+        raise SourceUnavailable(f"{source.name} is unavailable right now")
+    loop = asyncio.get_running_loop()
+    started = loop.create_future()
+    attempt = health.attempt(
+        on_start=lambda: loop.call_soon_threadsafe(lambda: started.done() or started.set_result(None))
+    )
+    job = asyncio.ensure_future(run_in_pool("lyrics", health.measure, source.fetch, song_name, attempt=attempt))
     try:
-        # Format the search query
-        search_query = quote(song_name.lower().replace(' ', '+'))
-        search_url = f"https://search.azlyrics.com/search.php?q={search_query}"
-        
-        # Send request to search page
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(search_url, headers=headers)
-        response.raise_for_status()
-        
-        # Parse search results
-        soup = BeautifulSoup(response.text, 'html.parser')
-        song_results = soup.select('td.text-left a')
-        
-        if not song_results:
-            return f"No lyrics found for '{song_name}'"
-        
-        # Get the first result URL
-        lyrics_url = song_results[0]['href']
-        
-        # Get the lyrics page
-        lyrics_response = requests.get(lyrics_url, headers=headers)
-        lyrics_response.raise_for_status()
-        
-        # Parse lyrics page
-        lyrics_soup = BeautifulSoup(lyrics_response.text, 'html.parser')
-        
-        # Find the lyrics div (AZLyrics has a specific structure)
-        lyrics_div = lyrics_soup.find('div', class_=None, id=None, attrs={'style': None})
-        
-        if lyrics_div:
-            # Extract the text and clean it up
-            lyrics = lyrics_div.get_text().strip()
-            # Remove any script or comment content
-            lyrics = re.sub(r'<!--.*?-->', '', lyrics, flags=re.DOTALL)
-            lyrics = re.sub(r'<script.*?>.*?</script>', '', lyrics, flags=re.DOTALL)
-            return lyrics
-        else:
-            return f"Could not extract lyrics for '{song_name}'"
-            
+        # Time spent waiting for a free worker does not count against the source
+        await asyncio.wait({job, started}, timeout=attempt.timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not job.done() and attempt.started_at is None:
+            attempt.cancel()
+            raise PoolBusyError("The lyrics service is busy right now. Please try again in a moment.")
+        remaining = attempt.timeout - (time.monotonic() - (attempt.started_at or time.monotonic()))
+        lyrics = await asyncio.wait_for(job, max(0.0, remaining))
+    except asyncio.TimeoutError:
+        # The fetch keeps running in its thread; its late result must not count as a success
+        attempt.abandon()
+        raise SourceUnavailable(f"{source.name} did not answer within {attempt.timeout:.1f}s")
+    except asyncio.CancelledError:
+        # Another source answered first: a fetch still waiting for a worker need not run
+        if attempt.started_at is None:
+            attempt.cancel()
+        job.cancel()
+        raise
+    except (LyricsNotFound, PoolBusyError):
+        raise
     except Exception as e:
-        return f"Error extracting lyrics: {str(e)}"
+        raise SourceUnavailable(f"{source.name} failed: {e}") from e
+    if len(lyrics.strip()) < MIN_LYRICS_LENGTH:
+        raise LyricsNotFound(f"{source.name} returned no usable lyrics")
+    return lyrics
+
+def _lookup_stored(song_name: str) -> Optional[str]:
+    """Return stored lyrics for a query; raise if it is a recent known miss."""
+    store = lyrics_store()
+    lyrics = store.get(song_name)
+    if lyrics is None and store.is_known_miss(song_name):
+        raise LyricsNotFound(f"No lyrics found for '{song_name}'")
+    return lyrics
 
-def extract_lyrics_from_genius(song_name: str) -> str:
+async def find_lyrics(song_name: str, sources: Optional[List[LyricsSource]] = None,
+                      use_store: bool = True) -> str:
     """
-    Extract lyrics from Genius.com as a fallback
-    
+    Look up lyrics on all sources at once and return the first good result.
+
+    The local lyrics store is checked first, so a song fetched before (or
+    asked for with different spelling or word order) needs no network call.
+    Otherwise the remaining lookups are cancelled as soon as one source
+    succeeds, so the latency is that of the fastest source rather than the
+    sum of all of them.
+
     Args:
         song_name: Name of the song (can include artist)
-        
+        sources: Sources to query, defaults to LYRICS_SOURCES
+        use_store: Whether to read from and write to the lyrics store
+
     Returns:
-        Lyrics as text or error message
+        Lyrics as text
+
+    Raises:
+        LyricsNotFound: If no source returned lyrics in time
     """
+    if use_store:
+        stored = await run_in_pool("lyrics", _lookup_stored, song_name)
+        if stored is not None:
+            return stored
+
+    sources = LYRICS_SOURCES if sources is None else sources
+    tasks = [asyncio.ensure_future(_query(source, song_name)) for source in sources]
+    errors = []
     try:
-        # Format the search query
-        search_query = quote(song_name.lower().replace(' ', '-'))
-        search_url = f"https://genius.com/search?q={search_query}"
-        
-        # Send request to search page
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(search_url, headers=headers)
-        response.raise_for_status()
-        
-        # Parse search results
-        soup = BeautifulSoup(response.text, 'html.parser')
-        song_results = soup.select('a.mini_card')
-        
-        if not song_results:
-            return f"No lyrics found for '{song_name}' on Genius"
-        
-        # Get the first result URL
-        lyrics_url = song_results[0]['href']
-        
-        # Get the lyrics page
-        lyrics_response = requests.get(lyrics_url, headers=headers)
-        lyrics_response.raise_for_status()
-        
-        # Parse lyrics page
-        lyrics_soup = BeautifulSoup(lyrics_response.text, 'html.parser')
-        
-        # Find the lyrics div
-        lyrics_div = lyrics_soup.select_one('div[class*="Lyrics__Container"]')
-        
-        if lyrics_div:
-            # Extract the text and clean it up
-            lyrics = lyrics_div.get_text(separator='\n').strip()
+        for finished in asyncio.as_completed(tasks):
+            try:
+                lyrics = await finished
+            except (LyricsNotFound, PoolBusyError) as e:
+                logger.info(f"Lyrics lookup for '{song_name}': {e}")
+                errors.append(e)
+                continue
+            for task in tasks:
+                task.cancel()
+            if use_store:
+                await run_in_pool("lyrics", lyrics_store().put, song_name, lyrics)
             return lyrics
-        else:
-            return f"Could not extract lyrics for '{song_name}' from Genius"
-            
-    except Exception as e:
-        return f"Error extracting lyrics from Genius: {str(e)}"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    # Only report "busy" when no source could even be asked
+    if errors and all(isinstance(e, PoolBusyError) for e in errors):
+        raise errors[0]
+    # Cache the miss only if every source actually answered "not found"
+    if use_store and sources and not any(isinstance(e, (SourceUnavailable, PoolBusyError)) for e in errors):
+        await run_in_pool("lyrics", lyrics_store().put_miss, song_name)
+    raise LyricsNotFound(f"No lyrics found for '{song_name}'")
 
 def get_lyrics(song_name: str) -> str:
     """
     Get lyrics for a song by trying multiple sources
-    
+
+    Blocking wrapper around find_lyrics for callers without an event loop.
+
     Args:
         song_name: Name of the song (can include artist)
-        
+
     Returns:
-        Lyrics as text or error message
-    """
-    # Try AZLyrics first
-    lyrics = extract_lyrics_from_azlyrics(song_name)
-    
-    # If AZLyrics fails, try Genius
-    if "Error extracting lyrics" in lyrics or "No lyrics found" in lyrics or "Could not extract lyrics" in lyrics:
-        lyrics = extract_lyrics_from_genius(song_name)
-    
-    return lyrics
+        Lyrics as text
 
+    Raises:
+        LyricsNotFound: If no source returned lyrics in time
+    """
+    return asyncio.run(find_lyrics(song_name))
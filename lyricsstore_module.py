@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Lyrics Store Module for Telegram Bot
+- Keep fetched lyrics in a local SQLite database
+- Match queries regardless of case, punctuation and word order
+- Fuzzy lookup through a trigram index, short-lived cache of failed lookups
+"""
+
+import os
+import re
+import time
+import sqlite3
+import threading
+import unicodedata
+from typing import Optional, Set
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+LYRICS_DB = os.getenv("LYRICS_DB", os.path.join(DATA_DIR, "lyrics.sqlite3"))
+
+# Seconds a failed lookup is remembered before the websites are asked again
+MISS_TTL = float(os.getenv("LYRICS_MISS_TTL", "600"))
+# Smallest trigram similarity (0..1) accepted as the same song
+FUZZY_THRESHOLD = float(os.getenv("LYRICS_FUZZY_THRESHOLD", "0.7"))
+# Number of best trigram candidates scored per fuzzy lookup
+FUZZY_CANDIDATES = 20
+
+# Words users add to a query that do not identify the song
+_FILLER_WORDS = {"lyrics", "lyric", "by", "song", "the", "official", "video", "audio", "ft", "feat"}
+_NON_WORD_RE = re.compile(r"[^\w\s]+")
+# Words that tell different recordings or parts of a song apart; a fuzzy
+# match must agree on them, as well as on numbers and roman numerals
+_VARIANT_WORDS = {
+    "remix", "mix", "live", "acoustic", "instrumental", "remastered", "remaster", "cover", "edit",
+    "version", "unplugged", "demo", "karaoke", "reprise", "slowed", "reverb", "sped", "extended",
+}
+# Well-formed Roman numerals up to 39 (part and volume numbers); larger ones
+# would also match words such as "mi", "li" or "di"
+_ROMAN_NUMERAL_RE = re.compile(r"^(?=[ivx])x{0,3}(ix|iv|v?i{0,3})$")
+# The pronoun "I" and the "x" of collaborations ("A x B") are words, not numbers
+_NOT_NUMERALS = {"i", "x"}
+
+
+def normalize_query(query: str) -> str:
+    """
+    Reduce a song query to a key that ignores case, accents, punctuation and word order.
+
+    "Queen - Bohemian Rhapsody" and "bohemian rhapsody queen" both become
+    "bohemian queen rhapsody".
+
+    Args:
+        query: Song name as typed by the user
+
+    Returns:
+        The normalized key (may be empty)
+    """
+    text = unicodedata.normalize("NFKD", query.casefold())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    words = _NON_WORD_RE.sub(" ", text).split()
+    kept = [word for word in words if word not in _FILLER_WORDS] or words
+    return " ".join(sorted(set(kept)))
+
+
+def trigrams(key: str) -> Set[str]:
+    """Return the padded character trigrams of each word in a normalized key."""
+    grams = set()
+    for word in key.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def distinguishing_words(key: str) -> Set[str]:
+    """
+    Return the words of a normalized key that a fuzzy match must not change.
+
+    "song part 1" and "song part 2" share most trigrams but are different
+    songs, as are "song" and "song remix".
+    """
+    return {
+        word for word in key.split()
+        if word in _VARIANT_WORDS or any(ch.isdigit() for ch in word)
+        or (word not in _NOT_NUMERALS and _ROMAN_NUMERAL_RE.match(word))
+    }
+
+
+class LyricsStore:
+    """
+    A persistent lyrics cache with exact and fuzzy lookup.
+
+    Lyrics are stored under the normalized query key. A lookup first tries
+    the exact key, then scores the stored keys that share the most trigrams
+    with it and accepts the best one above FUZZY_THRESHOLD (Dice
+    coefficient) whose numbers and version words (remix, live, ...) are
+    the same as the query's. Queries no website could answer are kept for MISS_TTL
+    seconds so repeated requests for them do not scrape again.
+    """
+
+    def __init__(self, path: str = LYRICS_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS lyrics (
+                    key TEXT PRIMARY KEY,
+                    query TEXT NOT NULL,
+                    lyrics TEXT NOT NULL,
+                    trigram_count INTEGER NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS lyrics_trigrams (
+                    trigram TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    PRIMARY KEY (trigram, key)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS lyrics_misses (
+                    key TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL
+                );
+                """
+            )
+
+    def get(self, query: str) -> Optional[str]:
+        """
+        Look up stored lyrics for a query, exactly or by trigram similarity.
+
+        Returns:
+            The lyrics, or None if nothing similar enough is stored
+        """
+        key = normalize_query(query)
+        if not key:
+            return None
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT lyrics FROM lyrics WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                key = self._fuzzy_key(key)
+                if key is None:
+                    return None
+                row = self._conn.execute("SELECT lyrics FROM lyrics WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("UPDATE lyrics SET hits = hits + 1 WHERE key = ?", (key,))
+        return row[0]
+
+    def _fuzzy_key(self, key: str) -> Optional[str]:
+        """Return the stored key most similar to key, if it passes FUZZY_THRESHOLD."""
+        grams = trigrams(key)
+        required = distinguishing_words(key)
+        if not grams:
+            return None
+        placeholders = ",".join("?" * len(grams))
+        rows = self._conn.execute(
+            f"""
+            SELECT t.key, COUNT(*) AS shared, l.trigram_count
+            FROM lyrics_trigrams t JOIN lyrics l ON l.key = t.key
+            WHERE t.trigram IN ({placeholders})
+            GROUP BY t.key
+            ORDER BY shared DESC
+            LIMIT ?
+            """,
+            (*grams, FUZZY_CANDIDATES),
+        ).fetchall()
+        best_key, best_score = None, FUZZY_THRESHOLD
+        for candidate, shared, count in rows:
+            if distinguishing_words(candidate) != required:
+                continue
+            score = 2.0 * shared / (len(grams) + count)
+            if score >= best_score:
+                best_key, best_score = candidate, score
+        return best_key
+
+    def put(self, query: str, lyrics: str) -> None:
+        """Store lyrics fetched for a query and clear any cached miss."""
+        key = normalize_query(query)
+        if not key:
+            return
+        grams = trigrams(key)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO lyrics (key, query, lyrics, trigram_count, fetched_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    query = excluded.query,
+                    lyrics = excluded.lyrics,
+                    fetched_at = excluded.fetched_at
+                """,
+                (key, query, lyrics, len(grams), time.time()),
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO lyrics_trigrams (trigram, key) VALUES (?, ?)",
+                ((gram, key) for gram in grams),
+            )
+            self._conn.execute("DELETE FROM lyrics_misses WHERE key = ?", (key,))
+
+    def is_known_miss(self, query: str) -> bool:
+        """Check whether a query recently failed on every source."""
+        key = normalize_query(query)
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT expires_at FROM lyrics_misses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return False
+            if row[0] > time.time():
+                return True
+            self._conn.execute("DELETE FROM lyrics_misses WHERE key = ?", (key,))
+        return False
+
+    def put_miss(self, query: str, ttl: float = MISS_TTL) -> None:
+        """Remember for ttl seconds that no source had lyrics for a query."""
+        key = normalize_query(query)
+        if not key:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO lyrics_misses (key, expires_at) VALUES (?, ?)",
+                (key, time.time() + ttl),
+            )
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+HTML Parsing Module for Telegram Bot
+- Build only the part of a page a scraper needs
+- Shared selectors for the lyrics and currency scrapers
+- Use lxml when it is installed, html.parser otherwise
+"""
+
+import os
+import re
+from typing import List, NamedTuple, Optional, Union
+from bs4 import BeautifulSoup, SoupStrainer, Tag
+
+try:
+    import lxml  # noqa: F401
+    _DEFAULT_PARSER = "lxml"
+except ImportError:
+    _DEFAULT_PARSER = "html.parser"
+
+# Tree builder used by BeautifulSoup: "lxml" (faster, optional) or "html.parser"
+HTML_PARSER = os.getenv("HTML_PARSER", _DEFAULT_PARSER)
+
+Markup = Union[str, bytes]
+
+
+class Selector(NamedTuple):
+    """
+    The elements to keep while parsing a page, and how to pick results from them.
+
+    strainer limits the parse tree to matching elements and their children;
+    everything else on the page is skipped while parsing. css, if given, is
+    applied to that reduced tree.
+    """
+    strainer: SoupStrainer
+    css: Optional[str] = None
+
+
+def has_class(*names: str) -> "re.Pattern[str]":
+    """
+    Match elements carrying any of the given CSS classes.
+
+    While a page is being parsed, a strainer sees the raw class attribute
+    ("text-left visitedlyr"), so a plain string would only match elements
+    with exactly that one class.
+    """
+    alternatives = "|".join(re.escape(name) for name in names)
+    return re.compile(rf"(?:^|\s)(?:{alternatives})(?:\s|$)")
+
+
+# AZLyrics: search result links, and the lyrics div (the only div without attributes)
+AZLYRICS_RESULTS = Selector(SoupStrainer("td", class_=has_class("text-left")), "td.text-left a")
+AZLYRICS_LYRICS = Selector(SoupStrainer("div", attrs={"class": None, "id": None, "style": None}))
+
+# Genius: search result cards, and the lyrics containers
+GENIUS_RESULTS = Selector(SoupStrainer("a", class_=has_class("mini_card")), "a.mini_card")
+GENIUS_LYRICS = Selector(
+    SoupStrainer("div", class_=re.compile("Lyrics__Container")), 'div[class*="Lyrics__Container"]'
+)
+
+# sp-today: the market price cards and the local currency table
+SPTODAY_RATES = Selector(SoupStrainer(["div", "table"], class_=has_class("item-data", "local-cur")))
+
+
+def parse(markup: Markup, selector: Optional[Selector] = None, parser: Optional[str] = None) -> BeautifulSoup:
+    """
+    Parse a page, keeping only the elements a selector needs.
+
+    Args:
+        markup: Page content as text or bytes
+        selector: Elements to keep, or None for the whole page
+        parser: Tree builder, defaults to HTML_PARSER
+
+    Returns:
+        The (reduced) parse tree
+    """
+    strainer = selector.strainer if selector is not None else None
+    return BeautifulSoup(markup, parser or HTML_PARSER, parse_only=strainer)
+
+
+def select(markup: Markup, selector: Selector, parser: Optional[str] = None) -> List[Tag]:
+    """
+    Return every element of a page matching a selector.
+
+    Args:
+        markup: Page content as text or bytes
+        selector: Selector to apply
+        parser: Tree builder, defaults to HTML_PARSER
+
+    Returns:
+        Matching elements in document order
+    """
+    soup = parse(markup, selector, parser)
+    if selector.css is None:
+        return [element for element in soup.contents if isinstance(element, Tag)]
+    return soup.select(selector.css)
+
+
+def select_one(markup: Markup, selector: Selector, parser: Optional[str] = None) -> Optional[Tag]:
+    """Return the first element of a page matching a selector, or None."""
+    soup = parse(markup, selector, parser)
+    if selector.css is None:
+        return soup.find(True)
+    return soup.select_one(selector.css)
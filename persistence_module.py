@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Shared State Persistence Module for Telegram Bot
+- Conversation states and user_data stored in SQLite (WAL mode)
+- One file shared by all bot processes; each user is served by one of them
+- Scale-out workers write the state after every update, so another worker
+  can take over a user's conversations at any step
+"""
+
+import os
+import json
+import time
+import pickle
+import sqlite3
+import logging
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from telegram import Update
+from telegram.ext import Application, BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+STATE_DB = os.getenv("STATE_DB", os.path.join(DATA_DIR, "state.sqlite3"))
+
+
+def _encode_key(key: Tuple[Any, ...]) -> str:
+    """Encode a conversation key such as (chat_id, user_id) as text."""
+    return json.dumps(list(key))
+
+
+def _decode_key(key: str) -> Tuple[Any, ...]:
+    return tuple(json.loads(key))
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Stores user_data, chat_data and conversation states in one SQLite file.
+
+    Every bot process opens the same file; SQLite in WAL mode lets them read
+    while one of them writes. The data is read once, when a process starts,
+    as PTB does with any persistence: a user's updates always go to the same
+    process (see scaleout_module), so no other process changes them while it
+    runs. The process that takes a user over after a restart or a change of
+    the worker count reads the state the previous one wrote.
+
+    Writes go to the database at once; there is no buffer to flush.
+    """
+
+    def __init__(self, path: str = STATE_DB, conversation_ttl: Optional[float] = None):
+        """
+        Args:
+            path: SQLite file shared by all bot processes
+            conversation_ttl: Seconds after their last write conversations are
+                not resumed on start (None keeps them all)
+        """
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=True, callback_data=False),
+            update_interval=60,
+        )
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.conversation_ttl = conversation_ttl
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_data "
+            "(user_id INTEGER PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chat_data "
+            "(chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS conversations (
+                name TEXT NOT NULL,
+                key TEXT NOT NULL,
+                state TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (name, key)
+            ) WITHOUT ROWID
+            """
+        )
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        """Run one statement under the connection lock."""
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    # Loading
+
+    def _load_table(self, table: str, column: str) -> Dict[int, Dict[Any, Any]]:
+        rows = self._execute(f"SELECT {column}, data FROM {table}").fetchall()
+        return {row_id: pickle.loads(data) for row_id, data in rows}
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        return self._load_table("user_data", "user_id")
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return self._load_table("chat_data", "chat_id")
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[Tuple[Any, ...], object]:
+        # Conversations abandoned while the bot was down would never time out
+        if self.conversation_ttl is not None:
+            self.expire_conversations(time.time() - self.conversation_ttl)
+        rows = self._execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        return {_decode_key(key): json.loads(state) for key, state in rows}
+
+    # Writing
+
+    def _put(self, table: str, column: str, row_id: int, data: Dict[Any, Any]) -> None:
+        if data:
+            self._execute(
+                f"INSERT INTO {table} ({column}, data, updated_at) VALUES (?, ?, ?) "
+                f"ON CONFLICT({column}) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                (row_id, pickle.dumps(data, pickle.HIGHEST_PROTOCOL), time.time()),
+            )
+        else:
+            self._execute(f"DELETE FROM {table} WHERE {column} = ?", (row_id,))
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        self._put("user_data", "user_id", user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        self._put("chat_data", "chat_id", chat_id, data)
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key: Tuple[Any, ...], new_state: Optional[object]) -> None:
+        if new_state is None:
+            self._execute("DELETE FROM conversations WHERE name = ? AND key = ?", (name, _encode_key(key)))
+            return
+        self._execute(
+            "INSERT INTO conversations (name, key, state, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(name, key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (name, _encode_key(key), json.dumps(new_state), time.time()),
+        )
+
+    def expire_conversations(self, before: float) -> int:
+        """
+        Delete conversations whose state was last written before a time.
+
+        Args:
+            before: UNIX time
+
+        Returns:
+            Number of conversations deleted
+        """
+        return self._execute("DELETE FROM conversations WHERE updated_at < ?", (before,)).rowcount
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._execute("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._execute("DELETE FROM chat_data WHERE chat_id = ?", (chat_id,))
+
+    # Refreshing: the process serving a user holds the current data already
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Close the database; every write was already committed."""
+        with self._lock:
+            self._conn.close()
+
+
+class SharedStateApplication(Application):
+    """
+    Application that can write its state after every update.
+
+    By default the persistence is written on PTB's periodic timer. A
+    scale-out worker sets write_through, so that the worker started in place
+    of a crashed one resumes every conversation from its last finished step.
+    It also tracks which users have an update in progress, whose data a
+    handler may be using.
+    """
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.write_through = False
+        # Called with each update once it is handled and, with write_through, written
+        self.after_update: Optional[Callable[[object], None]] = None
+        # user_id -> number of their updates being processed
+        self._busy: Counter = Counter()
+
+    def busy_users(self) -> Set[int]:
+        """Return the users with an update in progress."""
+        return set(self._busy)
+
+    async def process_update(self, update: object) -> None:
+        user_id = update.effective_user.id if isinstance(update, Update) and update.effective_user else None
+        if user_id is not None:
+            self._busy[user_id] += 1
+        try:
+            await super().process_update(update)
+            if self.write_through and self.persistence is not None:
+                await self.update_persistence()
+        finally:
+            if user_id is not None:
+                self._busy[user_id] -= 1
+                if self._busy[user_id] <= 0:
+                    del self._busy[user_id]
+            if self.after_update is not None:
+                self.after_update(update)
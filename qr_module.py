@@ -8,49 +8,144 @@ QR Code Module for Telegram Bot
 """
 
 import os
+import threading
 import qrcode
 import cv2
 import numpy as np
 from PIL import Image
 from io import BytesIO
+from typing import Dict, List, Optional
 
-def generate_qr_code(text: str) -> BytesIO:
-    """Generate a QR code from text and return it as a BytesIO object."""
+from cache_module import ByteLRUCache, DiskLRUStore, make_key
+from decode_module import imdecode
+
+# QR parameters: (version, error correction, box size, border)
+QR_PARAMS = (1, qrcode.constants.ERROR_CORRECT_L, 10, 4)
+
+# Rendered QR codes are cached by text and parameters
+QR_CACHE_MAX_BYTES = int(os.getenv("QR_CACHE_MB", "16")) * 1024 * 1024
+QR_CACHE_DIR = os.getenv("QR_CACHE_DIR")
+QR_CACHE_DISK_MAX_BYTES = int(os.getenv("QR_CACHE_DISK_MB", "128")) * 1024 * 1024
+
+_qr_cache = ByteLRUCache(
+    QR_CACHE_MAX_BYTES,
+    disk=DiskLRUStore(QR_CACHE_DIR, QR_CACHE_DISK_MAX_BYTES, suffix=".png") if QR_CACHE_DIR else None,
+)
+
+def _render_qr_code(text: str, version: int, error_correction: int, box_size: int, border: int) -> bytes:
+    """Build the QR matrix for text and encode it as PNG bytes."""
     qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
+        version=version,
+        error_correction=error_correction,
+        box_size=box_size,
+        border=border,
     )
     qr.add_data(text)
     qr.make(fit=True)
 
     img = qr.make_image(fill_color="black", back_color="white")
-    
+
     # Save the image to a BytesIO object
     bio = BytesIO()
-    bio.name = 'qrcode.png'
     img.save(bio, 'PNG')
-    bio.seek(0)
-    
+    return bio.getvalue()
+
+def qr_content_key(text: str) -> str:
+    """Return a key identifying the QR image generated for text."""
+    return make_key("qr", text, *QR_PARAMS)
+
+def generate_qr_code(text: str) -> BytesIO:
+    """Generate a QR code from text and return it as a BytesIO object."""
+    key = qr_content_key(text)
+
+    png = _qr_cache.get(key)
+    if png is None:
+        png = _render_qr_code(text, *QR_PARAMS)
+        _qr_cache.put(key, png)
+
+    bio = BytesIO(png)
+    bio.name = 'qrcode.png'
     return bio
 
+def qr_cache_stats() -> Dict[str, int]:
+    """Return hit, miss and size counters of the QR render cache."""
+    return _qr_cache.stats()
+
+# Longest image side tried at each step of the pyramid; None means full size
+PYRAMID = (640, 1280, None)
+
+_local = threading.local()
+
+def _detector() -> cv2.QRCodeDetector:
+    """Return the QR detector of the current worker thread, creating it once."""
+    detector = getattr(_local, "detector", None)
+    if detector is None:
+        detector = _local.detector = cv2.QRCodeDetector()
+    return detector
+
+def _fit(img: np.ndarray, max_side: Optional[int]) -> np.ndarray:
+    """Downscale an image so its longest side is at most max_side."""
+    if max_side is None or max(img.shape[:2]) <= max_side:
+        return img
+    scale = max_side / max(img.shape[:2])
+    size = (max(1, int(img.shape[1] * scale)), max(1, int(img.shape[0] * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+def _decode_level(img: np.ndarray, multi: bool) -> List[str]:
+    """Run the detector on one pyramid level and return the decoded strings."""
+    detector = _detector()
+    codes = []
+    if multi:
+        ok, decoded, _, _ = detector.detectAndDecodeMulti(img)
+        if ok:
+            codes = [text for text in decoded if text]
+    if not codes:
+        data, bbox, _ = detector.detectAndDecode(img)
+        if bbox is not None and data:
+            codes = [data]
+    # Keep the first occurrence of each code
+    return list(dict.fromkeys(codes))
+
+def read_qr_codes(image_data: bytes, multi: bool = True) -> List[str]:
+    """
+    Read every QR code in an image.
+
+    The image is decoded as grayscale and tried at increasing resolutions,
+    starting small; larger levels are only decoded when the smaller one
+    finds nothing. JPEG levels use OpenCV's reduced decoding directly.
+
+    Args:
+        image_data: Image data as bytes
+        multi: Whether to look for several codes in the image
+
+    Returns:
+        List of decoded texts, in detection order
+
+    Raises:
+        ValueError: If no QR code is found
+    """
+    is_jpeg = image_data[:3] == b"\xff\xd8\xff"
+    full = None
+
+    for max_side in PYRAMID:
+        if is_jpeg:
+            # Decode within the per-job memory budget, reduced when possible
+            img = _fit(imdecode(image_data, grayscale=True, max_side=max_side), max_side)
+        else:
+            if full is None:
+                full = imdecode(image_data, grayscale=True)
+            img = _fit(full, max_side)
+
+        codes = _decode_level(img, multi)
+        if codes:
+            return codes
+
+        # Nothing bigger to try once the whole image has been scanned
+        if max_side is None or max(img.shape[:2]) < max_side:
+            break
+
+    raise ValueError("No QR code found in the image")
+
 def read_qr_code(image_data: bytes) -> str:
     """Read a QR code from an image and return the decoded text."""
-    # Convert bytes to numpy array
-    nparr = np.frombuffer(image_data, np.uint8)
-    
-    # Decode image
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    
-    # Initialize QR code detector
-    detector = cv2.QRCodeDetector()
-    
-    # Detect and decode
-    data, bbox, _ = detector.detectAndDecode(img)
-    
-    if bbox is not None:
-        return data
-    else:
-        raise ValueError("No QR code found in the image")
-
+    return read_qr_codes(image_data, multi=False)[0]
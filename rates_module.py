@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Exchange Rates Module for Telegram Bot
+- One interface for every rate source (sp-today scraper, currency APIs)
+- Fetch all sources concurrently and merge them into an immutable snapshot
+- Render /dollar replies from the snapshot without any network call
+- Share the snapshot with other bot processes through a file
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from dollar import RatesUnavailable, fetch_rates_from_sptoday, format_rates
+from dollarprice import dollar as fetch_currencyfreaks, price as fetch_exchangerate_api
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background refreshes, and the age after which rates are marked stale
+REFRESH_INTERVAL = float(os.getenv("RATES_REFRESH_INTERVAL", "300"))
+STALE_AFTER = float(os.getenv("RATES_STALE_AFTER", str(3 * REFRESH_INTERVAL)))
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# Written by the process that fetches the rates, read by the other bot processes
+SNAPSHOT_FILE = os.getenv("RATES_SNAPSHOT_FILE", os.path.join(DATA_DIR, "rates_snapshot.json"))
+
+SPTODAY = "sp-today"
+
+
+class RateProvider(NamedTuple):
+    """A rate source: fetch() returns {name: value} and raises on failure."""
+    name: str
+    label: str
+    fetch: Callable[[], Dict[str, Optional[str]]]
+
+
+class RateQuote(NamedTuple):
+    """The values one provider returned, and when."""
+    source: str
+    label: str
+    fetched_at: float
+    values: Tuple[Tuple[str, Optional[str]], ...]
+
+
+class RateSnapshot(NamedTuple):
+    """The latest quote of every provider; never modified after creation."""
+    quotes: Tuple[RateQuote, ...]
+    fetched_at: float
+    text: str
+
+    def quote(self, source: str) -> Optional[RateQuote]:
+        """Return the quote of a provider, or None if it never answered."""
+        for quote in self.quotes:
+            if quote.source == source:
+                return quote
+        return None
+
+    @property
+    def buy(self) -> Optional[str]:
+        """Damascus USD buy price from sp-today."""
+        quote = self.quote(SPTODAY)
+        return dict(quote.values).get("buy") if quote else None
+
+    @property
+    def sell(self) -> Optional[str]:
+        """Damascus USD sell price from sp-today."""
+        quote = self.quote(SPTODAY)
+        return dict(quote.values).get("sell") if quote else None
+
+    @property
+    def market(self) -> Tuple[Tuple[str, Optional[str]], ...]:
+        """Damascus market prices from sp-today as (label, value) pairs."""
+        quote = self.quote(SPTODAY)
+        if quote is None:
+            return ()
+        return tuple((name, value) for name, value in quote.values if name not in ("buy", "sell"))
+
+
+def _sptoday() -> Dict[str, Optional[str]]:
+    """Flatten the sp-today rates into one dict."""
+    rates = fetch_rates_from_sptoday()
+    values = {"buy": rates["buy"], "sell": rates["sell"]}
+    values.update(rates["market"])
+    return values
+
+
+def _api(fetch: Callable[[], Dict]) -> Callable[[], Dict[str, Optional[str]]]:
+    """Adapt a JSON rate API returning {"SYP": ..., "EUR": ...} per USD."""
+    def fetch_values() -> Dict[str, Optional[str]]:
+        rates = fetch()
+        if not any(rates.values()):
+            raise RatesUnavailable("The rate API returned no rates")
+        return {name: None if value is None else str(value) for name, value in rates.items()}
+    return fetch_values
+
+
+def default_providers() -> List[RateProvider]:
+    """
+    Return the configured providers.
+
+    The JSON APIs are only used when their key is set in the environment
+    (CURRENCYFREAKS_API_KEY, EXCHANGERATE_API_KEY).
+    """
+    providers = [RateProvider(SPTODAY, "sp-today", _sptoday)]
+    if os.getenv("CURRENCYFREAKS_API_KEY"):
+        providers.append(RateProvider("currencyfreaks", "CurrencyFreaks", _api(fetch_currencyfreaks)))
+    if os.getenv("EXCHANGERATE_API_KEY"):
+        providers.append(RateProvider("exchangerate-api", "ExchangeRate-API", _api(fetch_exchangerate_api)))
+    return providers
+
+
+def _format_age(seconds: float) -> str:
+    """Describe an age in seconds as a short Arabic phrase."""
+    if seconds < 60:
+        return "الآن"
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"منذ {minutes} دقيقة"
+    hours = minutes // 60
+    if hours < 24:
+        return f"منذ {hours} ساعة"
+    return f"منذ {hours // 24} يوم"
+
+
+def _format_snapshot(quotes: Tuple[RateQuote, ...]) -> str:
+    """Render the parts of the reply that do not depend on the current time."""
+    parts = []
+    for quote in quotes:
+        values = dict(quote.values)
+        if quote.source == SPTODAY:
+            market = {name: value for name, value in quote.values if name not in ("buy", "sell")}
+            parts.append(format_rates(values.get("buy"), values.get("sell"), market))
+        else:
+            lines = [f"\n🏦 السعر الرسمي ({quote.label}):"]
+            lines += [f"{name}: {value or 'غير متوفر'}" for name, value in quote.values]
+            parts.append("\n".join(lines) + "\n")
+    return "".join(parts)
+
+
+class RatesBoard:
+    """
+    Holds the latest merged rate snapshot.
+
+    refresh() asks every provider at the same time. A provider that fails
+    keeps its previous quote, so each part of the snapshot carries its own
+    age. The new snapshot is built completely and swapped in with one
+    assignment, so readers always see a consistent set of rates and never
+    wait for a fetch. The reply text is rendered once per snapshot.
+
+    With a path, every new snapshot is also written to that file, and
+    sync() loads the one another process wrote, so only one process of a
+    scale-out deployment has to fetch.
+    """
+
+    def __init__(self, providers: Optional[List[RateProvider]] = None, stale_after: float = STALE_AFTER,
+                 path: Optional[str] = None):
+        """
+        Args:
+            providers: Rate sources, defaults to default_providers() on first refresh
+            stale_after: Age in seconds after which a quote is marked stale
+            path: File the snapshot is shared through, or None to keep it in memory only
+        """
+        self.providers = providers
+        self.stale_after = stale_after
+        self.path = path
+        # Modification time of the snapshot file when it was last loaded
+        self._synced = None
+        self._snapshot: Optional[RateSnapshot] = None
+        self._refresh_lock = threading.Lock()
+        # When the last refresh (successful or not) finished
+        self._attempted_at = 0.0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.refreshes = 0
+        self.failures = 0
+
+    @property
+    def snapshot(self) -> Optional[RateSnapshot]:
+        """The latest snapshot, or None before the first successful refresh."""
+        return self._snapshot
+
+    def _fetch_all(self) -> Dict[str, RateQuote]:
+        """Fetch every provider concurrently and return the quotes that succeeded."""
+        if self.providers is None:
+            self.providers = default_providers()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=len(self.providers), thread_name_prefix="rates")
+
+        futures = {provider: self._executor.submit(provider.fetch) for provider in self.providers}
+        quotes = {}
+        for provider, future in futures.items():
+            try:
+                values = future.result()
+            except Exception as e:
+                logger.warning(f"Rate provider {provider.name} failed: {e}")
+                continue
+            quotes[provider.name] = RateQuote(provider.name, provider.label, time.time(), tuple(values.items()))
+        return quotes
+
+    def refresh(self) -> RateSnapshot:
+        """
+        Fetch all providers and publish the merged result as the new snapshot.
+
+        Concurrent calls share one fetch: a caller that finds a refresh in
+        progress waits for it and returns its outcome. If every provider
+        fails, the previous snapshot is kept as it is, so its age (and
+        is_stale) still tells when the rates were last fetched.
+
+        Raises:
+            RatesUnavailable: If no provider has ever answered
+        """
+        started = time.time()
+        with self._refresh_lock:
+            current = self._snapshot
+            if self._attempted_at >= started:
+                if current is None:
+                    raise RatesUnavailable("No exchange rate source is available")
+                return current
+
+            fresh = self._fetch_all()
+            self._attempted_at = time.time()
+            if not fresh:
+                self.failures += 1
+                if current is None:
+                    raise RatesUnavailable("No exchange rate source is available")
+                return current
+
+            # Keep the previous quote of every provider that failed this time
+            previous = {quote.source: quote for quote in current.quotes} if current else {}
+            quotes = tuple(
+                fresh.get(provider.name) or previous[provider.name]
+                for provider in self.providers
+                if provider.name in fresh or provider.name in previous
+            )
+            snapshot = RateSnapshot(quotes=quotes, fetched_at=time.time(), text=_format_snapshot(quotes))
+            self._snapshot = snapshot
+            self.refreshes += 1
+            self._save(snapshot)
+            return snapshot
+
+    def _save(self, snapshot: RateSnapshot) -> None:
+        """Write a snapshot to the shared file, replacing the previous one atomically."""
+        if self.path is None:
+            return
+        data = {
+            "fetched_at": snapshot.fetched_at,
+            "quotes": [
+                {"source": q.source, "label": q.label, "fetched_at": q.fetched_at, "values": q.values}
+                for q in snapshot.quotes
+            ],
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save the rate snapshot: {e}")
+
+    def sync(self) -> bool:
+        """
+        Load the snapshot another process wrote, if the file changed since the last load.
+
+        Returns:
+            True if a new snapshot was loaded
+        """
+        if self.path is None:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self._synced:
+                return False
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            quotes = tuple(
+                RateQuote(q["source"], q["label"], q["fetched_at"], tuple((name, value) for name, value in q["values"]))
+                for q in data["quotes"]
+            )
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Could not read the rate snapshot: {e}")
+            return False
+        self._snapshot = RateSnapshot(quotes=quotes, fetched_at=data["fetched_at"], text=_format_snapshot(quotes))
+        self._synced = mtime
+        return True
+
+    def is_stale(self, snapshot: RateSnapshot, now: Optional[float] = None) -> bool:
+        """Check whether the last refresh of a snapshot is older than stale_after."""
+        return (now or time.time()) - snapshot.fetched_at > self.stale_after
+
+    def render(self, snapshot: RateSnapshot, now: Optional[float] = None) -> str:
+        """Return the /dollar reply for a snapshot, with the age of every source and stale markers."""
+        now = now or time.time()
+        lines = ["\n🕒 آخر تحديث:"]
+        stale = False
+        for quote in snapshot.quotes:
+            age = now - quote.fetched_at
+            marker = " ⚠️" if age > self.stale_after else ""
+            stale = stale or bool(marker)
+            lines.append(f"{quote.label}: {_format_age(age)}{marker}")
+        if stale:
+            lines.append("⚠️ قد تكون بعض هذه الأسعار قديمة، تعذر تحديثها مؤخراً")
+        return snapshot.text + "\n".join(lines)
+
+    def close(self) -> None:
+        """Stop the provider threads."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+RATES = RatesBoard(path=SNAPSHOT_FILE)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Scale-out Module for Telegram Bot
+- One dispatcher process receives the updates (polling or webhook)
+- Updates are fanned out to N worker processes running the full bot
+- Each user is served by one worker, which owns their conversation state
+- Workers that exit are restarted and resume their users' state from STATE_DB
+"""
+
+import os
+import sys
+import json
+import signal
+import asyncio
+import logging
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes; 1 runs the whole bot in a single process
+SCALE_WORKERS = max(1, int(os.getenv("SCALE_WORKERS", "1")))
+
+# Set by the dispatcher in the environment of each worker
+WORKER_INDEX_ENV = "BOT_WORKER_INDEX"
+# File descriptor a worker reports finished update ids on
+WORKER_ACK_FD_ENV = "BOT_WORKER_ACK_FD"
+
+# Seconds a worker gets to finish its updates after its input is closed
+WORKER_STOP_GRACE = 15.0
+RESTART_DELAY = 1.0
+# Updates held for a restarting worker; older ones are dropped beyond this
+BACKLOG_LIMIT = 1000
+
+
+def worker_index() -> Optional[int]:
+    """Return the index of this worker process, or None outside a scale-out worker."""
+    value = os.getenv(WORKER_INDEX_ENV)
+    return int(value) if value is not None else None
+
+
+def is_primary() -> bool:
+    """Check whether this process does the once-per-deployment work (e.g. recording rate history)."""
+    return (worker_index() or 0) == 0
+
+
+class Worker:
+    """
+    A bot worker process fed with one JSON update per line on its stdin.
+
+    The worker reports the id of every update it finished, state written,
+    on a separate pipe. Updates it did not report when it exits, and those
+    sent while it is down, are kept in a backlog and written, in order, as
+    soon as it is running again. An update the worker handled but could not
+    report in time is handled twice.
+    """
+
+    def __init__(self, index: int, command: List[str]):
+        self.index = index
+        self.command = command
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.acks: Optional[asyncio.StreamReader] = None
+        # update_id -> line of updates sent but not finished, in sending order
+        self.pending: "OrderedDict[int, bytes]" = OrderedDict()
+        self.backlog: List[Tuple[int, bytes]] = []
+        self.forwarded = 0
+        self.dropped = 0
+        self.restarts = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self) -> None:
+        read_fd, write_fd = os.pipe()
+        env = dict(os.environ, **{WORKER_INDEX_ENV: str(self.index), WORKER_ACK_FD_ENV: str(write_fd)})
+        # A new session keeps Ctrl-C in the terminal from reaching the workers;
+        # the dispatcher stops them by closing their input
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *self.command, stdin=asyncio.subprocess.PIPE, env=env, start_new_session=True,
+                pass_fds=(write_fd,),
+            )
+        finally:
+            os.close(write_fd)
+        # Written before anything else can be sent, so the order is kept
+        for update_id, line in self.backlog:
+            self.pending[update_id] = line
+            self.process.stdin.write(line)
+        self.backlog.clear()
+        self.acks = asyncio.StreamReader()
+        await asyncio.get_running_loop().connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(self.acks), os.fdopen(read_fd, "rb")
+        )
+        logger.info(f"Started bot worker {self.index} (pid {self.process.pid})")
+
+    async def send(self, update: Update) -> None:
+        line = update.to_json().encode() + b"\n"
+        if not self.alive:
+            self._hold(update.update_id, line)
+            return
+        # A write to a process that just died may be lost; it stays pending until finished
+        self.pending[update.update_id] = line
+        self.forwarded += 1
+        try:
+            self.process.stdin.write(line)
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.warning(f"Bot worker {self.index} exited, holding its updates until it restarts")
+
+    def _hold(self, update_id: int, line: bytes) -> None:
+        if len(self.backlog) >= BACKLOG_LIMIT:
+            self.backlog.pop(0)
+            self.dropped += 1
+        self.backlog.append((update_id, line))
+
+    async def read_acks(self) -> None:
+        """Forget the updates the worker reports as finished, until it exits."""
+        while True:
+            line = await self.acks.readline()
+            if not line:
+                return
+            self.pending.pop(int(line), None)
+
+    def requeue(self) -> None:
+        """Put the updates an exited worker did not finish in front of the backlog."""
+        unfinished = list(self.pending.items())
+        self.pending.clear()
+        self.backlog[:0] = unfinished
+        if unfinished:
+            logger.warning(f"Bot worker {self.index} exited with {len(unfinished)} unfinished update(s)")
+
+    async def stop(self) -> None:
+        if not self.alive:
+            return
+        self.process.stdin.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), WORKER_STOP_GRACE)
+        except asyncio.TimeoutError:
+            logger.warning(f"Bot worker {self.index} did not stop, killing it")
+            self.process.kill()
+            await self.process.wait()
+
+
+class Dispatcher:
+    """
+    Fans updates out to worker processes.
+
+    The dispatcher is an Application with a single handler that forwards
+    every update, so it receives updates exactly like the single-process bot
+    (run_polling or run_webhook). It holds no conversation state. A user's
+    updates always go to the same worker, which alone changes their state,
+    so workers never read state another one is about to change. When a
+    worker exits, its users' updates wait for the restarted worker, which
+    reads the state its predecessor wrote; with a different worker count,
+    users move to new workers that read it the same way.
+    """
+
+    def __init__(self, workers: int = SCALE_WORKERS, command: Optional[List[str]] = None):
+        """
+        Args:
+            workers: Number of worker processes
+            command: Command line of a worker, defaults to this script
+        """
+        command = command or [sys.executable, os.path.abspath(sys.argv[0])]
+        self.workers = [Worker(index, command) for index in range(workers)]
+        self._round_robin = itertools.count()
+        self._stopping = False
+        self._monitors: List[asyncio.Task] = []
+
+    def pick(self, update: Update) -> Worker:
+        """Choose the worker for an update: the user's own, or any for updates without a user."""
+        user = update.effective_user
+        if user is not None:
+            return self.workers[user.id % len(self.workers)]
+        alive = [worker for worker in self.workers if worker.alive] or self.workers
+        return alive[next(self._round_robin) % len(alive)]
+
+    async def forward(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Handler that passes an update on to its worker."""
+        if not isinstance(update, Update):
+            return
+        await self.pick(update).send(update)
+
+    async def _monitor(self, worker: Worker) -> None:
+        """Track finished updates and restart the worker whenever it exits, until the dispatcher stops."""
+        while not self._stopping:
+            reader = asyncio.create_task(worker.read_acks())
+            code = await worker.process.wait()
+            await reader
+            if self._stopping:
+                return
+            worker.requeue()
+            logger.error(f"Bot worker {worker.index} exited with code {code}, restarting it")
+            worker.restarts += 1
+            await asyncio.sleep(RESTART_DELAY)
+            await worker.start()
+
+    async def start(self, application: Application) -> None:
+        """post_init hook: start the workers."""
+        for worker in self.workers:
+            await worker.start()
+        self._monitors = [asyncio.create_task(self._monitor(worker)) for worker in self.workers]
+
+    async def stop(self, application: Application) -> None:
+        """post_shutdown hook: let the workers finish and stop them."""
+        self._stopping = True
+        for task in self._monitors:
+            task.cancel()
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+        logger.info("Forwarded updates per worker: " + ", ".join(
+            f"{worker.index}: {worker.forwarded}" for worker in self.workers))
+        dropped = sum(worker.dropped for worker in self.workers)
+        if dropped:
+            logger.warning(f"Dropped {dropped} update(s) while workers were restarting")
+
+    def build_application(self, token: str, configure: Optional[Callable] = None) -> Application:
+        """
+        Create the dispatcher Application.
+
+        Args:
+            token: Bot token
+            configure: Optional function applied to the ApplicationBuilder (e.g. base_url)
+        """
+        builder = Application.builder().token(token).post_init(self.start).post_shutdown(self.stop)
+        if configure is not None:
+            builder = configure(builder)
+        application = builder.build()
+        application.add_handler(TypeHandler(Update, self.forward))
+        return application
+
+
+def serve_worker(application: Application) -> None:
+    """
+    Run a worker: handle the updates the dispatcher writes to stdin until it closes.
+
+    Runs the same start and stop sequence as run_polling, without an updater.
+    """
+    # The dispatcher decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Each finished update is written, so a restarted worker resumes from there
+    application.write_through = True
+    acks = os.fdopen(int(os.environ[WORKER_ACK_FD_ENV]), "wb", buffering=0)
+
+    def acknowledge(update: object) -> None:
+        if isinstance(update, Update):
+            acks.write(f"{update.update_id}\n".encode())
+
+    application.after_update = acknowledge
+
+    async def serve() -> None:
+        await application.initialize()
+        if application.post_init is not None:
+            await application.post_init(application)
+        await application.start()
+        loop = asyncio.get_running_loop()
+        lines: "asyncio.Queue[bytes]" = asyncio.Queue()
+
+        def read_input() -> None:
+            # Blocking reads happen in a thread; the event loop only sees whole lines
+            for line in sys.stdin.buffer:
+                loop.call_soon_threadsafe(lines.put_nowait, line)
+            loop.call_soon_threadsafe(lines.put_nowait, b"")
+
+        threading.Thread(target=read_input, name="worker-input", daemon=True).start()
+        try:
+            while True:
+                line = await lines.get()
+                if not line:
+                    break
+                update = Update.de_json(json.loads(line), application.bot)
+                await application.update_queue.put(update)
+        finally:
+            await application.stop()
+            if application.post_stop is not None:
+                await application.post_stop(application)
+            await application.shutdown()
+            if application.post_shutdown is not None:
+                await application.post_shutdown(application)
+
+    asyncio.run(serve())
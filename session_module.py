@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Session Module for Telegram Bot
+- Compact per-user session state (search results as small tuples)
+- Global memory cap with least-recently-used eviction
+- Timed sweep expiring abandoned sessions
+"""
+
+import os
+import sys
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, MutableMapping, NamedTuple, Optional, Tuple
+
+from persistence_module import SharedStateApplication
+
+logger = logging.getLogger(__name__)
+
+# Seconds a conversation or session may stay untouched before it is dropped
+SESSION_TTL = float(os.getenv("SESSION_TTL", "600"))
+# Memory all sessions of this process may use together
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MEMORY_MB", "8")) * 1024 * 1024
+# Seconds between two expiry sweeps
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+
+# Key of the session in context.user_data
+SESSION_KEY = "session"
+
+
+class SearchResult(NamedTuple):
+    """One song offered for download; only what the buttons and the download need."""
+    title: str
+    uploader: str
+    url: str
+
+
+class Session(NamedTuple):
+    """State of a user between the search and the song selection."""
+    results: Tuple[SearchResult, ...]
+    touched: float
+
+
+def footprint(session: Session) -> int:
+    """Estimate the memory a session occupies in bytes."""
+    size = sys.getsizeof(session) + sys.getsizeof(session.results)
+    for result in session.results:
+        size += sys.getsizeof(result) + sum(sys.getsizeof(field) for field in result)
+    return size
+
+
+class SessionStore:
+    """
+    Keeps sessions in context.user_data, bounded in total size and age.
+
+    Sessions live in user_data so that they are persisted, and a worker
+    taking a user over continues their session. This store accounts for the
+    ones held by this process, in
+    least-recently-used order: storing a session that takes the total over
+    max_bytes evicts the sessions untouched for the longest. A periodic
+    sweep drops sessions older than ttl and user_data entries left empty.
+    """
+
+    def __init__(self, max_bytes: int = SESSION_MAX_BYTES, ttl: float = SESSION_TTL):
+        """
+        Args:
+            max_bytes: Memory all sessions may use together
+            ttl: Seconds a session may stay untouched
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._application: Optional[SharedStateApplication] = None
+        # user_id -> footprint, least recently used first
+        self._sizes: "OrderedDict[int, int]" = OrderedDict()
+        self._size = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def bind(self, application: SharedStateApplication) -> None:
+        """Set the application whose user_data holds the sessions."""
+        self._application = application
+
+    def _account(self, user_id: int, size: int) -> None:
+        """Record a session's size as most recently used."""
+        self._size += size - self._sizes.pop(user_id, 0)
+        self._sizes[user_id] = size
+
+    def _forget(self, user_id: int) -> None:
+        self._size -= self._sizes.pop(user_id, 0)
+
+    def _remove(self, user_id: int, user_data: MutableMapping[Any, Any]) -> None:
+        """Drop a session from user_data and from the persistence."""
+        self._forget(user_id)
+        user_data.pop(SESSION_KEY, None)
+        if self._application is None:
+            return
+        if user_data:
+            self._application.mark_data_for_update_persistence(user_ids=user_id)
+        else:
+            self._application.drop_user_data(user_id)
+
+    def _evict(self) -> None:
+        """Evict least recently used sessions until the total fits max_bytes."""
+        if self._application is None:
+            return
+        # The data of users with an update in progress (the caller's too) is in use by a handler
+        busy = self._application.busy_users()
+        while self._size > self.max_bytes:
+            user_id = next((uid for uid in self._sizes if uid not in busy), None)
+            if user_id is None:
+                return
+            user_data = self._application.user_data.get(user_id)
+            if user_data is None:
+                self._forget(user_id)
+                continue
+            self._remove(user_id, user_data)
+            self.evictions += 1
+
+    def put_results(
+        self, user_data: MutableMapping[Any, Any], user_id: int, results: Iterable[Dict[str, Any]]
+    ) -> Tuple[SearchResult, ...]:
+        """
+        Start a session holding search results.
+
+        Args:
+            user_data: context.user_data of the user
+            user_id: Telegram user id
+            results: Search results as returned by youtube_module.search_youtube
+
+        Returns:
+            The stored results
+        """
+        compact = tuple(
+            SearchResult(str(result["title"]), str(result["uploader"]), str(result["url"])) for result in results
+        )
+        session = Session(compact, time.time())
+        user_data[SESSION_KEY] = session
+        self._account(user_id, footprint(session))
+        self._evict()
+        return compact
+
+    def results(self, user_data: MutableMapping[Any, Any], user_id: int) -> Tuple[SearchResult, ...]:
+        """Return the search results of a user's session, or () if it expired or was evicted."""
+        session = user_data.get(SESSION_KEY)
+        if session is None:
+            return ()
+        if time.time() - session.touched > self.ttl:
+            # Written back with the rest of the user's data after this update
+            self.end(user_data, user_id)
+            self.expirations += 1
+            return ()
+        session = session._replace(touched=time.time())
+        user_data[SESSION_KEY] = session
+        self._account(user_id, footprint(session))
+        return session.results
+
+    def end(self, user_data: MutableMapping[Any, Any], user_id: int) -> None:
+        """Drop a user's session once their conversation is over."""
+        if SESSION_KEY in user_data:
+            self._forget(user_id)
+            user_data.pop(SESSION_KEY)
+
+    async def sweep(self) -> None:
+        """
+        Expire old sessions, drop empty user_data entries and re-count the footprint.
+
+        Conversations expire through their conversation_timeout; ones left
+        over from before a restart are not loaded again (SQLitePersistence).
+        """
+        application = self._application
+        if application is None:
+            return
+        cutoff = time.time() - self.ttl
+        busy = application.busy_users()
+        expired = 0
+        sizes = []
+        for user_id, user_data in list(application.user_data.items()):
+            session = user_data.get(SESSION_KEY)
+            if session is not None and (user_id in busy or session.touched >= cutoff):
+                sizes.append((session.touched, user_id, footprint(session)))
+            elif user_id in busy:
+                continue
+            elif session is not None:
+                self._remove(user_id, user_data)
+                expired += 1
+            elif not user_data:
+                # PTB keeps an empty dict for every user it has seen
+                application.drop_user_data(user_id)
+
+        # Rebuild the LRU order from the touch times
+        self._sizes = OrderedDict((user_id, size) for _, user_id, size in sorted(sizes))
+        self._size = sum(self._sizes.values())
+        self.expirations += expired
+        evictions = self.evictions
+        self._evict()
+
+        await application.update_persistence()
+        if expired or self.evictions > evictions:
+            logger.info(
+                f"Expired {expired} session(s), evicted {self.evictions - evictions}; "
+                f"{len(self._sizes)} session(s) use {self._size} of {self.max_bytes} bytes"
+            )
+
+    def stats(self) -> Dict[str, int]:
+        """Return the current footprint and the expiry and eviction counters."""
+        return {
+            "sessions": len(self._sizes),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+SESSIONS = SessionStore()
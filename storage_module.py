@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Storage Module for Telegram Bot
+- One place that owns the temp directory
+- Private per-job workspaces under a global byte quota
+- Janitor that reclaims files left behind by crashed or killed jobs
+"""
+
+import os
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Temporary directory for downloads and caches
+TEMP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "temp")
+os.makedirs(TEMP_DIR, exist_ok=True)
+
+STORAGE_QUOTA_BYTES = int(os.getenv("STORAGE_QUOTA_MB", "4096")) * 1024 * 1024
+# Workspaces older than this are reclaimed even if their owner still runs
+ORPHAN_MAX_AGE = float(os.getenv("STORAGE_ORPHAN_AGE", "3600"))
+# Put scratch workspaces on tmpfs (/dev/shm) when available
+USE_TMPFS = os.getenv("STORAGE_TMPFS", "0").lower() in ("1", "true", "yes")
+JANITOR_INTERVAL = float(os.getenv("STORAGE_JANITOR_INTERVAL", "600"))
+
+_OWNER_FILE = ".owner"
+
+
+class StorageQuotaExceeded(RuntimeError):
+    """Raised when a new workspace would exceed the storage quota."""
+
+
+def _dir_size(path: str) -> int:
+    """Return the total size of the files below a directory."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def pid_alive(pid: int) -> bool:
+    """Check whether a process id is still running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class StorageManager:
+    """
+    Hands out per-job workspaces and keeps scratch disk use bounded.
+
+    Every job works in its own directory, so jobs never collide on file
+    names. A workspace records the pid that owns it; the janitor removes
+    workspaces whose owner is gone (e.g. a killed download process) or that
+    are older than ORPHAN_MAX_AGE, together with stale temporary files.
+    """
+
+    def __init__(self, root: str, quota_bytes: int, scratch_root: Optional[str] = None):
+        """
+        Args:
+            root: Directory owned by the bot (the temp directory)
+            quota_bytes: Bytes all workspaces together may use
+            scratch_root: Directory for workspaces, e.g. on tmpfs; defaults to root/work
+        """
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.scratch_root = scratch_root or os.path.join(root, "work")
+        os.makedirs(self.scratch_root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._usage = 0
+        self._usage_at = 0.0
+        self._janitor: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def usage(self, max_age: float = 5.0) -> int:
+        """Return the bytes used by all workspaces, recomputed at most every max_age seconds."""
+        with self._lock:
+            if time.monotonic() - self._usage_at > max_age:
+                self._usage = _dir_size(self.scratch_root)
+                self._usage_at = time.monotonic()
+            return self._usage
+
+    @contextmanager
+    def workspace(self, name: str) -> Iterator[str]:
+        """
+        Create a private workspace for one job and remove it afterwards.
+
+        Args:
+            name: Short job name used as directory prefix
+
+        Yields:
+            Path of the workspace directory
+
+        Raises:
+            StorageQuotaExceeded: If the workspaces already use the whole quota
+        """
+        if self.usage() >= self.quota_bytes:
+            raise StorageQuotaExceeded("The server is low on temporary storage. Please try again later.")
+
+        path = tempfile.mkdtemp(prefix=f"{name}-", dir=self.scratch_root)
+        with open(os.path.join(path, _OWNER_FILE), "w") as f:
+            f.write(str(os.getpid()))
+        try:
+            yield path
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _is_orphan(self, path: str, now: float) -> bool:
+        """Check whether a workspace no longer belongs to a running job."""
+        try:
+            age = now - os.stat(path).st_mtime
+        except FileNotFoundError:
+            return False
+        if age > ORPHAN_MAX_AGE:
+            return True
+        try:
+            with open(os.path.join(path, _OWNER_FILE)) as f:
+                return not pid_alive(int(f.read().strip()))
+        except (FileNotFoundError, ValueError):
+            # No owner recorded (yet): only reclaim once it is clearly stale
+            return age > 60
+
+    def cleanup(self) -> int:
+        """
+        Reclaim orphaned workspaces and stale temporary files.
+
+        Returns:
+            The number of bytes freed
+        """
+        now = time.time()
+        freed = 0
+
+        for entry in os.scandir(self.scratch_root):
+            if entry.is_dir(follow_symlinks=False) and self._is_orphan(entry.path, now):
+                size = _dir_size(entry.path)
+                shutil.rmtree(entry.path, ignore_errors=True)
+                freed += size
+
+        # Files written to the temp directory itself belong to no job, and
+        # ".tmp-" files are half-written cache entries of a crashed writer
+        for root, dirs, files in os.walk(self.root):
+            if os.path.abspath(root) == os.path.abspath(self.scratch_root):
+                dirs[:] = []
+                continue
+            top_level = os.path.abspath(root) == os.path.abspath(self.root)
+            if top_level:
+                # Download directories of older versions lived in the temp directory itself
+                for name in [d for d in dirs if d.startswith("download-")]:
+                    dirs.remove(name)
+                    path = os.path.join(root, name)
+                    if self._is_orphan(path, now):
+                        size = _dir_size(path)
+                        shutil.rmtree(path, ignore_errors=True)
+                        freed += size
+            for name in files:
+                path = os.path.join(root, name)
+                if not (top_level or name.startswith(".tmp-")):
+                    continue
+                try:
+                    stat = os.stat(path)
+                    if now - stat.st_mtime > ORPHAN_MAX_AGE:
+                        os.unlink(path)
+                        freed += stat.st_size
+                except FileNotFoundError:
+                    pass
+
+        if freed:
+            logger.info(f"Janitor reclaimed {freed} bytes")
+            with self._lock:
+                self._usage_at = 0.0
+        return freed
+
+    def _janitor_loop(self, interval: float) -> None:
+        """Run cleanup every interval seconds until stopped."""
+        while not self._stop.is_set():
+            try:
+                self.cleanup()
+            except Exception as e:
+                logger.error(f"Janitor run failed: {e}")
+            self._stop.wait(interval)
+
+    def start_janitor(self, interval: float = JANITOR_INTERVAL) -> None:
+        """Start the background janitor thread, if it is not running yet."""
+        if self._janitor is not None and self._janitor.is_alive():
+            return
+        self._stop.clear()
+        self._janitor = threading.Thread(
+            target=self._janitor_loop, args=(interval,), name="storage-janitor", daemon=True
+        )
+        self._janitor.start()
+
+    def stop_janitor(self) -> None:
+        """Stop the background janitor thread."""
+        self._stop.set()
+        if self._janitor is not None:
+            self._janitor.join(timeout=5)
+            self._janitor = None
+
+
+def _scratch_root() -> Optional[str]:
+    """Return the tmpfs scratch directory if enabled and available."""
+    if USE_TMPFS and os.path.isdir("/dev/shm"):
+        return os.path.join("/dev/shm", f"telegram-bot-{os.getuid()}")
+    return None
+
+
+STORAGE = StorageManager(TEMP_DIR, STORAGE_QUOTA_BYTES, scratch_root=_scratch_root())
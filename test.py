@@ -43,7 +43,7 @@ def main():
         for module in missing_modules:
             print(f"  - {module}")
         print("\nPlease install them using:")
-        print("pip install python-telegram-bot qrcode[pil] opencv-python-headless yt-dlp requests beautifulsoup4 pillow python-dotenv")
+        print("pip install 'python-telegram-bot[job-queue,webhooks]' qrcode[pil] opencv-python-headless yt-dlp requests beautifulsoup4 pillow python-dotenv")
         return False
     
     # Check if .env file exists
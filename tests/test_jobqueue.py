@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the download job queue
+Run with: python -m unittest discover tests
+"""
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jobqueue_module
+
+# Stands in for youtube_module in the queue and in its download processes
+FAKE_YOUTUBE = '''
+import time
+
+def extract_video_id(url):
+    return url.rsplit("=", 1)[-1]
+
+def cached_audio(video_id, tier):
+    return None
+
+def download_youtube_audio(url, tier):
+    time.sleep(float(url.rsplit("=", 1)[-1]))
+    return "/dev/null", url
+'''
+
+
+class CrossProcessCancelTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.directory.name, "youtube_module.py"), "w") as f:
+            f.write(FAKE_YOUTUBE)
+        # Download processes inherit sys.path when the fork server starts
+        sys.path.insert(0, self.directory.name)
+        sys.modules.pop("youtube_module", None)
+        jobqueue_module._youtube_module = None
+        self.poll_interval = jobqueue_module.POLL_INTERVAL
+        jobqueue_module.POLL_INTERVAL = 0.2
+
+    def tearDown(self):
+        jobqueue_module.POLL_INTERVAL = self.poll_interval
+        jobqueue_module._youtube_module = None
+        sys.modules.pop("youtube_module", None)
+        sys.path.remove(self.directory.name)
+        self.directory.cleanup()
+
+    def test_cancel_kills_download_run_by_another_queue(self):
+        asyncio.run(self._cancel_across_queues())
+
+    async def _cancel_across_queues(self):
+        path = os.path.join(self.directory.name, "jobs.sqlite3")
+        # Two bot workers sharing one database; only "running" takes jobs
+        submitting = jobqueue_module.DownloadJobQueue(path, workers=1)
+        running = jobqueue_module.DownloadJobQueue(path, workers=1)
+        results = []
+
+        async def deliver(job, file_path, title):
+            results.append(("done", job.id))
+
+        async def fail(job, error):
+            results.append(("failed", job.id))
+
+        await running.start(deliver, fail)
+        try:
+            job_id = await submitting.submit(chat_id=1, user_id=10, url="v=30", tier="mp3")
+            process = None
+            for _ in range(100):
+                process = next((d.process for d in running._downloads.values() if d.process), None)
+                if process is not None:
+                    break
+                await asyncio.sleep(0.1)
+            self.assertIsNotNone(process, "the download never started")
+
+            self.assertEqual(await submitting.cancel_user(10), 1)
+            deadline = time.monotonic() + 10
+            while process.is_alive() and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            self.assertFalse(process.is_alive())
+            self.assertEqual(running._state(job_id), jobqueue_module.CANCELLED)
+
+            # The slot is free again for the next job
+            next_id = await submitting.submit(chat_id=1, user_id=11, url="v=0", tier="mp3")
+            for _ in range(100):
+                if results:
+                    break
+                await asyncio.sleep(0.1)
+            self.assertEqual(results, [("done", next_id)])
+        finally:
+            await running.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
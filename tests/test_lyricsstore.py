@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the lyrics store lookup
+Run with: python -m unittest discover tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lyricsstore_module import LyricsStore, distinguishing_words, normalize_query
+
+
+class LyricsStoreLookupTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = LyricsStore(os.path.join(self.directory.name, "lyrics.sqlite3"))
+        self.store.put("Queen - Bohemian Rhapsody", "Is this the real life?")
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_word_order_and_punctuation_match_exactly(self):
+        self.assertEqual(normalize_query("bohemian rhapsody queen"), normalize_query("Queen - Bohemian Rhapsody"))
+        self.assertEqual(self.store.get("bohemian rhapsody queen"), "Is this the real life?")
+
+    def test_misspelling_matches_fuzzily(self):
+        self.assertEqual(self.store.get("queen bohemian rapsody"), "Is this the real life?")
+
+    def test_other_part_number_does_not_match(self):
+        self.store.put("Artist - Long Song Part 1", "first part")
+        self.assertEqual(self.store.get("artist long song part 1"), "first part")
+        self.assertIsNone(self.store.get("Artist - Long Song Part 2"))
+        self.assertIsNone(self.store.get("Artist - Long Song Part II"))
+
+    def test_words_made_of_numeral_letters_still_match(self):
+        self.store.put("Whitney Houston - I Will Always Love You", "and I")
+        self.assertEqual(self.store.get("whitney houston will always love you"), "and I")
+        self.assertEqual(distinguishing_words(normalize_query("civil lil vic mi ill i x")), set())
+        self.assertEqual(distinguishing_words(normalize_query("song part iv vol xii")), {"iv", "xii"})
+
+    def test_version_word_does_not_match(self):
+        self.assertIsNone(self.store.get("Queen - Bohemian Rhapsody (Live)"))
+
+
+if __name__ == "__main__":
+    unittest.main()
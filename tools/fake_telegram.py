@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Fake Telegram Server
+- Answers the Bot API calls the bot makes (getMe, setWebhook, sendMessage, ...)
+- Posts updates to the webhook the bot registered, with its secret token
+- Checks that updates without the secret are refused
+- Times every update from delivery to the bot's first reply
+
+With --run-bot the bot is started in webhook mode against this server and
+stopped at the end, so one command tests the whole webhook path:
+
+    python tools/fake_telegram.py --run-bot --send /start --send /dollar --burst 50
+
+With --workers N the bot runs as a dispatcher and N worker processes. With
+--kill-workers as well, every worker is killed after the first message, so
+the rest of the conversation is handled by the restarted workers:
+
+    python tools/fake_telegram.py --run-bot --workers 3 --kill-workers --send /qrgen --send hello
+
+Without it the server waits for a bot started by hand:
+
+    python tools/fake_telegram.py --port 8081 --send /start
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_MODE=webhook \\
+        WEBHOOK_URL=http://127.0.0.1:8443 python bot.py
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_TOKEN = "123456:fake-telegram"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class Reply:
+    """A message the bot sent."""
+
+    def __init__(self, chat_id: int, method: str, text: str):
+        self.chat_id = chat_id
+        self.method = method
+        self.text = text
+        self.time = time.monotonic()
+
+
+class FakeBotApi:
+    """State of the fake Bot API: the registered webhook and the replies received."""
+
+    def __init__(self):
+        self.webhook: Dict[str, Any] = {}
+        self.webhook_set = threading.Event()
+        self.replies: List[Reply] = []
+        self.calls: Dict[str, int] = {}
+        self._cond = threading.Condition()
+        self._message_id = 0
+        self._update_id = 0
+
+    def call(self, method: str, params: Dict[str, str]) -> Any:
+        """Answer one Bot API method."""
+        with self._cond:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getMe":
+            return BOT_USER
+        if method == "setWebhook":
+            self.webhook = {
+                "url": params.get("url"),
+                "secret_token": params.get("secret_token"),
+                "allowed_updates": json.loads(params.get("allowed_updates", "null")),
+                "max_connections": params.get("max_connections"),
+            }
+            self.webhook_set.set()
+            return True
+        if method == "deleteWebhook":
+            self.webhook = {}
+            return True
+        if method == "getWebhookInfo":
+            return {"url": self.webhook.get("url", ""), "has_custom_certificate": False, "pending_update_count": 0}
+        if method.startswith("send") or method.startswith("edit"):
+            return self._record(method, params)
+        return True
+
+    def _record(self, method: str, params: Dict[str, str]) -> Dict[str, Any]:
+        """Store a reply and return the Message Telegram would return."""
+        chat_id = int(params.get("chat_id", 0))
+        text = params.get("text") or params.get("caption") or ""
+        with self._cond:
+            self._message_id += 1
+            message_id = self._message_id
+            self.replies.append(Reply(chat_id, method, text))
+            self._cond.notify_all()
+        message: Dict[str, Any] = {"message_id": message_id, "date": int(time.time()),
+                                   "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER}
+        if method == "sendPhoto":
+            message["photo"] = [{"file_id": f"photo-{message_id}", "file_unique_id": f"p{message_id}",
+                                 "width": 512, "height": 512}]
+        elif method == "sendDocument":
+            message["document"] = {"file_id": f"doc-{message_id}", "file_unique_id": f"d{message_id}"}
+        elif method == "sendAudio":
+            message["audio"] = {"file_id": f"audio-{message_id}", "file_unique_id": f"a{message_id}", "duration": 0}
+        else:
+            message["text"] = text
+        return message
+
+    def wait_reply(self, chat_id: int, after: float, timeout: float) -> Optional[Reply]:
+        """Wait for the first reply to a chat sent after a monotonic time."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                for reply in self.replies:
+                    if reply.chat_id == chat_id and reply.time >= after:
+                        return reply
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def wait_quiet(self, chat_id: int, after: float, quiet: float, timeout: float) -> List[Reply]:
+        """Collect the replies to a chat sent after a time, until none came for `quiet` seconds."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                replies = [reply for reply in self.replies if reply.chat_id == chat_id and reply.time >= after]
+                last = replies[-1].time if replies else after
+                wait = min(last + quiet, deadline) - time.monotonic()
+                if wait <= 0:
+                    return replies
+                self._cond.wait(wait)
+
+    def next_update_id(self) -> int:
+        with self._cond:
+            self._update_id += 1
+            return self._update_id
+
+
+def _params(handler: BaseHTTPRequestHandler, body: bytes) -> Dict[str, str]:
+    """Read the parameters of a Bot API call from the query string and the body."""
+    params = dict(parse_qsl(urlsplit(handler.path).query))
+    content_type = handler.headers.get("Content-Type", "")
+    if content_type.startswith("application/json") and body:
+        params.update({key: value if isinstance(value, str) else json.dumps(value)
+                       for key, value in json.loads(body).items()})
+    elif content_type.startswith("application/x-www-form-urlencoded"):
+        params.update(parse_qsl(body.decode()))
+    elif content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=policy.HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name and part.get_filename() is None:
+                params[name] = part.get_payload(decode=True).decode()
+    return params
+
+
+def make_handler(api: FakeBotApi):
+    """Return the request handler class of the fake Bot API server."""
+
+    class BotApiHandler(BaseHTTPRequestHandler):
+        def _answer(self) -> None:
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            parts = urlsplit(self.path).path.strip("/").split("/")
+            if len(parts) != 2 or parts[0] != f"bot{BOT_TOKEN}":
+                self._send(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                return
+            result = api.call(parts[1], _params(self, body))
+            self._send(200, {"ok": True, "result": result})
+
+        def _send(self, status: int, payload: Dict[str, Any]) -> None:
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = _answer
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return BotApiHandler
+
+
+def text_update(update_id: int, chat_id: int, text: str) -> Dict[str, Any]:
+    """Build a private text message update."""
+    user = {"id": chat_id, "is_bot": False, "first_name": f"User{chat_id}"}
+    message: Dict[str, Any] = {"message_id": update_id, "date": int(time.time()),
+                               "chat": {"id": chat_id, "type": "private"}, "from": user, "text": text}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def post_update(api: FakeBotApi, update: Dict[str, Any], secret: Optional[str] = None) -> int:
+    """POST an update to the registered webhook and return the HTTP status."""
+    request = urllib.request.Request(
+        api.webhook["url"], data=json.dumps(update).encode(), method="POST",
+        headers={"Content-Type": "application/json",
+                 SECRET_HEADER: api.webhook.get("secret_token") if secret is None else secret},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def deliver(api: FakeBotApi, chat_id: int, text: str, timeout: float) -> Tuple[int, Optional[Reply], float]:
+    """Send one message to the bot and wait for its first reply."""
+    started = time.monotonic()
+    status = post_update(api, text_update(api.next_update_id(), chat_id, text))
+    reply = api.wait_reply(chat_id, started, timeout) if status == 200 else None
+    return status, reply, time.monotonic() - started
+
+
+def start_bot(api_port: int, webhook_port: int, data_dir: str, workers: int, verbose: bool) -> subprocess.Popen:
+    """Start bot.py in webhook mode against the fake server."""
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN=BOT_TOKEN,
+        TELEGRAM_API_URL=f"http://127.0.0.1:{api_port}",
+        BOT_MODE="webhook",
+        WEBHOOK_URL=f"http://127.0.0.1:{webhook_port}",
+        WEBHOOK_LISTEN="127.0.0.1",
+        WEBHOOK_PORT=str(webhook_port),
+        JOB_DB=os.path.join(data_dir, "jobs.sqlite3"),
+        FILE_ID_DB=os.path.join(data_dir, "file_ids.sqlite3"),
+        LYRICS_DB=os.path.join(data_dir, "lyrics.sqlite3"),
+        RATES_HISTORY_LOG=os.path.join(data_dir, "rates_history.bin"),
+        STATE_DB=os.path.join(data_dir, "state.sqlite3"),
+        SCALE_WORKERS=str(workers),
+    )
+    env.pop("WEBHOOK_SECRET", None)
+    output = None if verbose else subprocess.DEVNULL
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, "bot.py")], env=env, cwd=ROOT,
+                            stdout=output, stderr=output)
+
+
+def kill_workers(bot: subprocess.Popen) -> int:
+    """Kill the worker processes of a scale-out bot; return how many were killed."""
+    killed = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The parent pid is the second field after the parenthesised command
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if parent == bot.pid:
+            os.kill(int(entry), signal.SIGKILL)
+            killed += 1
+    return killed
+
+
+def wait_for_webhook(api: FakeBotApi, timeout: float) -> None:
+    """Wait until the registered webhook accepts connections."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            post_update(api, text_update(0, 1, "/start"), secret="")
+            return
+        except urllib.error.URLError:
+            if time.monotonic() > deadline:
+                raise SystemExit(f"The webhook {api.webhook['url']} does not accept connections")
+            time.sleep(0.1)
+
+
+def run_checks(api: FakeBotApi, messages: List[str], burst: int, timeout: float, linger: float,
+               settle: float, kill_after_first: Optional[subprocess.Popen] = None) -> bool:
+    """Run the webhook checks and print their results; return True if all passed."""
+    ok = True
+    webhook = api.webhook
+    print(f"webhook: {webhook['url']} allowed_updates={webhook['allowed_updates']} "
+          f"max_connections={webhook['max_connections']}")
+    if not webhook.get("secret_token"):
+        print("FAIL no secret token was registered")
+        ok = False
+
+    for secret, label in (("", "missing"), ("wrong-secret", "wrong")):
+        status = post_update(api, text_update(api.next_update_id(), 1, "/start"), secret=secret)
+        passed = status == 403
+        ok = ok and passed
+        print(f"{'ok  ' if passed else 'FAIL'} update with a {label} secret token -> HTTP {status}")
+
+    for text in messages:
+        started = time.monotonic()
+        status, reply, elapsed = deliver(api, 1, text, timeout)
+        passed = reply is not None
+        ok = ok and passed
+        # Wait for the rest of the replies, so they are not taken for replies to the next message
+        replies = api.wait_quiet(1, started, settle, timeout) if passed else []
+        answer = " | ".join(r.text.splitlines()[0] if r.text else r.method for r in replies) or "no reply"
+        print(f"{'ok  ' if passed else 'FAIL'} {text!r} -> HTTP {status}, {elapsed * 1000:.0f} ms: {answer}")
+        if kill_after_first is not None:
+            print(f"     killed {kill_workers(kill_after_first)} worker process(es)")
+            kill_after_first = None
+
+    if burst:
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=min(burst, 32)) as pool:
+            results = list(pool.map(lambda chat_id: deliver(api, chat_id, "/start", timeout),
+                                    range(1000, 1000 + burst)))
+        total = time.monotonic() - started
+        latencies = sorted(elapsed for status, reply, elapsed in results if reply is not None)
+        answered = len(latencies)
+        passed = answered == burst
+        ok = ok and passed
+        if latencies:
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            print(f"{'ok  ' if passed else 'FAIL'} burst of {burst} /start from different users: "
+                  f"{answered} answered in {total:.2f}s, p50 {statistics.median(latencies) * 1000:.0f} ms, "
+                  f"p95 {p95 * 1000:.0f} ms")
+        else:
+            print(f"FAIL burst of {burst} /start: no replies")
+    # Later replies of the same update (e.g. the QR photo after its status message)
+    time.sleep(linger)
+    print(f"Bot API calls: {', '.join(f'{method} {count}' for method, count in sorted(api.calls.items()))}")
+    return ok
+
+
+def main() -> None:
+    """Start the fake server, optionally the bot, and run the checks."""
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--port", type=int, default=8081, help="port of the fake Bot API")
+    arg_parser.add_argument("--webhook-port", type=int, default=8443, help="webhook port of a bot started with --run-bot")
+    arg_parser.add_argument("--run-bot", action="store_true", help="start bot.py in webhook mode and stop it at the end")
+    arg_parser.add_argument("--workers", type=int, default=1,
+                            help="worker processes of a bot started with --run-bot (SCALE_WORKERS)")
+    arg_parser.add_argument("--kill-workers", action="store_true",
+                            help="kill the workers after the first --send message; they are restarted")
+    arg_parser.add_argument("--send", action="append", default=[], help="message to send (repeatable)")
+    arg_parser.add_argument("--burst", type=int, default=0, help="concurrent /start updates from different users")
+    arg_parser.add_argument("--settle", type=float, default=1.5,
+                            help="seconds without replies before the next --send message")
+    arg_parser.add_argument("--linger", type=float, default=2.0, help="seconds to wait for late replies at the end")
+    arg_parser.add_argument("--verbose", action="store_true", help="show the log output of a bot started with --run-bot")
+    arg_parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for each reply")
+    args = arg_parser.parse_args()
+
+    api = FakeBotApi()
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(api))
+    threading.Thread(target=server.serve_forever, name="fake-telegram", daemon=True).start()
+    print(f"Fake Bot API listening on http://127.0.0.1:{args.port} (token {BOT_TOKEN})")
+
+    bot = None
+    with tempfile.TemporaryDirectory(prefix="fake-telegram-") as data_dir:
+        try:
+            if args.run_bot:
+                bot = start_bot(args.port, args.webhook_port, data_dir, args.workers, args.verbose)
+            if not api.webhook_set.wait(60):
+                raise SystemExit("The bot did not call setWebhook")
+            # setWebhook is called before the webhook server accepts connections
+            wait_for_webhook(api, 30)
+            passed = run_checks(api, args.send or ["/start"], args.burst, args.timeout, args.linger, args.settle,
+                                kill_after_first=bot if args.kill_workers else None)
+        finally:
+            if bot is not None:
+                bot.send_signal(signal.SIGINT)
+                bot.wait(timeout=30)
+            server.shutdown()
+    raise SystemExit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
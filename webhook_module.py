@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Webhook Module for Telegram Bot
+- Settings of the webhook serving mode (BOT_MODE=webhook)
+- Secret token that Telegram must send with every update
+- Bot API base URL override, used to run against a local fake server
+"""
+
+import os
+import re
+import secrets
+import logging
+from typing import NamedTuple, Optional, Sequence
+
+from telegram.ext import Application, ApplicationBuilder
+
+logger = logging.getLogger(__name__)
+
+# "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+
+# Public base URL Telegram posts updates to, e.g. https://bot.example.com
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+# Address of the built-in HTTP server; usually behind a TLS-terminating proxy
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+# Random per start when unset; Telegram learns it through setWebhook
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Connections Telegram may open to the webhook at the same time (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Updates handled at the same time, in both modes (1 = one after another)
+CONCURRENT_UPDATES = max(1, int(os.getenv("CONCURRENT_UPDATES", "8")))
+
+# Bot API server, e.g. http://127.0.0.1:8081 for tools/fake_telegram.py
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+# Characters Telegram accepts in a secret token
+_SECRET_RE = re.compile(r"^[A-Za-z0-9_-]{1,256}$")
+
+
+class WebhookConfig(NamedTuple):
+    """Arguments of Application.run_webhook."""
+    listen: str
+    port: int
+    url_path: str
+    webhook_url: str
+    secret_token: str
+    max_connections: int
+
+
+def webhook_config() -> WebhookConfig:
+    """
+    Build the webhook settings from the environment.
+
+    Returns:
+        The validated settings
+
+    Raises:
+        ValueError: If WEBHOOK_URL is missing or WEBHOOK_SECRET is not a valid token
+    """
+    if not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL must be set when BOT_MODE=webhook")
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    if not _SECRET_RE.match(secret):
+        raise ValueError("WEBHOOK_SECRET may only contain A-Z, a-z, 0-9, _ and - (1-256 characters)")
+    return WebhookConfig(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=WEBHOOK_PATH,
+        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+        secret_token=secret,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+
+
+def use_api_server(builder: ApplicationBuilder, api_url: Optional[str] = TELEGRAM_API_URL) -> ApplicationBuilder:
+    """Point an ApplicationBuilder at TELEGRAM_API_URL, if it is set."""
+    if not api_url:
+        return builder
+    api_url = api_url.rstrip("/")
+    return builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+
+
+def run_webhook(application: Application, allowed_updates: Sequence[str]) -> None:
+    """
+    Serve updates on the built-in webhook server until the process is stopped.
+
+    The server answers 403 to any request without the secret token, so only
+    Telegram can deliver updates.
+    """
+    config = webhook_config()
+    logger.info(f"Serving webhook on {config.listen}:{config.port}/{config.url_path} for {config.webhook_url}")
+    application.run_webhook(allowed_updates=list(allowed_updates), **config._asdict())
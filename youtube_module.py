@@ -8,12 +8,158 @@ YouTube Download Module for Telegram Bot
 """
 
 import os
+import re
+import time
+import logging
+import subprocess
+import threading
 import yt_dlp
-from typing import List, Dict, Any, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 
-# Temporary directory for downloads
-TEMP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "temp")
-os.makedirs(TEMP_DIR, exist_ok=True)
+from cache_module import DiskLRUStore
+from storage_module import STORAGE, TEMP_DIR
+
+logger = logging.getLogger(__name__)
+
+# Downloaded songs, keyed by video id and audio format, evicted by total size
+AUDIO_CACHE_DIR = os.path.join(TEMP_DIR, "audio_cache")
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MB", "2048")) * 1024 * 1024
+AUDIO_CACHE = DiskLRUStore(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES)
+
+# Matches the 11-character video id in watch, short, embed and youtu.be URLs
+_VIDEO_ID_RE = re.compile(
+    r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/)|youtu\.be/)([A-Za-z0-9_-]{11})"
+)
+
+def extract_video_id(url: str) -> Optional[str]:
+    """
+    Extract the YouTube video id from a URL without any network access.
+
+    Args:
+        url: YouTube URL
+
+    Returns:
+        The video id, or None if the URL is not a recognised YouTube link
+    """
+    match = _VIDEO_ID_RE.search(url)
+    return match.group(1) if match else None
+
+# Options of the long-lived search extractors
+_SEARCH_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'format': 'bestaudio/best',
+    'noplaylist': True,
+    'extract_flat': True,
+    'default_search': 'ytsearch',
+}
+
+class YouTubeSearchService:
+    """
+    YouTube search with warm extractors and a stale-while-revalidate cache.
+
+    Each worker thread keeps its own YoutubeDL instance, created once, since
+    YoutubeDL is not thread-safe. Results are cached per normalized query:
+    fresh entries are returned as they are, older entries are returned right
+    away while a background refresh fetches new results, and expired entries
+    are fetched again before returning.
+    """
+
+    def __init__(self, ttl: float, refresh_after: float, max_entries: int):
+        """
+        Args:
+            ttl: Seconds after which a cached result is no longer returned
+            refresh_after: Seconds after which a cached result is refreshed in the background
+            max_entries: Number of queries kept in the cache
+        """
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._cache: "OrderedDict[Tuple[str, int], Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-refresh")
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Normalize a query so trivially different spellings share a cache entry."""
+        return " ".join(query.lower().split())
+
+    def _extractor(self) -> yt_dlp.YoutubeDL:
+        """Return the YoutubeDL instance of the current thread."""
+        ydl = getattr(self._local, 'ydl', None)
+        if ydl is None:
+            ydl = self._local.ydl = yt_dlp.YoutubeDL(_SEARCH_OPTS)
+        return ydl
+
+    def warm_up(self) -> None:
+        """Create the current thread's extractor and load the search extractor class."""
+        self._extractor().get_info_extractor('YoutubeSearch')
+
+    def _fetch(self, query: str, max_results: int) -> List[Dict[str, Any]]:
+        """Run a ytsearch extraction and convert its entries."""
+        search_results = self._extractor().extract_info(f"ytsearch{max_results}:{query}", download=False)
+
+        videos = []
+        if 'entries' in search_results:
+            for entry in search_results['entries']:
+                videos.append({
+                    'id': entry.get('id', ''),
+                    'title': entry.get('title', 'Unknown Title'),
+                    'url': f"https://www.youtube.com/watch?v={entry.get('id', '')}",
+                    'duration': entry.get('duration', 0),
+                    'uploader': entry.get('uploader', 'Unknown Uploader'),
+                })
+        return videos
+
+    def _store(self, key: Tuple[str, int], videos: List[Dict[str, Any]]) -> None:
+        """Insert a result in the cache, evicting the least recently used entries."""
+        with self._lock:
+            self._cache[key] = (time.monotonic(), videos)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _refresh(self, key: Tuple[str, int]) -> None:
+        """Fetch new results for a cached query in the background."""
+        try:
+            self._store(key, self._fetch(*key))
+        except Exception as e:
+            logger.warning(f"Background search refresh failed for {key[0]!r}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def search(self, query: str, max_results: int) -> List[Dict[str, Any]]:
+        """Search YouTube, answering from the cache when possible."""
+        key = (self.normalize(query), max_results)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                if now - entry[0] >= self.refresh_after and key not in self._refreshing:
+                    self._refreshing.add(key)
+                    self._refresher.submit(self._refresh, key)
+                return [dict(video) for video in entry[1]]
+            self.misses += 1
+
+        videos = self._fetch(*key)
+        self._store(key, videos)
+        return [dict(video) for video in videos]
+
+SEARCH_SERVICE = YouTubeSearchService(
+    ttl=float(os.getenv("SEARCH_CACHE_TTL", str(6 * 3600))),
+    refresh_after=float(os.getenv("SEARCH_REFRESH_AFTER", "1800")),
+    max_entries=int(os.getenv("SEARCH_CACHE_SIZE", "1000")),
+)
 
 def search_youtube(query: str, max_results: int = 3) -> List[Dict[str, str]]:
     """
@@ -26,57 +172,143 @@ def search_youtube(query: str, max_results: int = 3) -> List[Dict[str, str]]:
     Returns:
         List of dictionaries with video information
     """
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': True,
+    return SEARCH_SERVICE.search(query, max_results)
+
+def warm_up_search() -> None:
+    """Prepare the search extractor of the calling worker thread."""
+    SEARCH_SERVICE.warm_up()
+
+# Audio format tiers:
+# - fast: best AAC (or Opus) stream, remuxed without transcoding
+# - compatible: 192 kbps MP3, playable everywhere
+# - small: low-bitrate Opus, copied as-is when YouTube serves one
+AUDIO_TIERS = {
+    'fast': {
+        'format': 'bestaudio[acodec^=mp4a]/bestaudio[acodec=opus]/bestaudio/best',
+        'codec': 'best',
+        'quality': None,
+        'ffmpeg_args': None,
+    },
+    'compatible': {
         'format': 'bestaudio/best',
-        'noplaylist': True,
-        'extract_flat': True,
-        'default_search': 'ytsearch',
-    }
-    
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        search_results = ydl.extract_info(f"ytsearch{max_results}:{query}", download=False)
-        
-    videos = []
-    if 'entries' in search_results:
-        for entry in search_results['entries']:
-            videos.append({
-                'id': entry.get('id', ''),
-                'title': entry.get('title', 'Unknown Title'),
-                'url': f"https://www.youtube.com/watch?v={entry.get('id', '')}",
-                'duration': entry.get('duration', 0),
-                'uploader': entry.get('uploader', 'Unknown Uploader'),
-            })
-    
-    return videos
+        'codec': 'mp3',
+        'quality': '192',
+        'ffmpeg_args': ['-c:a', 'libmp3lame', '-b:a', '192k'],
+    },
+    'small': {
+        'format': 'bestaudio[acodec=opus][abr<=80]/worstaudio[acodec=opus]/bestaudio/best',
+        'codec': 'opus',
+        'quality': '64',
+        'ffmpeg_args': ['-c:a', 'libopus', '-b:a', '64k'],
+    },
+}
+DEFAULT_AUDIO_TIER = os.getenv("AUDIO_TIER", "fast")
+
+def _audio_cache_key(video_id: str, tier: str) -> str:
+    """Return the cache key of one audio tier of a video."""
+    return f"{video_id}-{tier}"
+
+def audio_extension(file_path: str) -> str:
+    """Return the audio file extension (e.g. "m4a") of a cached song."""
+    return AUDIO_CACHE.get_meta(os.path.basename(file_path)).get('ext', 'mp3')
+
+def cached_audio(video_id: str, tier: str = DEFAULT_AUDIO_TIER) -> Optional[Tuple[str, str]]:
+    """
+    Look up a previously downloaded song in the audio cache.
+
+    Args:
+        video_id: YouTube video id
+        tier: Audio format tier of the cached file
+
+    Returns:
+        Tuple of (file_path, title), or None on a cache miss
+    """
+    key = _audio_cache_key(video_id, tier)
+    file_path = AUDIO_CACHE.get_path(key)
+    if file_path is None:
+        return None
+    return file_path, AUDIO_CACHE.get_meta(key).get('title', 'Unknown Title')
+
+def _transcode_cached(video_id: str, tier: str, work_dir: str) -> Optional[Tuple[str, str]]:
+    """
+    Build a tier from the cached "fast" variant with a local ffmpeg run.
+
+    Returns:
+        Tuple of (file_path, title), or None if there is no fast variant
+    """
+    source = cached_audio(video_id, 'fast')
+    if source is None:
+        return None
+    source_path, title = source
+
+    spec = AUDIO_TIERS[tier]
+    ext = spec['codec']
+    output = os.path.join(work_dir, f"{video_id}.{ext}")
+    subprocess.run(
+        ['ffmpeg', '-nostdin', '-v', 'error', '-y', '-i', source_path, '-vn', *spec['ffmpeg_args'], output],
+        check=True,
+    )
+    key = _audio_cache_key(video_id, tier)
+    return AUDIO_CACHE.put_file(key, output, meta={'title': title, 'ext': ext}), title
 
-def download_youtube_audio(url: str) -> Tuple[str, str]:
+def download_youtube_audio(url: str, tier: str = DEFAULT_AUDIO_TIER) -> Tuple[str, str]:
     """
     Download audio from a YouTube URL.
-    
+
+    Songs are kept in the audio cache per tier; the returned file belongs to
+    the cache and must not be deleted by the caller. A cache hit skips yt-dlp
+    and ffmpeg, and a missing tier is transcoded from the cached "fast"
+    variant when there is one, without downloading again.
+
     Args:
         url: YouTube URL
-        
+        tier: Audio format tier ("fast", "compatible" or "small")
+
     Returns:
         Tuple of (file_path, title)
     """
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'postprocessors': [{
+    if tier not in AUDIO_TIERS:
+        raise ValueError(f"Unknown audio tier: {tier}")
+    spec = AUDIO_TIERS[tier]
+
+    video_id = extract_video_id(url)
+    if video_id:
+        hit = cached_audio(video_id, tier)
+        if hit is not None:
+            return hit
+
+    # Work in a private directory so concurrent jobs never share files
+    with STORAGE.workspace('download') as work_dir:
+        if video_id and tier != 'fast':
+            transcoded = _transcode_cached(video_id, tier, work_dir)
+            if transcoded is not None:
+                return transcoded
+
+        postprocessor = {
             'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'outtmpl': os.path.join(TEMP_DIR, '%(title)s.%(ext)s'),
-        'quiet': True,
-        'no_warnings': True,
-    }
-    
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=True)
-        title = info.get('title', 'Unknown Title')
-        file_path = os.path.join(TEMP_DIR, f"{title}.mp3")
-        
-    return file_path, title
+            'preferredcodec': spec['codec'],
+        }
+        if spec['quality']:
+            postprocessor['preferredquality'] = spec['quality']
 
+        ydl_opts = {
+            'format': spec['format'],
+            'postprocessors': [postprocessor],
+            'outtmpl': os.path.join(work_dir, '%(id)s.%(ext)s'),
+            'quiet': True,
+            'no_warnings': True,
+        }
+
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=True)
+            title = info.get('title', 'Unknown Title')
+            video_id = info.get('id') or video_id
+            # The final path after post-processing (extension depends on the tier)
+            downloaded = info['requested_downloads'][0]['filepath']
+
+        # Move the finished file into the cache atomically
+        key = _audio_cache_key(video_id, tier)
+        ext = os.path.splitext(downloaded)[1].lstrip('.') or 'mp3'
+        file_path = AUDIO_CACHE.put_file(key, downloaded, meta={'title': title, 'ext': ext})
+
+    return file_path, title